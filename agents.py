@@ -1,5 +1,7 @@
-from entities import RectangleEntity, CircleEntity, RingEntity
+import numpy as np
+from entities import RectangleEntity, CircleEntity, RingEntity, CARS, PEDESTRIANS, BUILDINGS, DECORATIONS, _Field
 from geometry import Point
+import dynamics
 
 # For colors, we use tkinter colors. See http://www.science.smith.edu/dftwiki/index.php/Color_Charts_for_TKinter
 
@@ -11,6 +13,8 @@ class Car(RectangleEntity):
         super(Car, self).__init__(center, heading, size, movable, friction)
         self.color = color
         self.collidable = True
+        self.category = CARS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
         
 class Pedestrian(CircleEntity):
     def __init__(self, center: Point, heading: float, color: str = 'LightSalmon3'): # after careful consideration, I decided my color is the same as a salmon, so here we go.
@@ -20,6 +24,24 @@ class Pedestrian(CircleEntity):
         super(Pedestrian, self).__init__(center, heading, radius, movable, friction)
         self.color = color
         self.collidable = True
+        self.category = PEDESTRIANS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
+        
+class RailCar(Car):
+    # A car that follows a road.Lane at a given speed, s meters from its start and offset meters to its left. The World
+    # moves all of them at once, see dynamics.RailDynamics. Its controls are ignored.
+    s = _Field(dynamics.S)
+    offset = _Field(dynamics.OFFSET)
+    rail_speed = _Field(dynamics.RAIL_SPEED)
+    
+    def __init__(self, lane, s: float = 0., speed: float = 0., offset: float = 0., color: str = 'red'):
+        points, headings = lane.position(s, offset)
+        super(RailCar, self).__init__(Point(*points[0]), float(headings[0]) % (2*np.pi), color)
+        self.lane = lane
+        self.s = s
+        self.offset = offset
+        self.rail_speed = speed
+        self.velocity = Point(speed * np.cos(self.heading), speed * np.sin(self.heading))
         
 class RectangleBuilding(RectangleEntity):
     def __init__(self, center: Point, size: Point, color: str = 'gray26'):
@@ -29,6 +51,8 @@ class RectangleBuilding(RectangleEntity):
         super(RectangleBuilding, self).__init__(center, heading, size, movable, friction)
         self.color = color
         self.collidable = True
+        self.category = BUILDINGS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
         
 class CircleBuilding(CircleEntity):
     def __init__(self, center: Point, radius: float, color: str = 'gray26'):
@@ -38,6 +62,8 @@ class CircleBuilding(CircleEntity):
         super(CircleBuilding, self).__init__(center, heading, radius, movable, friction)
         self.color = color
         self.collidable = True
+        self.category = BUILDINGS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
 
 class RingBuilding(RingEntity):
     def __init__(self, center: Point, inner_radius: float, outer_radius: float, color: str = 'gray26'):
@@ -47,6 +73,8 @@ class RingBuilding(RingEntity):
         super(RingBuilding, self).__init__(center, heading, inner_radius, outer_radius, movable, friction)
         self.color = color
         self.collidable = True
+        self.category = BUILDINGS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
 
 class Painting(RectangleEntity):
     def __init__(self, center: Point, size: Point, color: str = 'gray26', heading: float = 0.):
@@ -55,3 +83,5 @@ class Painting(RectangleEntity):
         super(Painting, self).__init__(center, heading, size, movable, friction)
         self.color = color
         self.collidable = False
+        self.category = DECORATIONS
+        self.mask = 0 # only drawn, it never collides
@@ -0,0 +1,173 @@
+import numpy as np
+import time
+import sys
+from world import World
+from agents import Car, Pedestrian, RectangleBuilding
+from geometry import Point
+from road import Lane
+from traffic import IDMTraffic
+from crowd import SocialForceCrowd
+
+# Simple timing scripts for the simulator. Run e.g.
+#	python benchmarks.py collision
+# Every benchmark prints one line per problem size.
+
+def timeit(f, repeats: int = 5) -> float: # returns the best wall-clock time of f() in seconds
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def car_grid_world(num_cars: int, spacing: float = 8., dt: float = 0.1, broadphase: str = 'grid') -> World:
+    # Cars are placed on a square grid with constant density, with a building in every other cell, so that nothing collides
+    n = int(np.ceil(np.sqrt(num_cars)))
+    w = World(dt, width = n * spacing, height = n * spacing, broadphase = broadphase)
+    rng = np.random.default_rng(0)
+    for k in range(num_cars):
+        i, j = divmod(k, n)
+        car = Car(Point((i + 0.5) * spacing, (j + 0.5) * spacing), rng.uniform(0, 2*np.pi))
+        car.set_control(0, 0.1)
+        w.add(car)
+        if (i + j) % 2 == 0:
+            w.add(RectangleBuilding(Point((i + 1) * spacing, (j + 1) * spacing), Point(1., 1.)))
+    return w
+
+def collision(sizes = (10, 100, 500, 1000, 2000, 5000)):
+    print('num_cars | collision_exists() (ms) | per car (us)')
+    for num_cars in sizes:
+        w = car_grid_world(num_cars)
+        def step():
+            w._dynamic_shapes = None # force the broad phase to be rebuilt, like after a tick
+            w._contacts = None
+            w.collision_exists()
+        t = timeit(step)
+        print('%8d | %24.2f | %12.2f' % (num_cars, 1e3 * t, 1e6 * t / num_cars))
+
+def static_collision(sizes = (100, 1000, 5000, 20000), num_cars: int = 100):
+    print('num_buildings | collision_exists() (ms)')
+    rng = np.random.default_rng(0)
+    for num_buildings in sizes:
+        w = World(0.1, width = 1000, height = 1000)
+        for _ in range(num_buildings):
+            w.add(RectangleBuilding(Point(*rng.uniform(0, 1000, 2)), Point(*rng.uniform(0.5, 3., 2))))
+        for _ in range(num_cars):
+            w.add(Car(Point(*rng.uniform(0, 1000, 2)), rng.uniform(0, 2*np.pi)))
+        w.collision_exists() # the static BVH is built here, once
+        def step():
+            w._dynamic_shapes = None
+            w._contacts = None
+            w.collision_exists()
+        print('%13d | %23.2f' % (num_buildings, 1e3 * timeit(step)))
+
+def tick(sizes = (500,), ticks: int = 20):
+    print('num_cars | ticks per second | tick + collision_exists() per second')
+    for num_cars in sizes:
+        w = car_grid_world(num_cars)
+        def run_ticks():
+            for _ in range(ticks): w.tick()
+        def run_ticks_and_collisions():
+            for _ in range(ticks):
+                w.tick()
+                w.collision_exists()
+        print('%8d | %16.1f | %36.1f' % (num_cars, ticks / timeit(run_ticks, 3), ticks / timeit(run_ticks_and_collisions, 3)))
+
+def sleep(sizes = (1000, 5000), moving: float = 0.1, ticks: int = 20):
+    # A parking lot: only a fraction of the cars drive, the others are parked and fall asleep after a few ticks
+    print('num_cars | batched | no sleeping: tick + collision_exists() (ms) | sleeping (ms) | sleeping agents')
+    for num_cars in sizes:
+        for batched in (False, True):
+            times = []
+            for sleep_ticks in (0, 10):
+                n = int(np.ceil(np.sqrt(num_cars)))
+                w = World(0.1, width = n * 8., height = n * 8., batched = batched, sleep_ticks = sleep_ticks)
+                rng = np.random.default_rng(0)
+                for k in range(num_cars):
+                    i, j = divmod(k, n)
+                    car = Car(Point((i + 0.5) * 8., (j + 0.5) * 8.), rng.uniform(0, 2*np.pi))
+                    if rng.uniform() < moving: car.set_control(0, 0.1)
+                    w.add(car)
+                for _ in range(sleep_ticks + 1): w.tick()
+                def run():
+                    for _ in range(ticks):
+                        w.tick()
+                        w.collision_exists()
+                times.append(1e3 * timeit(run, 3) / ticks)
+            print('%8d | %7s | %42.2f | %13.2f | %15d' % (num_cars, batched, times[0], times[1], w.num_sleeping))
+
+def broadphase(sizes = (100, 1000, 5000), ticks: int = 20):
+    print('num_cars | grid: tick + collision_exists() (ms) | sap: tick + collision_exists() (ms)')
+    for num_cars in sizes:
+        times = []
+        for method in ['grid', 'sap']:
+            w = car_grid_world(num_cars, broadphase = method)
+            w.collision_exists()
+            def run():
+                for _ in range(ticks):
+                    w.tick()
+                    w.collision_exists()
+            times.append(1e3 * timeit(run, 3) / ticks)
+        print('%8d | %36.2f | %35.2f' % (num_cars, times[0], times[1]))
+
+TRAFFIC_BUDGET = 10. # ms per tick for IDMTraffic.update() + World.tick(), at every size of the traffic benchmark
+
+def traffic(sizes = (100, 1000, 5000), ticks: int = 20, spacing: float = 12.):
+    # IDM cars on concentric ring roads, spacing meters apart, in a batched world
+    print('num_cars | update() (ms) | tick() (ms) | within %.0f ms budget' % TRAFFIC_BUDGET)
+    for num_cars in sizes:
+        num_lanes = int(np.ceil(num_cars * spacing / (2 * np.pi * 500.)))
+        radii = 100. + 4. * np.arange(num_lanes)
+        per_lane = np.round(num_cars * radii / np.sum(radii)).astype(int)
+        per_lane[-1] += num_cars - np.sum(per_lane)
+        w = World(0.1, width = 2 * radii[-1] + 20, height = 2 * radii[-1] + 20, batched = True)
+        center = Point(radii[-1] + 10, radii[-1] + 10)
+        traffic = IDMTraffic()
+        for radius, n in zip(radii, per_lane):
+            lane = Lane.circle(center, radius, cell_size = 4.)
+            points, headings = lane.position(np.arange(n) * lane.length / n)
+            for p, h in zip(points, headings):
+                car = Car(Point(*p), h % (2*np.pi))
+                w.add(car)
+                traffic.add(car, lane)
+        def run_updates():
+            for _ in range(ticks): traffic.update(w.dt)
+        def run_ticks():
+            for _ in range(ticks): w.tick()
+        update_time = 1e3 * timeit(run_updates, 3) / ticks
+        tick_time = 1e3 * timeit(run_ticks, 3) / ticks
+        print('%8d | %13.2f | %11.2f | %s' % (num_cars, update_time, tick_time, 'yes' if update_time + tick_time <= TRAFFIC_BUDGET else 'NO'))
+
+CROWD_BUDGET = 10. # ms per tick for SocialForceCrowd.update() + World.tick(), at every size of the crowd benchmark
+
+def crowd(sizes = (100, 1000, 3000), ticks: int = 20, spacing: float = 1.5):
+    # Two blocks of pedestrians, spacing meters apart, walking through each other in a batched world
+    print('num_pedestrians | update() (ms) | tick() (ms) | within %.0f ms budget' % CROWD_BUDGET)
+    for num_pedestrians in sizes:
+        side = int(np.ceil(np.sqrt(num_pedestrians / 2.)))
+        width = 4 * side * spacing
+        w = World(0.1, width = width, height = side * spacing + 20, batched = True)
+        crowd = SocialForceCrowd()
+        for k in range(num_pedestrians):
+            block, i, j = k % 2, (k // 2) % side, k // (2 * side)
+            y = 10 + i * spacing + block * spacing / 2.
+            start, goal = Point(10 + j * spacing, y), Point(width - 10 - j * spacing, y)
+            if block: start, goal = goal, start
+            pedestrian = Pedestrian(start, np.pi * block)
+            w.add(pedestrian)
+            crowd.add(pedestrian, goal)
+        def run_updates():
+            for _ in range(ticks): crowd.update(w.dt)
+        def run_ticks():
+            for _ in range(ticks): w.tick()
+        update_time = 1e3 * timeit(run_updates, 3) / ticks
+        tick_time = 1e3 * timeit(run_ticks, 3) / ticks
+        print('%15d | %13.2f | %11.2f | %s' % (num_pedestrians, update_time, tick_time, 'yes' if update_time + tick_time <= CROWD_BUDGET else 'NO'))
+
+BENCHMARKS = {'collision': collision, 'static_collision': static_collision, 'tick': tick, 'sleep': sleep, 'broadphase': broadphase, 'traffic': traffic, 'crowd': crowd}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS.keys())
+    for name in names:
+        print('== ' + name)
+        BENCHMARKS[name]()
@@ -0,0 +1,287 @@
+import numpy as np
+
+# Broad phase structures. They only work with axis-aligned bounding boxes given as an (N, 4) array
+# of [xmin, ymin, xmax, ymax] rows and return candidate index pairs. The exact test is left to the narrow phase.
+
+
+def aabb_overlap(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    return (A[..., 0] <= B[..., 2]) & (B[..., 0] <= A[..., 2]) & (A[..., 1] <= B[..., 3]) & (B[..., 1] <= A[..., 3])
+
+
+def layers_overlap(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    # A and B hold [category, mask] bit fields (see entities.py). Two entities can only collide if each one's category is in the other's mask
+    return ((A[..., 0] & B[..., 1]) != 0) & ((B[..., 0] & A[..., 1]) != 0)
+
+
+def neighbour_pairs(P: np.ndarray, radius: float):
+    # Returns (I, J) with I < J for every pair of the (N, 2) points P closer than radius. This is a grid too, but for points:
+    # every point is in exactly one cell of size radius and only looks at its own cell and 4 of its 8 neighbours, so every
+    # pair comes up once and there is nothing to deduplicate. Cells are numbered densely over the bounding box, no hashing.
+    n = len(P)
+    if n == 0: return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    cells = np.floor(P / radius).astype(np.int64)
+    cells -= cells.min(axis=0) - 1 # a margin of one cell all around, so that the neighbours of a cell never wrap
+    height = cells[:, 1].max() + 2
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    I, J = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        neighbours = keys + dx * height + dy
+        left = np.searchsorted(sorted_keys, neighbours, side='left')
+        counts = np.searchsorted(sorted_keys, neighbours, side='right') - left
+        q = np.repeat(np.arange(n), counts)
+        i = order[np.repeat(left, counts) + np.arange(len(q)) - np.repeat(np.cumsum(counts) - counts, counts)]
+        if dx == dy == 0: q, i = q[q < i], i[q < i] # the same cell, both ways
+        I.append(q)
+        J.append(i)
+    I = np.concatenate(I)
+    J = np.concatenate(J)
+    close = np.sum((P[I] - P[J]) ** 2, axis=1) < radius ** 2
+    return np.minimum(I, J)[close], np.maximum(I, J)[close]
+
+
+class SpatialHash:
+    def __init__(self, cell_size: float = 10., max_cells: int = 256):
+        self.cell_size = cell_size
+        self.max_cells = max_cells # entities covering more cells than this are not hashed, they are tested against everything instead
+        self.build(np.zeros((0, 4)))
+
+    def _cell_range(self, aabbs: np.ndarray):
+        lo = np.floor(aabbs[:, :2] / self.cell_size).astype(np.int64)
+        hi = np.floor(aabbs[:, 2:] / self.cell_size).astype(np.int64)
+        return lo, hi
+
+    @staticmethod
+    def _keys(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+        # Hash collisions only add candidates, they never remove any
+        return ix * 73856093 ^ iy * 19349663
+
+    def _expand(self, lo: np.ndarray, hi: np.ndarray):
+        # Returns (entity index, cell key) for every cell covered by every entity
+        widths = hi[:, 0] - lo[:, 0] + 1
+        counts = widths * (hi[:, 1] - lo[:, 1] + 1)
+        ids = np.repeat(np.arange(len(lo)), counts)
+        k = np.arange(len(ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        ix = lo[ids, 0] + k % widths[ids]
+        iy = lo[ids, 1] + k // widths[ids]
+        return ids, self._keys(ix, iy)
+
+    def build(self, aabbs: np.ndarray):
+        self.aabbs = aabbs
+        lo, hi = self._cell_range(aabbs)
+        counts = np.prod(hi - lo + 1, axis=1)
+        self.oversized = np.where(counts > self.max_cells)[0]
+        regular = np.where(counts <= self.max_cells)[0]
+        ids, keys = self._expand(lo[regular], hi[regular])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.ids = regular[ids[order]]
+
+    def pairs(self):
+        # Returns (I, J) with I < J for every pair of entities that share a cell and whose AABBs overlap
+        I = [np.zeros(0, dtype=int)]
+        J = [np.zeros(0, dtype=int)]
+        offset = 1
+        while offset < len(self.keys):
+            same = self.keys[offset:] == self.keys[:-offset]
+            if not np.any(same): break # cells are contiguous after sorting, so no cell has more than offset entities
+            I.append(self.ids[:-offset][same])
+            J.append(self.ids[offset:][same])
+            offset += 1
+        n = len(self.aabbs)
+        for i in self.oversized:
+            I.append(np.full(n, i))
+            J.append(np.arange(n))
+        I = np.concatenate(I)
+        J = np.concatenate(J)
+        I, J = np.minimum(I, J), np.maximum(I, J)
+        codes = np.unique(I[I != J] * n + J[I != J])
+        I, J = codes // n, codes % n
+        keep = aabb_overlap(self.aabbs[I], self.aabbs[J])
+        return I[keep], J[keep]
+
+    def query(self, aabbs: np.ndarray):
+        # Returns (Q, I) such that aabbs[Q[k]] overlaps self.aabbs[I[k]], for every such pair
+        lo, hi = self._cell_range(aabbs)
+        small = np.prod(hi - lo + 1, axis=1) <= self.max_cells
+        q, keys = self._expand(lo[small], hi[small])
+        q = np.where(small)[0][q]
+        left = np.searchsorted(self.keys, keys, side='left')
+        counts = np.searchsorted(self.keys, keys, side='right') - left
+        Q = np.repeat(q, counts)
+        local = np.arange(len(Q)) - np.repeat(np.cumsum(counts) - counts, counts)
+        I = self.ids[np.repeat(left, counts) + local]
+        # Boxes that cover too many cells, and the entities that were not hashed, are paired with everything
+        large = np.where(~small)[0]
+        Q = np.concatenate([Q, np.repeat(large, len(self.aabbs)), np.tile(np.arange(len(aabbs)), len(self.oversized))])
+        I = np.concatenate([I, np.tile(np.arange(len(self.aabbs)), len(large)), np.repeat(self.oversized, len(aabbs))])
+        # An entity spanning several cells shows up once per shared cell
+        codes = np.unique(Q * max(len(self.aabbs), 1) + I)
+        Q, I = codes // max(len(self.aabbs), 1), codes % max(len(self.aabbs), 1)
+        keep = aabb_overlap(aabbs[Q], self.aabbs[I])
+        return Q[keep], I[keep]
+
+    def update(self, aabbs: np.ndarray):
+        # Same entities as the last build, new boxes. Nothing to reuse for a hash, so it is rebuilt
+        self.build(aabbs)
+
+
+class SweepAndPrune:
+    # Sorted endpoint lists on x and y plus the set of pairs whose AABBs overlap. Between two updates the entities
+    # only move a little, so the lists are nearly sorted: update() re-sorts them with insertion sort and fixes the
+    # pair set from the swaps it makes, instead of starting from scratch.
+    def __init__(self):
+        self.build(np.zeros((0, 4)))
+
+    def _values(self, codes: np.ndarray, axis: int) -> np.ndarray:
+        # Endpoint code 2*i is the min of entity i, and 2*i + 1 is its max
+        return self.aabbs[codes // 2, axis + 2 * (codes % 2)]
+
+    def build(self, aabbs: np.ndarray):
+        self.aabbs = aabbs
+        self._x_order = None
+        n = len(aabbs)
+        self.endpoints = []
+        for axis in range(2):
+            codes = np.arange(2 * n)
+            order = np.lexsort((codes % 2, self._values(codes, axis))) # at equal values, mins come before maxes
+            self.endpoints.append(codes[order].tolist())
+            
+        # Initial pairs with one vectorized sweep along x: entity j overlaps entity i on x if min_i <= min_j <= max_i
+        order = np.argsort(aabbs[:, 0], kind='stable')
+        sorted_mins = aabbs[order, 0]
+        position = np.empty(n, dtype=int)
+        position[order] = np.arange(n)
+        counts = np.maximum(np.searchsorted(sorted_mins, aabbs[:, 2], side='right') - position - 1, 0)
+        I = np.repeat(np.arange(n), counts)
+        local = np.arange(len(I)) - np.repeat(np.cumsum(counts) - counts, counts)
+        J = order[np.repeat(position + 1, counts) + local]
+        keep = aabb_overlap(aabbs[I], aabbs[J])
+        self.overlapping = set(zip(np.minimum(I, J)[keep].tolist(), np.maximum(I, J)[keep].tolist()))
+
+    def update(self, aabbs: np.ndarray):
+        # aabbs must describe the same entities, in the same order, as in the last build()
+        if len(aabbs) != len(self.aabbs): return self.build(aabbs)
+        self.aabbs = aabbs
+        self._boxes = None
+        self._x_order = None
+        for axis in range(2):
+            self._insertion_sort(axis)
+
+    def _insertion_sort(self, axis: int):
+        codes = self.endpoints[axis]
+        values = self._values(np.array(codes, dtype=int), axis)
+        # Only the endpoints that are smaller than something before them have to move
+        running_max = np.maximum.accumulate(values)
+        to_move = np.nonzero(values[1:] <= running_max[:-1])[0] + 1
+        if len(to_move) == 0: return
+        values = values.tolist()
+        if self._boxes is None: self._boxes = self.aabbs.tolist()
+        boxes = self._boxes
+        for k in to_move:
+            code, value = codes[k], values[k]
+            j = k
+            while j > 0 and (values[j-1] > value or (values[j-1] == value and codes[j-1] % 2 > code % 2)):
+                other = codes[j-1]
+                a, b = code // 2, other // 2
+                pair = (min(a, b), max(a, b))
+                if code % 2 == 0 and other % 2 == 1: # a min moved before a max, the two might overlap now
+                    A, B = boxes[a], boxes[b]
+                    if A[0] <= B[2] and B[0] <= A[2] and A[1] <= B[3] and B[1] <= A[3]:
+                        self.overlapping.add(pair)
+                elif code % 2 == 1 and other % 2 == 0: # a max moved before a min, the two are separated on this axis
+                    self.overlapping.discard(pair)
+                codes[j] = other
+                values[j] = values[j-1]
+                j -= 1
+            codes[j] = code
+            values[j] = value
+
+    def pairs(self):
+        # Returns (I, J) with I < J for every pair of entities whose AABBs overlap
+        P = np.array(list(self.overlapping), dtype=int).reshape(-1, 2)
+        return P[:, 0], P[:, 1]
+
+    def query(self, aabbs: np.ndarray):
+        # Returns (Q, I) such that aabbs[Q[k]] overlaps self.aabbs[I[k]], for every such pair. The entities come sorted
+        # by min x in the endpoint list: the ones that can overlap a query box on x have their min x between its min x
+        # minus the widest entity and its max x, a range found by binary search.
+        if self._x_order is None:
+            codes = np.array(self.endpoints[0], dtype=int)
+            self._x_order = codes[codes % 2 == 0] // 2
+            self._x_mins = self.aabbs[self._x_order, 0]
+            self._max_width = float(np.max(self.aabbs[:, 2] - self.aabbs[:, 0])) if len(self.aabbs) > 0 else 0.
+        lo = np.searchsorted(self._x_mins, aabbs[:, 0] - self._max_width, side='left')
+        counts = np.maximum(np.searchsorted(self._x_mins, aabbs[:, 2], side='right') - lo, 0)
+        Q = np.repeat(np.arange(len(aabbs)), counts)
+        I = self._x_order[np.repeat(lo, counts) + np.arange(len(Q)) - np.repeat(np.cumsum(counts) - counts, counts)]
+        keep = aabb_overlap(aabbs[Q], self.aabbs[I])
+        return Q[keep], I[keep]
+
+
+class BVH:
+    # Bounding volume hierarchy over a fixed set of AABBs (e.g. the static agents of a World).
+    # The tree is stored in flat arrays so that many AABBs can be queried at once, one tree level per iteration.
+    def __init__(self, leaf_size: int = 4):
+        self.leaf_size = leaf_size
+        self.build(np.zeros((0, 4)))
+
+    def build(self, aabbs: np.ndarray):
+        self.aabbs = aabbs
+        self.order = np.arange(len(aabbs))
+        bounds, children, starts, counts = [], [], [], []
+        centers = (aabbs[:, :2] + aabbs[:, 2:]) / 2.
+        stack = [(0, len(aabbs), -1, 0)] # (start, end, parent, which child of the parent)
+        while stack:
+            start, end, parent, side = stack.pop()
+            node = len(bounds)
+            items = self.order[start:end]
+            if len(items) > 0:
+                bounds.append(np.concatenate([aabbs[items, :2].min(axis=0), aabbs[items, 2:].max(axis=0)]))
+            else:
+                bounds.append(np.array([np.inf, np.inf, -np.inf, -np.inf])) # empty tree, overlaps nothing
+            children.append([-1, -1])
+            starts.append(start)
+            counts.append(end - start)
+            if parent >= 0:
+                children[parent][side] = node
+            if end - start > self.leaf_size:
+                # Split at the median of the longest axis
+                extent = bounds[node][2:] - bounds[node][:2]
+                axis = int(np.argmax(extent))
+                mid = (end - start) // 2
+                self.order[start:end] = items[np.argpartition(centers[items, axis], mid)]
+                stack.append((start + mid, end, node, 1))
+                stack.append((start, start + mid, node, 0))
+        self.node_bounds = np.array(bounds).reshape(-1, 4)
+        self.node_children = np.array(children, dtype=int).reshape(-1, 2)
+        self.node_starts = np.array(starts, dtype=int)
+        self.node_counts = np.array(counts, dtype=int)
+
+    def query(self, aabbs: np.ndarray):
+        # Returns (Q, I) such that aabbs[Q[k]] overlaps self.aabbs[I[k]], for every such pair
+        Q_out = [np.zeros(0, dtype=int)]
+        I_out = [np.zeros(0, dtype=int)]
+        q = np.arange(len(aabbs))
+        nodes = np.zeros(len(aabbs), dtype=int)
+        while len(q) > 0:
+            hit = aabb_overlap(self.node_bounds[nodes], aabbs[q])
+            q, nodes = q[hit], nodes[hit]
+            leaf = self.node_children[nodes, 0] < 0
+            
+            # Leaves: test the items they hold
+            leaf_q, leaf_nodes = q[leaf], nodes[leaf]
+            counts = self.node_counts[leaf_nodes]
+            item_q = np.repeat(leaf_q, counts)
+            local = np.arange(len(item_q)) - np.repeat(np.cumsum(counts) - counts, counts)
+            items = self.order[np.repeat(self.node_starts[leaf_nodes], counts) + local]
+            keep = aabb_overlap(self.aabbs[items], aabbs[item_q])
+            Q_out.append(item_q[keep])
+            I_out.append(items[keep])
+            
+            # Internal nodes: descend into both children
+            inner_q, inner_nodes = q[~leaf], nodes[~leaf]
+            q = np.concatenate([inner_q, inner_q])
+            nodes = np.concatenate([self.node_children[inner_nodes, 0], self.node_children[inner_nodes, 1]])
+        return np.concatenate(Q_out), np.concatenate(I_out)
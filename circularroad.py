@@ -1,8 +1,9 @@
 import numpy as np
 import torch
 from world import World
-from agents import Car, RingBuilding, CircleBuilding, Painting, Pedestrian
+from agents import Car, RailCar, RingBuilding, CircleBuilding, Painting, Pedestrian
 from geometry import Point
+from road import Lane
 import time
 from tkinter import *
 from dql_agent import DQLAgent
@@ -20,22 +21,6 @@ lane_width = 3.5
 
 w = World(dt, width = world_width, height = world_height, ppm = 6) # The world is 120 meters by 120 meters. ppm is the pixels per meter.
 
-def update_car_position(car, center_x, center_y, radius, speed, dt):
-    # Get current angle
-    current_angle = np.arctan2(car.center.y - center_y, car.center.x - center_x)
-    
-    # Update angle based on speed and radius
-    angular_velocity = speed / radius  # v = ω * r
-    new_angle = current_angle + angular_velocity * dt
-    
-    # Calculate new position
-    new_x = center_x + radius * np.cos(new_angle)
-    new_y = center_y + radius * np.sin(new_angle)
-    
-    # Update car position and heading
-    car.center = Point(new_x, new_y)
-    car.heading = new_angle + np.pi/2  # Add π/2 to make car tangent to circle
-
 def environment_setup(w):
     # Let's add some sidewalks and RectangleBuildings.
     # A Painting object is a rectangle that the vehicles cannot collide with. So we use them for the sidewalks / zebra crossings / or creating lanes.
@@ -66,22 +51,21 @@ c1.max_speed = 30.0 # let's say the maximum is 30 m/s (108 km/h)
 c1.velocity = Point(0, 3.0)
 w.add(c1)
 
+# The other cars drive counterclockwise on the centerlines of the two lanes at 3 m/s. A RailCar is moved by the world
+# along its lane, starting s meters from the start of the lane (here, the rightmost point of the circle).
+inner_lane = Lane.circle(Point(world_width/2, world_height/2), inner_building_radius + lane_width/2, lane_width)
+outer_lane = Lane.circle(Point(world_width/2, world_height/2), inner_building_radius + 3*lane_width/2, lane_width)
+
 # Level 2 (add this to the code)
-c2 = Car(Point(world_width/2, 95), np.pi, 'yellow')
-c2.max_speed = 30.0 # let's say the maximum is 30 m/s (108 km/h)
-c2.velocity = Point(0, 3.0)
+c2 = RailCar(inner_lane, s = inner_lane.length / 4, speed = 3.0, color = 'yellow')
 w.add(c2)
 
 # Level 3 (add this to the code to level 2)
-c3 = Car(Point(world_width/2, 24), 0, 'blue')
-c3.max_speed = 30.0 # let's say the maximum is 30 m/s (108 km/h)
-c3.velocity = Point(0, 3.0)
+c3 = RailCar(outer_lane, s = 3 * outer_lane.length / 4, speed = 3.0, color = 'blue')
 w.add(c3)
 
 # Level 4 (add this to the code to level 3)
-c4 = Car(Point(28,60), np.pi/2, 'green')
-c4.max_speed = 30.0 # let's say the maximum is 30 m/s (108 km/h)
-c4.velocity = Point(0, 3.0)
+c4 = RailCar(outer_lane, s = outer_lane.length / 2, speed = 3.0, color = 'green')
 w.add(c4)
 
 w.render() # This visualizes the world we just constructed.
@@ -96,26 +80,11 @@ if not human_controller:
     action_size = 15  # 5 steering actions * 3 throttle actions
     agent = DQLAgent(state_size, action_size)
     
+    initial_state = w.snapshot()
+    
     for episode in range(EPISODES):
         # Reset the environment
-        c1.center = Point(96, 60)
-        c1.heading = np.pi/2
-        c1.velocity = Point(0, 3.0)
-
-        # Level 2
-        c2.center = Point(world_width/2, 95)
-        c2.heading = np.pi
-        c2.velocity = Point(0, 3.0)
-
-        # Level 3
-        c3.center = Point(world_width/2, 24)
-        c3.heading = 0
-        c3.velocity = Point(0, 3.0)
-
-        # Level 4
-        c4.center = Point(28,60)
-        c4.heading = np.pi/2
-        c4.velocity = Point(0, 3.0)
+        w.restore(initial_state)
         
         # Add lap tracking variables
         last_angle = np.arctan2(c1.center.y - world_height/2, c1.center.x - world_width/2)
@@ -145,12 +114,6 @@ if not human_controller:
             # Get action from agent
             steering, throttle = agent.act(state)
             c1.set_control(steering, throttle)
-            
-            # Update other cars' positions
-            radius = inner_building_radius + lane_width/2
-            update_car_position(c2, world_width/2, world_height/2, radius, 3.0, dt)   
-            update_car_position(c3, world_width/2, world_height/2, radius + lane_width, 3.0, dt)
-            update_car_position(c4, world_width/2, world_height/2, radius + lane_width, 3.0, dt)
 
             # Advance simulation
             w.tick()
@@ -205,12 +168,6 @@ else: # Let's use the keyboard input for human control
     controller = KeyboardController(w)
     for k in range(600):
         c1.set_control(controller.steering, controller.throttle)
-        
-        # Update other cars' positions
-        radius = inner_building_radius + lane_width/2
-        update_car_position(c2, world_width/2, world_height/2, radius, 3.0, dt)   
-        update_car_position(c3, world_width/2, world_height/2, radius + lane_width, 3.0, dt)
-        update_car_position(c4, world_width/2, world_height/2, radius + lane_width, 3.0, dt)
 
         w.tick() # This ticks the world for one time step (dt second)
         w.render()
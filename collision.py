@@ -0,0 +1,542 @@
+import numpy as np
+from geometry import Rectangle, Circle, Ring
+from typing import Union
+
+# Vectorized narrow phase. Shapes are packed into plain NumPy arrays:
+#   boxes:   (..., 4, 2) corner coordinates in the same order as Rectangle.corners
+#   circles: (..., 3) as [x, y, r]
+#   rings:   (..., 4) as [x, y, r_inner, r_outer]
+# All the kernels below broadcast over the leading dimensions, so the same function answers
+# a single pair, a list of pairs or a full N x M matrix (by passing A[:, None] and B[None, :]).
+
+BOX, CIRCLE, RING = 0, 1, 2
+
+
+def _cross(v: np.ndarray) -> np.ndarray: # rotates 2D vectors by 90 degrees
+    return np.stack([-v[..., 1], v[..., 0]], axis=-1)
+
+
+def _inside_boxes(p: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    # Same test as Point.isInside(Rectangle), based on https://stackoverflow.com/a/2763387
+    AB = boxes[..., 1, :] - boxes[..., 0, :]
+    AM = p - boxes[..., 0, :]
+    BC = boxes[..., 2, :] - boxes[..., 1, :]
+    BM = p - boxes[..., 1, :]
+    ABAM = np.sum(AB * AM, axis=-1)
+    BCBM = np.sum(BC * BM, axis=-1)
+    return (0 <= ABAM) & (ABAM <= np.sum(AB * AB, axis=-1)) & (0 <= BCBM) & (BCBM <= np.sum(BC * BC, axis=-1))
+
+
+def _edge_distances(p: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    # Distance from p to the boundary of each box (same formula as Point.distanceTo(Line))
+    s1 = boxes
+    s2 = np.roll(boxes, -1, axis=-2)
+    d = s2 - s1
+    m = p[..., None, :] - s1
+    that = np.sum(m * d, axis=-1) / np.sum(d * d, axis=-1)
+    tstar = np.clip(that, 0, 1)
+    return np.min(np.linalg.norm(s1 + tstar[..., None] * d - p[..., None, :], axis=-1), axis=-1)
+
+
+def box_box(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    # Separating axis theorem. Rectangles are parallelograms, so the normals of two edges per box are enough.
+    A, B = np.broadcast_arrays(A, B)
+    axes = np.stack([_cross(A[..., 1, :] - A[..., 0, :]), _cross(A[..., 2, :] - A[..., 1, :]),
+                     _cross(B[..., 1, :] - B[..., 0, :]), _cross(B[..., 2, :] - B[..., 1, :])], axis=-2) # (..., 4, 2)
+    projA = np.einsum('...kd,...ad->...ak', A, axes) # (..., 4 axes, 4 corners)
+    projB = np.einsum('...kd,...ad->...ak', B, axes)
+    separated = (projA.max(axis=-1) < projB.min(axis=-1)) | (projB.max(axis=-1) < projA.min(axis=-1))
+    return ~np.any(separated, axis=-1)
+
+
+def box_circle(A: np.ndarray, C: np.ndarray) -> np.ndarray:
+    m = C[..., :2]
+    return _inside_boxes(m, A) | (_edge_distances(m, A) <= C[..., 2])
+
+
+def box_ring(A: np.ndarray, R: np.ndarray) -> np.ndarray:
+    # The box touches the ring iff the range of distances from the ring center to the box overlaps [r_inner, r_outer]
+    m = R[..., :2]
+    max_dist = np.max(np.linalg.norm(A - m[..., None, :], axis=-1), axis=-1)
+    min_dist = np.where(_inside_boxes(m, A), 0., _edge_distances(m, A))
+    return (max_dist >= R[..., 2]) & (min_dist < R[..., 3])
+
+
+def circle_circle(C1: np.ndarray, C2: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(C1[..., :2] - C2[..., :2], axis=-1) <= C1[..., 2] + C2[..., 2]
+
+
+def circle_ring(C: np.ndarray, R: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(C[..., :2] - R[..., :2], axis=-1)
+    return (R[..., 2] - C[..., 2] <= d) & (d <= C[..., 2] + R[..., 3])
+
+
+def ring_ring(R1: np.ndarray, R2: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(R1[..., :2] - R2[..., :2], axis=-1)
+    far_away = d > R1[..., 3] + R2[..., 3]
+    first_inside = d + R1[..., 3] < R2[..., 2]
+    second_inside = d + R2[..., 3] < R1[..., 2]
+    return ~(far_away | first_inside | second_inside)
+
+
+def point_distance(P: np.ndarray, kind: int, S: np.ndarray) -> np.ndarray:
+    # Distance from points P (..., 2) to shapes S of the given kind
+    if kind == BOX:
+        return np.where(_inside_boxes(P, S), 0., _edge_distances(P, S))
+    d = np.linalg.norm(P - S[..., :2], axis=-1)
+    if kind == CIRCLE:
+        return np.maximum(0., d - S[..., 2])
+    return np.maximum(np.maximum(S[..., 2] - d, d - S[..., 3]), 0.)
+
+
+def point_inside(P: np.ndarray, kind: int, S: np.ndarray) -> np.ndarray:
+    # Same as point_distance(P, kind, S) == 0, without computing any distance to the boundary
+    if kind == BOX:
+        return _inside_boxes(P, S)
+    d2 = np.sum((P - S[..., :2]) ** 2, axis=-1)
+    if kind == CIRCLE:
+        return d2 <= S[..., 2] ** 2
+    return (S[..., 2] ** 2 <= d2) & (d2 <= S[..., 3] ** 2)
+
+
+def point_signed_distance(P: np.ndarray, kind: int, S: np.ndarray) -> np.ndarray:
+    # Like point_distance, but negative inside the shapes, where it is minus the distance to the boundary
+    if kind == BOX:
+        d = _edge_distances(P, S)
+        return np.where(_inside_boxes(P, S), -d, d)
+    d = np.linalg.norm(P - S[..., :2], axis=-1)
+    if kind == CIRCLE:
+        return d - S[..., 2]
+    return np.maximum(S[..., 2] - d, d - S[..., 3])
+
+
+def box_box_distance(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    # For two disjoint convex polygons, the closest pair of points always includes a corner
+    A, B = np.broadcast_arrays(A, B)
+    d = np.min([_edge_distances(A[..., k, :], B) for k in range(4)] + [_edge_distances(B[..., k, :], A) for k in range(4)], axis=0)
+    return np.where(box_box(A, B), 0., d)
+
+
+def box_circle_distance(A: np.ndarray, C: np.ndarray) -> np.ndarray:
+    return np.maximum(0., point_distance(C[..., :2], BOX, A) - C[..., 2])
+
+
+def box_ring_distance(A: np.ndarray, R: np.ndarray) -> np.ndarray:
+    m = R[..., :2]
+    max_dist = np.max(np.linalg.norm(A - m[..., None, :], axis=-1), axis=-1)
+    d = np.where(max_dist < R[..., 2], R[..., 2] - max_dist, point_distance(m, BOX, A) - R[..., 3]) # inside the hole or outside the ring
+    return np.where(box_ring(A, R), 0., d)
+
+
+def circle_circle_distance(C1: np.ndarray, C2: np.ndarray) -> np.ndarray:
+    return np.maximum(0., np.linalg.norm(C1[..., :2] - C2[..., :2], axis=-1) - C1[..., 2] - C2[..., 2])
+
+
+def circle_ring_distance(C: np.ndarray, R: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(C[..., :2] - R[..., :2], axis=-1)
+    return np.where(circle_ring(C, R), 0., np.maximum(R[..., 2] - d, d - R[..., 3]) - C[..., 2])
+
+
+def ring_ring_distance(R1: np.ndarray, R2: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(R1[..., :2] - R2[..., :2], axis=-1)
+    far_away = d > R1[..., 3] + R2[..., 3]
+    first_inside = d + R1[..., 3] < R2[..., 2]
+    second_inside = d + R2[..., 3] < R1[..., 2]
+    return np.select([far_away, first_inside, second_inside],
+                     [d - R1[..., 3] - R2[..., 3], R2[..., 2] - d - R1[..., 3], R1[..., 2] - d - R2[..., 3]], 0.)
+
+
+def box_box_penetration(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    # Smallest overlap of the projections over the separating axis candidates
+    A, B = np.broadcast_arrays(A, B)
+    axes = np.stack([_cross(A[..., 1, :] - A[..., 0, :]), _cross(A[..., 2, :] - A[..., 1, :]),
+                     _cross(B[..., 1, :] - B[..., 0, :]), _cross(B[..., 2, :] - B[..., 1, :])], axis=-2)
+    axes = axes / np.linalg.norm(axes, axis=-1, keepdims=True)
+    projA = np.einsum('...kd,...ad->...ak', A, axes)
+    projB = np.einsum('...kd,...ad->...ak', B, axes)
+    overlap = np.minimum(projA.max(axis=-1), projB.max(axis=-1)) - np.maximum(projA.min(axis=-1), projB.min(axis=-1))
+    return np.min(overlap, axis=-1)
+
+
+def box_circle_penetration(A: np.ndarray, C: np.ndarray) -> np.ndarray:
+    return C[..., 2] - point_signed_distance(C[..., :2], BOX, A)
+
+
+def box_ring_penetration(A: np.ndarray, R: np.ndarray) -> np.ndarray:
+    m = R[..., :2]
+    max_dist = np.max(np.linalg.norm(A - m[..., None, :], axis=-1), axis=-1)
+    min_dist = point_distance(m, BOX, A)
+    return np.minimum(R[..., 3] - min_dist, max_dist - R[..., 2])
+
+
+def circle_circle_penetration(C1: np.ndarray, C2: np.ndarray) -> np.ndarray:
+    return C1[..., 2] + C2[..., 2] - np.linalg.norm(C1[..., :2] - C2[..., :2], axis=-1)
+
+
+def circle_ring_penetration(C: np.ndarray, R: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(C[..., :2] - R[..., :2], axis=-1)
+    return np.minimum(C[..., 2] + R[..., 3] - d, d + C[..., 2] - R[..., 2])
+
+
+def ring_ring_penetration(R1: np.ndarray, R2: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(R1[..., :2] - R2[..., :2], axis=-1)
+    return np.minimum(np.minimum(R1[..., 3] + R2[..., 3] - d, d + R1[..., 3] - R2[..., 2]), d + R2[..., 3] - R1[..., 2])
+
+
+# (kind_a, kind_b) -> (kernel, swapped). Swapped kernels are called with their arguments reversed.
+KERNELS = {
+    (BOX, BOX): (box_box, False),
+    (BOX, CIRCLE): (box_circle, False),
+    (BOX, RING): (box_ring, False),
+    (CIRCLE, BOX): (box_circle, True),
+    (CIRCLE, CIRCLE): (circle_circle, False),
+    (CIRCLE, RING): (circle_ring, False),
+    (RING, BOX): (box_ring, True),
+    (RING, CIRCLE): (circle_ring, True),
+    (RING, RING): (ring_ring, False),
+}
+
+# Same layout as KERNELS, for distances
+DISTANCE_KERNELS = {
+    (BOX, BOX): (box_box_distance, False),
+    (BOX, CIRCLE): (box_circle_distance, False),
+    (BOX, RING): (box_ring_distance, False),
+    (CIRCLE, BOX): (box_circle_distance, True),
+    (CIRCLE, CIRCLE): (circle_circle_distance, False),
+    (CIRCLE, RING): (circle_ring_distance, False),
+    (RING, BOX): (box_ring_distance, True),
+    (RING, CIRCLE): (circle_ring_distance, True),
+    (RING, RING): (ring_ring_distance, False),
+}
+
+# Same layout as KERNELS, for how deep two intersecting shapes overlap (only meaningful for intersecting pairs)
+PENETRATION_KERNELS = {
+    (BOX, BOX): (box_box_penetration, False),
+    (BOX, CIRCLE): (box_circle_penetration, False),
+    (BOX, RING): (box_ring_penetration, False),
+    (CIRCLE, BOX): (box_circle_penetration, True),
+    (CIRCLE, CIRCLE): (circle_circle_penetration, False),
+    (CIRCLE, RING): (circle_ring_penetration, False),
+    (RING, BOX): (box_ring_penetration, True),
+    (RING, CIRCLE): (circle_ring_penetration, True),
+    (RING, RING): (ring_ring_penetration, False),
+}
+
+
+# Time to collision under constant velocities: the shapes keep their orientation and move in straight lines, and V is the
+# velocity of the second shape relative to the first. Each kernel returns the first time in [0, horizon] at which the
+# shapes touch (0 if they already do), or inf if they do not touch within the horizon.
+
+def _interval_ttc(lo_a: np.ndarray, hi_a: np.ndarray, lo_b: np.ndarray, hi_b: np.ndarray, speed: np.ndarray, horizon: float) -> np.ndarray:
+    # The intervals [lo_b, hi_b] move at speed along their axis. Returns the first time at which they overlap
+    # [lo_a, hi_a] on all the axes (the last dimension) at once
+    overlap = (lo_b <= hi_a) & (lo_a <= hi_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (lo_a - hi_b) / speed
+        t2 = (hi_a - lo_b) / speed
+    enter = np.where(speed == 0, np.where(overlap, -np.inf, np.inf), np.minimum(t1, t2))
+    leave = np.where(speed == 0, np.where(overlap, np.inf, -np.inf), np.maximum(t1, t2))
+    enter = np.maximum(enter.max(axis=-1), 0.)
+    leave = np.minimum(leave.min(axis=-1), horizon)
+    return np.where(enter <= leave, enter, np.inf)
+
+
+def _disk_ttc(D: np.ndarray, r: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    # First time at which the point D + V t gets within r of the origin
+    a = np.sum(V * V, axis=-1)
+    b = np.sum(D * V, axis=-1)
+    c = np.sum(D * D, axis=-1) - r ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (-b - np.sqrt(b ** 2 - a * c)) / a
+    t = np.where(c <= 0, 0., np.where((b < 0) & (b ** 2 >= a * c), t, np.inf))
+    return np.where(t <= horizon, t, np.inf)
+
+
+def box_box_ttc(A: np.ndarray, B: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    # Separating axis theorem again: the boxes touch when their projections overlap on all four axes
+    A, B = np.broadcast_arrays(A, B)
+    axes = np.stack([_cross(A[..., 1, :] - A[..., 0, :]), _cross(A[..., 2, :] - A[..., 1, :]),
+                     _cross(B[..., 1, :] - B[..., 0, :]), _cross(B[..., 2, :] - B[..., 1, :])], axis=-2)
+    projA = np.einsum('...kd,...ad->...ak', A, axes)
+    projB = np.einsum('...kd,...ad->...ak', B, axes)
+    speed = np.einsum('...d,...ad->...a', V, axes)
+    return _interval_ttc(projA.min(axis=-1), projA.max(axis=-1), projB.min(axis=-1), projB.max(axis=-1), speed, horizon)
+
+
+def box_circle_ttc(A: np.ndarray, C: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    # The center of the circle hits the box grown by the radius, i.e. one of two boxes grown along one axis each, or one of the corner disks
+    A, m, r, V = np.broadcast_arrays(A, C[..., None, :2], C[..., None, 2:3], V[..., None, :])
+    m, r, V = m[..., 0, :], r[..., 0, 0], V[..., 0, :]
+    edges = np.stack([A[..., 1, :] - A[..., 0, :], A[..., 2, :] - A[..., 1, :]], axis=-2)
+    axes = edges / np.linalg.norm(edges, axis=-1, keepdims=True)
+    projA = np.einsum('...kd,...ad->...ak', A, axes)
+    lo, hi = projA.min(axis=-1), projA.max(axis=-1)
+    p = np.einsum('...d,...ad->...a', m, axes)
+    speed = np.einsum('...d,...ad->...a', V, axes)
+    t = np.full(r.shape, np.inf)
+    for axis in range(2):
+        grow = np.zeros(lo.shape)
+        grow[..., axis] = r
+        t = np.minimum(t, _interval_ttc(lo - grow, hi + grow, p, p, speed, horizon))
+    for corner in range(4):
+        t = np.minimum(t, _disk_ttc(m - A[..., corner, :], r, V, horizon))
+    return t
+
+
+def circle_circle_ttc(C1: np.ndarray, C2: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    return _disk_ttc(C2[..., :2] - C1[..., :2], C1[..., 2] + C2[..., 2], V, horizon)
+
+
+# Rings are treated as disks of their outer radius here, which can only make the time to collision shorter
+def box_ring_ttc(A: np.ndarray, R: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    return box_circle_ttc(A, R[..., [0, 1, 3]], V, horizon)
+
+
+def circle_ring_ttc(C: np.ndarray, R: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    return circle_circle_ttc(C, R[..., [0, 1, 3]], V, horizon)
+
+
+def ring_ring_ttc(R1: np.ndarray, R2: np.ndarray, V: np.ndarray, horizon: float) -> np.ndarray:
+    return circle_circle_ttc(R1[..., [0, 1, 3]], R2[..., [0, 1, 3]], V, horizon)
+
+
+# Same layout as KERNELS. Swapped kernels also get the opposite relative velocity
+TTC_KERNELS = {
+    (BOX, BOX): (box_box_ttc, False),
+    (BOX, CIRCLE): (box_circle_ttc, False),
+    (BOX, RING): (box_ring_ttc, False),
+    (CIRCLE, BOX): (box_circle_ttc, True),
+    (CIRCLE, CIRCLE): (circle_circle_ttc, False),
+    (CIRCLE, RING): (circle_ring_ttc, False),
+    (RING, BOX): (box_ring_ttc, True),
+    (RING, CIRCLE): (circle_ring_ttc, True),
+    (RING, RING): (ring_ring_ttc, False),
+}
+
+
+def shape_kind(obj: Union[Rectangle, Circle, Ring]) -> int:
+    if isinstance(obj, Rectangle): return BOX
+    if isinstance(obj, Circle): return CIRCLE
+    if isinstance(obj, Ring): return RING
+    raise NotImplementedError
+
+
+def pack(objs: list) -> dict:
+    # Groups the shapes by kind. Returns {kind: (indices into objs, packed array)}
+    groups = {BOX: ([], []), CIRCLE: ([], []), RING: ([], [])}
+    for i, obj in enumerate(objs):
+        kind = shape_kind(obj)
+        idx, rows = groups[kind]
+        idx.append(i)
+        if kind == BOX:
+            rows.append([[c.x, c.y] for c in obj.corners])
+        elif kind == CIRCLE:
+            rows.append([obj.m.x, obj.m.y, obj.r])
+        else:
+            rows.append([obj.m.x, obj.m.y, obj.r_inner, obj.r_outer])
+    return {kind: (np.array(idx, dtype=int), np.array(rows, dtype=float)) for kind, (idx, rows) in groups.items() if idx}
+
+
+class ShapeBatch:
+    # A list of shapes packed once, so that many pairwise queries can be answered without re-packing
+    def __init__(self, objs: list, packed: dict = None):
+        self.objs = objs
+        self.packed = pack(objs) if packed is None else packed
+        n = sum(len(idx) for idx, _ in self.packed.values())
+        self.kinds = np.zeros(n, dtype=int)
+        self.rows = np.zeros(n, dtype=int)
+        self.aabbs = np.zeros((n, 4)) # [xmin, ymin, xmax, ymax]
+        for kind, (idx, arr) in self.packed.items():
+            self.kinds[idx] = kind
+            self.rows[idx] = np.arange(len(idx))
+            if kind == BOX:
+                self.aabbs[idx] = np.concatenate([arr.min(axis=1), arr.max(axis=1)], axis=1)
+            else:
+                r = arr[:, 2] if kind == CIRCLE else arr[:, 3]
+                self.aabbs[idx] = np.stack([arr[:, 0] - r, arr[:, 1] - r, arr[:, 0] + r, arr[:, 1] + r], axis=1)
+                
+    @classmethod
+    def from_poses(cls, kinds: np.ndarray, templates: np.ndarray, poses: np.ndarray) -> 'ShapeBatch':
+        # Packs entities given by their kinds and templates (see entity_templates) at the given poses, without building
+        # their geometry. The batch has no objs then.
+        packed = {}
+        for kind in (BOX, CIRCLE, RING):
+            idx = np.nonzero(kinds == kind)[0]
+            if len(idx) > 0:
+                packed[kind] = (idx, posed_shapes(kind, templates[idx], poses[idx]))
+        return cls(None, packed)
+        
+    def __len__(self):
+        return len(self.kinds)
+        
+    def intersects(self, I: np.ndarray, J: np.ndarray, other: 'ShapeBatch' = None) -> np.ndarray:
+        # Returns a boolean array whose k-th entry is self.objs[I[k]].intersectsWith(other.objs[J[k]])
+        return self._pairwise(KERNELS, I, J, other, bool)
+        
+    def distances(self, I: np.ndarray, J: np.ndarray, other: 'ShapeBatch' = None) -> np.ndarray:
+        # Returns an array whose k-th entry is self.objs[I[k]].distanceTo(other.objs[J[k]])
+        return self._pairwise(DISTANCE_KERNELS, I, J, other, float)
+        
+    def penetrations(self, I: np.ndarray, J: np.ndarray, other: 'ShapeBatch' = None) -> np.ndarray:
+        # Returns how deep self.objs[I[k]] and other.objs[J[k]] overlap, for pairs that are known to intersect
+        return self._pairwise(PENETRATION_KERNELS, I, J, other, float)
+        
+    def times_to_collision(self, I: np.ndarray, J: np.ndarray, velocities: np.ndarray, horizon: float, other: 'ShapeBatch' = None, other_velocities: np.ndarray = None) -> np.ndarray:
+        # Returns the time to collision of self.objs[I[k]] and other.objs[J[k]] if they keep the given (N, 2) velocities
+        other = self if other is None else other
+        other_velocities = velocities if other_velocities is None else other_velocities
+        I = np.asarray(I, dtype=int)
+        J = np.asarray(J, dtype=int)
+        result = np.full(len(I), np.inf)
+        kinds_a = self.kinds[I]
+        kinds_b = other.kinds[J]
+        for kind_a in self.packed:
+            for kind_b in other.packed:
+                mask = (kinds_a == kind_a) & (kinds_b == kind_b)
+                if not np.any(mask): continue
+                arr_a = self.packed[kind_a][1][self.rows[I[mask]]]
+                arr_b = other.packed[kind_b][1][other.rows[J[mask]]]
+                V = other_velocities[J[mask]] - velocities[I[mask]]
+                kernel, swapped = TTC_KERNELS[(kind_a, kind_b)]
+                result[mask] = kernel(arr_b, arr_a, -V, horizon) if swapped else kernel(arr_a, arr_b, V, horizon)
+        return result
+        
+    def _pairwise(self, kernels: dict, I: np.ndarray, J: np.ndarray, other: 'ShapeBatch', dtype: type) -> np.ndarray:
+        other = self if other is None else other
+        I = np.asarray(I, dtype=int)
+        J = np.asarray(J, dtype=int)
+        result = np.zeros(len(I), dtype=dtype)
+        kinds_a = self.kinds[I]
+        kinds_b = other.kinds[J]
+        for kind_a in self.packed:
+            for kind_b in other.packed:
+                mask = (kinds_a == kind_a) & (kinds_b == kind_b)
+                if not np.any(mask): continue
+                arr_a = self.packed[kind_a][1][self.rows[I[mask]]]
+                arr_b = other.packed[kind_b][1][other.rows[J[mask]]]
+                kernel, swapped = kernels[(kind_a, kind_b)]
+                result[mask] = kernel(arr_b, arr_a) if swapped else kernel(arr_a, arr_b)
+        return result
+
+
+def intersection_matrix(objs_a: list, objs_b: list) -> np.ndarray:
+    # Returns the N x M boolean matrix whose (i, j) entry is objs_a[i].intersectsWith(objs_b[j])
+    result = np.zeros((len(objs_a), len(objs_b)), dtype=bool)
+    packed_a = pack(objs_a)
+    packed_b = packed_a if objs_b is objs_a else pack(objs_b)
+    for kind_a, (idx_a, arr_a) in packed_a.items():
+        for kind_b, (idx_b, arr_b) in packed_b.items():
+            kernel, swapped = KERNELS[(kind_a, kind_b)]
+            if swapped:
+                block = kernel(arr_b[None, :], arr_a[:, None])
+            else:
+                block = kernel(arr_a[:, None], arr_b[None, :])
+            result[np.ix_(idx_a, idx_b)] = block
+    return result
+
+
+def distance_matrix(sources, targets: list) -> np.ndarray:
+    # Returns the N x M matrix whose (i, j) entry is the distance between sources[i] and targets[j].
+    # sources is either an N x 2 array of points or a list of shapes.
+    packed_b = pack(targets)
+    if isinstance(sources, np.ndarray):
+        P = sources.reshape(-1, 2).astype(float)
+        result = np.zeros((len(P), len(targets)))
+        for kind_b, (idx_b, arr_b) in packed_b.items():
+            result[:, idx_b] = point_distance(P[:, None], kind_b, arr_b[None, :])
+        return result
+    result = np.zeros((len(sources), len(targets)))
+    packed_a = packed_b if sources is targets else pack(sources)
+    for kind_a, (idx_a, arr_a) in packed_a.items():
+        for kind_b, (idx_b, arr_b) in packed_b.items():
+            kernel, swapped = DISTANCE_KERNELS[(kind_a, kind_b)]
+            if swapped:
+                block = kernel(arr_b[None, :], arr_a[:, None])
+            else:
+                block = kernel(arr_a[:, None], arr_b[None, :])
+            result[np.ix_(idx_a, idx_b)] = block
+    return result
+
+
+# Entities can also be described by a pose (x, y, heading) and a template in their own frame:
+#   boxes:   [width / 2, height / 2]
+#   circles: [r, 0]
+#   rings:   [r_inner, r_outer]
+# which lets us place them anywhere along their motion.
+
+def entity_templates(entities: list):
+    # Returns the kinds, templates and bounding radii (the farthest any point of the shape gets from its center) of the entities
+    kinds = np.zeros(len(entities), dtype=int)
+    templates = np.zeros((len(entities), 2))
+    radii = np.zeros(len(entities))
+    for i, entity in enumerate(entities):
+        kinds[i] = shape_kind(entity.obj)
+        if kinds[i] == BOX:
+            templates[i] = [entity.size.x / 2., entity.size.y / 2.]
+            radii[i] = np.hypot(*templates[i])
+        elif kinds[i] == CIRCLE:
+            templates[i] = [entity.radius, 0.]
+            radii[i] = entity.radius
+        else:
+            templates[i] = [entity.inner_radius, entity.outer_radius]
+            radii[i] = entity.outer_radius
+    return kinds, templates, radii
+
+
+def posed_shapes(kind: int, templates: np.ndarray, poses: np.ndarray) -> np.ndarray:
+    # Packs the shapes of the given kind at the given poses, in the layout the kernels above expect
+    x, y = poses[:, 0], poses[:, 1]
+    if kind == BOX:
+        c = np.cos(poses[:, 2])
+        s = np.sin(poses[:, 2])
+        wc, ws = templates[:, 0] * c, templates[:, 0] * s
+        hc, hs = templates[:, 1] * c, templates[:, 1] * s
+        # Same corner order as RectangleEntity.corners
+        return np.stack([np.stack([x + wc - hs, y + ws + hc], axis=-1),
+                         np.stack([x - wc - hs, y - ws + hc], axis=-1),
+                         np.stack([x - wc + hs, y - ws - hc], axis=-1),
+                         np.stack([x + wc + hs, y + ws - hc], axis=-1)], axis=1)
+    if kind == CIRCLE:
+        return np.stack([x, y, templates[:, 0]], axis=-1)
+    return np.stack([x, y, templates[:, 0], templates[:, 1]], axis=-1)
+
+
+def posed_distances(kinds: np.ndarray, templates: np.ndarray, I: np.ndarray, J: np.ndarray, poses_I: np.ndarray, poses_J: np.ndarray) -> np.ndarray:
+    # Distance between entity I[k] at poses_I[k] and entity J[k] at poses_J[k]
+    result = np.zeros(len(I))
+    for (kind_a, kind_b), (kernel, swapped) in DISTANCE_KERNELS.items():
+        mask = (kinds[I] == kind_a) & (kinds[J] == kind_b)
+        if not np.any(mask): continue
+        arr_a = posed_shapes(kind_a, templates[I[mask]], poses_I[mask])
+        arr_b = posed_shapes(kind_b, templates[J[mask]], poses_J[mask])
+        result[mask] = kernel(arr_b, arr_a) if swapped else kernel(arr_a, arr_b)
+    return result
+
+
+def times_of_impact(kinds: np.ndarray, templates: np.ndarray, radii: np.ndarray, poses0: np.ndarray, poses1: np.ndarray,
+                    I: np.ndarray, J: np.ndarray, tolerance: float = 1e-3, max_iterations: int = 64) -> np.ndarray:
+    # Conservative advancement. The entities move from poses0 to poses1 (linearly in x, y and heading) while the
+    # fraction of the step goes from 0 to 1. Returns, for each pair (I[k], J[k]), the first fraction at which they are
+    # closer than tolerance, or inf if they stay apart during the whole step. Pairs that are still unresolved after
+    # max_iterations (e.g. fast ones that graze) are reported at the last fraction they were known to be apart, so that
+    # nothing tunnels through unnoticed.
+    motion = poses1 - poses0
+    motion[:, 2] = np.mod(motion[:, 2] + np.pi, 2*np.pi) - np.pi # turn the shortest way around
+    # No point of an entity moves faster than this (per unit fraction of the step)
+    speeds = np.linalg.norm(motion[:, :2], axis=1) + np.abs(motion[:, 2]) * radii
+    bound = speeds[I] + speeds[J]
+    
+    t = np.zeros(len(I))
+    toi = np.full(len(I), np.inf)
+    active = np.arange(len(I))
+    for _ in range(max_iterations):
+        if len(active) == 0: break
+        i, j = I[active], J[active]
+        d = posed_distances(kinds, templates, i, j, poses0[i] + t[active, None] * motion[i], poses0[j] + t[active, None] * motion[j])
+        hit = d <= tolerance
+        toi[active[hit]] = t[active[hit]]
+        # The pair cannot touch before this. Pairs that do not move never touch if they do not already
+        t[active] += np.divide(d, bound[active], out=np.full_like(d, np.inf), where=bound[active] > 0)
+        active = active[~hit & (t[active] <= 1)]
+    toi[active] = t[active]
+    return toi
@@ -0,0 +1,101 @@
+import numpy as np
+import dynamics
+from broadphase import neighbour_pairs
+from entities import Entity
+from geometry import Point
+from road import wrap_angle
+from sdf import SignedDistanceField
+
+# Pedestrian crowds driven by the social force model (Helbing and Molnar, "Social force model for pedestrian dynamics").
+# Every pedestrian is pulled toward its goal at its desired speed and pushed away from the pedestrians around it and,
+# given a signed distance field of the static agents, from obstacles. The resulting velocity change is turned into
+# set_control inputs, the pedestrians are then moved by the usual kinematic bicycle model in World.tick.
+
+
+class SocialForceCrowd:
+    def __init__(self, desired_speed: float = 1.34, relaxation_time: float = 0.5, strength: float = 2.1, interaction_range: float = 0.3,
+                 anisotropy: float = 0.5, cutoff: float = 2., obstacle_strength: float = 10., obstacle_range: float = 0.2,
+                 goal_radius: float = 0.5, max_speed: float = 2., sdf: SignedDistanceField = None):
+        self.desired_speed = desired_speed # v0, m/s
+        self.relaxation_time = relaxation_time # tau, s
+        self.strength = strength # A, m/s^2
+        self.interaction_range = interaction_range # B, m
+        self.anisotropy = anisotropy # lambda: how much pedestrians care about the ones behind them, from 0 to 1
+        self.cutoff = cutoff # pedestrians farther apart than this, center to center, do not interact
+        self.obstacle_strength = obstacle_strength
+        self.obstacle_range = obstacle_range
+        self.goal_radius = goal_radius # pedestrians stop within this distance of their goals
+        self.max_speed = max_speed
+        self.sdf = sdf # e.g. World.bake_sdf(), for the obstacles
+        self.pedestrians = []
+        self.goals = np.zeros((0, 2)) # can be changed at any time, e.g. to send the pedestrians back across the street
+        self._desired_speeds = np.zeros(0)
+        self._radii = np.zeros(0)
+        self._rear_dists = np.zeros(0)
+        self._arrays = dynamics.EntityArrays(self.pedestrians)
+
+    def __len__(self):
+        return len(self.pedestrians)
+
+    def add(self, pedestrian: Entity, goal: Point, desired_speed: float = None):
+        # The pedestrian (any CircleEntity) will walk to goal at desired_speed (or the default one)
+        self.pedestrians.append(pedestrian)
+        self.goals = np.concatenate([self.goals, [[goal.x, goal.y]]])
+        self._desired_speeds = np.append(self._desired_speeds, self.desired_speed if desired_speed is None else desired_speed)
+        self._radii = np.append(self._radii, pedestrian.radius)
+        self._rear_dists = np.append(self._rear_dists, pedestrian.rear_dist)
+
+    def arrived(self, P: np.ndarray = None) -> np.ndarray:
+        # Which pedestrians are within goal_radius of their goals
+        if P is None: P = self._arrays.state()[:, :2]
+        return np.hypot(*(self.goals - P).T) <= self.goal_radius
+
+    def forces(self, P: np.ndarray, V: np.ndarray) -> np.ndarray:
+        # (N, 2) social forces (accelerations) on the pedestrians at positions P with velocities V
+        to_goal = self.goals - P
+        distance = np.hypot(to_goal[:, 0], to_goal[:, 1])
+        desired = np.where(distance > self.goal_radius, self._desired_speeds / np.maximum(distance, 1e-9), 0.)[:, None] * to_goal
+        F = (desired - V) / self.relaxation_time
+
+        # Repulsion between neighbours, weaker from behind: n points from the other pedestrian to this one
+        I, J = neighbour_pairs(P, self.cutoff)
+        offset = P[I] - P[J]
+        d = np.maximum(np.hypot(offset[:, 0], offset[:, 1]), 1e-9)
+        n = offset / d[:, None]
+        magnitude = self.strength * np.exp((self._radii[I] + self._radii[J] - d) / self.interaction_range)
+        speed = np.hypot(V[:, 0], V[:, 1])
+        e = np.where(speed[:, None] > 1e-9, V / np.maximum(speed, 1e-9)[:, None], 0.) # walking directions
+        weight = lambda k, n: self.anisotropy + (1 - self.anisotropy) * (1 - np.sum(n * e[k], axis=1)) / 2.
+        np.add.at(F, I, (magnitude * weight(I, n))[:, None] * n)
+        np.add.at(F, J, -(magnitude * weight(J, -n))[:, None] * n)
+
+        # Repulsion from the obstacles, along the gradient of their distance field
+        if self.sdf is not None:
+            with np.errstate(invalid='ignore'): # without any static agent, the field is inf everywhere and interpolates to NaN
+                clearance = self.sdf.distance(P) - self._radii
+            near = np.isfinite(clearance) & (clearance < self.cutoff)
+            gradient = self.sdf.gradient(P[near])
+            gradient /= np.maximum(np.hypot(gradient[:, 0], gradient[:, 1]), 1e-9)[:, None]
+            F[near] += (self.obstacle_strength * np.exp(-clearance[near] / self.obstacle_range))[:, None] * gradient
+        return F
+
+    def update(self, dt: float):
+        # Computes the controls of all the pedestrians from their current state. Call it before every World.tick, with its dt
+        if not self.pedestrians: return
+        state = self._arrays.state()
+        P, heading, V, friction = state[:, :2], state[:, 2], state[:, 3:5], state[:, 5]
+        speed = np.hypot(V[:, 0], V[:, 1])
+
+        # Velocity the forces ask for by the next tick
+        target = V + self.forces(P, V) * dt
+        target_speed = np.hypot(target[:, 0], target[:, 1])
+        target *= (np.minimum(target_speed, self.max_speed) / np.maximum(target_speed, 1e-9))[:, None]
+        target_speed = np.minimum(target_speed, self.max_speed)
+        target_heading = np.where(target_speed > 1e-6, np.arctan2(target[:, 1], target[:, 0]), heading)
+
+        # Over the tick the entity travels at the mean of its old and new speeds, so the turn needs this curvature
+        mean_speed = np.maximum((speed + target_speed) / 2., 1e-3)
+        curvature = wrap_angle(target_heading - heading) / (mean_speed * dt)
+        steering = dynamics.steering_for_curvature(curvature, self._rear_dists)
+        throttle = (target_speed - speed) / dt + friction # Entity.tick applies inputAcceleration - friction
+        self._arrays.set_controls(steering, throttle)
@@ -0,0 +1,208 @@
+import numpy as np
+import copy
+from road import LaneSet
+
+# Structure-of-arrays engine for movable entities. Every field below is one contiguous row of BatchedDynamics.state,
+# and every attached entity owns one column of it: its attributes (center, heading, velocity, controls...) become
+# views on that column, see Entity. tick() then integrates all the entities with a single vectorized update.
+
+X, Y, HEADING, VX, VY, ACCELERATION, ANGULAR_VELOCITY, STEERING, THROTTLE, FRICTION, MIN_SPEED, MAX_SPEED, REAR_DIST = range(13)
+NUM_FIELDS = 13
+STATE_FIELDS = REAR_DIST # the fields before REAR_DIST make up the state of an entity, REAR_DIST only depends on its size
+
+
+def entity_state(entity) -> list:
+    # The STATE_FIELDS of an entity that is not attached, from its plain attributes
+    return [entity._center.x, entity._center.y, entity._heading, entity._velocity.x, entity._velocity.y,
+            entity._acceleration, entity._angular_velocity, entity._inputSteering, entity._inputAcceleration,
+            entity._friction, entity._min_speed, entity._max_speed]
+
+
+def set_entity_state(entity, state: list):
+    # Inverse of entity_state
+    entity.center = type(entity._center)(state[X], state[Y])
+    entity.velocity = type(entity._velocity)(state[VX], state[VY])
+    entity._heading, entity._acceleration, entity._angular_velocity = state[HEADING], state[ACCELERATION], state[ANGULAR_VELOCITY]
+    entity._inputSteering, entity._inputAcceleration, entity._friction = state[STEERING], state[THROTTLE], state[FRICTION]
+    entity._min_speed, entity._max_speed = state[MIN_SPEED], state[MAX_SPEED]
+
+
+def steering_for_curvature(curvature: np.ndarray, rear_dist: np.ndarray) -> np.ndarray:
+    # Inverts the kinematic bicycle model of Entity.tick, where the heading changes by speed * sin(beta) / lr per second
+    # with tan(beta) = tan(steering) / 2: the steering that makes the entity turn with the given curvature (1/m)
+    beta = np.arcsin(np.clip(curvature * rear_dist, -1, 1))
+    return np.arctan(2 * np.tan(beta))
+
+
+class BatchedDynamics:
+    num_fields = NUM_FIELDS
+    
+    def __init__(self, capacity: int = 64):
+        self.state = np.zeros((self.num_fields, capacity))
+        self.entities = []
+        self.step = 0 # incremented at every tick, so that the entities know their geometry is out of date
+        self.version = 0 # incremented whenever entities are attached or detached, and so whenever columns may move
+
+    def __len__(self):
+        return len(self.entities)
+
+    def attach(self, entity):
+        # Moves the state of a movable entity into a new column. From now on, the entity reads and writes that column.
+        if entity._batch is not None:
+            entity._batch.detach(entity)
+        row = len(self.entities)
+        if row == self.state.shape[1]:
+            self.state = np.concatenate([self.state, np.zeros_like(self.state)], axis=1)
+        self.state[:NUM_FIELDS, row] = entity_state(entity) + [entity.rear_dist]
+        self.entities.append(entity)
+        self.version += 1
+        entity._batch = self
+        entity._row = row
+        entity._invalidate()
+
+    def detach(self, entity):
+        # Gives the entity its state back as plain attributes. The last column takes the place of the entity's column.
+        state = [float(v) for v in self.state[:, entity._row]]
+        last = self.entities.pop()
+        self.version += 1
+        if last is not entity:
+            self.state[:, entity._row] = self.state[:, last._row]
+            self.entities[entity._row] = last
+            last._row = entity._row
+        entity._batch = None
+        set_entity_state(entity, state)
+        entity._invalidate()
+
+    def detach_all(self):
+        while self.entities:
+            self.detach(self.entities[-1])
+            
+    def clone(self) -> 'BatchedDynamics':
+        # A new batch with a copy of the state, and shallow copies of the attached entities (in the same order) attached to it
+        batch = copy.copy(self)
+        batch.state = self.state.copy()
+        batch.entities = [copy.copy(entity) for entity in self.entities]
+        for entity in batch.entities:
+            entity._batch = batch
+        return batch
+
+    def tick(self, dt: float, rows: np.ndarray = None):
+        # Same kinematic bicycle model as Entity.tick, for all the attached entities (or the given columns) at once
+        state = self.state[:, :len(self.entities)] if rows is None else self.state[:, rows]
+        x, y, heading, vx, vy = state[X], state[Y], state[HEADING], state[VX], state[VY]
+        steering, throttle, friction, lr = state[STEERING], state[THROTTLE], state[FRICTION], state[REAR_DIST]
+        speed = np.sqrt(vx * vx + vy * vy)
+        lf = lr # we assume the center of mass is the same as the geometric center of the entity
+        beta = np.arctan(lr / (lf + lr) * np.tan(steering))
+
+        new_angular_velocity = speed * steering
+        new_acceleration = throttle - friction
+        new_speed = np.minimum(np.maximum(speed + new_acceleration * dt, state[MIN_SPEED]), state[MAX_SPEED])
+        new_heading = heading + ((speed + new_speed)/lr)*np.sin(beta)*dt/2.
+        angle = (heading + new_heading)/2. + beta
+        displacement = (speed + new_speed)*dt / 2.
+
+        new = np.empty((7, state.shape[1]))
+        new[X] = x + displacement*np.cos(angle)
+        new[Y] = y + displacement*np.sin(angle)
+        new[HEADING] = np.mod(new_heading, 2*np.pi) # wrap the heading angle between 0 and +2pi
+        new[VX] = new_speed * np.cos(new_heading)
+        new[VY] = new_speed * np.sin(new_heading)
+        new[ACCELERATION] = new_acceleration
+        new[ANGULAR_VELOCITY] = new_angular_velocity
+        if rows is None:
+            self.state[:7, :len(self.entities)] = new
+        else:
+            self.state[:7, rows] = new
+        self.step += 1
+
+
+class EntityArrays:
+    # The state and controls of a list of entities as arrays, for controllers that drive many of them at once. When they
+    # are all attached to the same batch, they are read and written straight in its state, otherwise attribute by attribute.
+    def __init__(self, entities: list):
+        self.entities = entities # entities can be appended to it later
+        self._columns = None # (batch, batch.version, number of entities, columns of the entities in the batch)
+
+    def columns(self):
+        # The batch that holds all the entities and their columns in it, or (None, None)
+        cached = self._columns
+        if cached is None or cached[0].version != cached[1] or cached[2] != len(self.entities):
+            batch = self.entities[0]._batch if self.entities else None
+            if batch is None or any(entity._batch is not batch for entity in self.entities):
+                return None, None
+            self._columns = cached = (batch, batch.version, len(self.entities), np.array([entity._row for entity in self.entities], dtype=int))
+        return cached[0], cached[3]
+
+    def state(self) -> np.ndarray:
+        # (N, 6) [x, y, heading, vx, vy, friction] of the entities
+        batch, columns = self.columns()
+        if batch is not None:
+            return batch.state[[X, Y, HEADING, VX, VY, FRICTION]][:, columns].T
+        return np.array([[e.center.x, e.center.y, e.heading, e.velocity.x, e.velocity.y, e.friction] for e in self.entities]).reshape(-1, 6)
+
+    def set_controls(self, steering: np.ndarray, throttle: np.ndarray):
+        batch, columns = self.columns()
+        if batch is not None:
+            batch.state[STEERING, columns] = steering
+            batch.state[THROTTLE, columns] = throttle
+        else:
+            for entity, u, a in zip(self.entities, np.broadcast_to(steering, len(self.entities)).tolist(), np.broadcast_to(throttle, len(self.entities)).tolist()):
+                entity.set_control(u, a)
+
+
+# Extra fields of RailDynamics: the lane (index in RailDynamics.lanes), the arc length and lateral offset on it, and the speed
+LANE, S, OFFSET, RAIL_SPEED = range(NUM_FIELDS, NUM_FIELDS + 4)
+
+
+class RailDynamics(BatchedDynamics):
+    # Scripted entities that follow lanes (see road.Lane) at given speeds, e.g. background traffic. Their pose and velocity
+    # are views on the state like in BatchedDynamics, but tick() moves them along their lanes instead of integrating controls.
+    num_fields = NUM_FIELDS + 4
+    
+    def __init__(self, capacity: int = 64):
+        super(RailDynamics, self).__init__(capacity)
+        self.tracks = LaneSet() # the lanes of the entities, LANE is an index in it
+        
+    def attach(self, entity):
+        # The entity must have lane, s, offset and rail_speed attributes, see agents.RailCar
+        lane, s, offset, rail_speed = entity.lane, entity.s, entity.offset, entity.rail_speed
+        super(RailDynamics, self).attach(entity)
+        self.state[LANE, entity._row] = self.tracks.index(lane)
+        self.state[S, entity._row] = s
+        self.state[OFFSET, entity._row] = offset
+        self.state[RAIL_SPEED, entity._row] = rail_speed
+        self.tick(0., [entity._row]) # puts it on its lane
+        
+    def detach(self, entity):
+        entity._s, entity._offset, entity._rail_speed = (float(v) for v in self.state[[S, OFFSET, RAIL_SPEED], entity._row])
+        super(RailDynamics, self).detach(entity)
+        
+    def clone(self) -> 'RailDynamics':
+        batch = super(RailDynamics, self).clone()
+        batch.tracks = LaneSet(self.tracks.lanes)
+        return batch
+        
+    def tick(self, dt: float, rows: np.ndarray = None):
+        rows = np.arange(len(self.entities)) if rows is None else np.asarray(rows, dtype=int)
+        state = self.state[:, rows]
+        lane = state[LANE].astype(int)
+        length = self.tracks.lengths[lane]
+        speed = state[RAIL_SPEED]
+        s = state[S] + speed * dt
+        # Around closed lanes, and up to the ends of open lanes, where they stop
+        closed = self.tracks.closed[lane]
+        speed = np.where(~closed & (((s <= 0) & (speed < 0)) | ((s >= length) & (speed > 0))), 0., speed)
+        s = np.where(closed, np.mod(s, length), np.clip(s, 0, length))
+        points, heading = self.tracks.position(lane, s, state[OFFSET])
+        heading = np.mod(heading, 2*np.pi)
+        self.state[S, rows] = s
+        self.state[X, rows] = points[:, 0]
+        self.state[Y, rows] = points[:, 1]
+        self.state[HEADING, rows] = heading
+        self.state[VX, rows] = speed * np.cos(heading)
+        self.state[VY, rows] = speed * np.sin(heading)
+        self.state[ACCELERATION, rows] = 0.
+        turn = np.mod(heading - state[HEADING] + np.pi, 2*np.pi) - np.pi
+        self.state[ANGULAR_VELOCITY, rows] = turn / dt if dt > 0 else 0.
+        self.step += 1
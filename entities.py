@@ -1,16 +1,63 @@
 import numpy as np
+import math
 from geometry import Point, Rectangle, Circle, Ring
 from typing import Union
 import copy
+import dynamics
+
+# Collision layers. Every entity belongs to some categories and has a mask of the categories it collides with.
+# Two entities can only collide if the category of each one is in the mask of the other.
+CARS, PEDESTRIANS, BUILDINGS, DECORATIONS = 1, 2, 4, 8
+ALL_LAYERS = CARS | PEDESTRIANS | BUILDINGS | DECORATIONS
+
+
+class _Field:
+    # A float attribute of an Entity. It is stored in the entity as _<name>, except while the entity is attached
+    # to a BatchedDynamics: then it is a view on the entity's column of the batch.
+    def __init__(self, field: int, geometry: bool = False):
+        self.field = field
+        self.geometry = geometry # whether the geometry of the entity depends on it
+        
+    def __set_name__(self, owner: type, name: str):
+        self.name = '_' + name
+        
+    def __get__(self, entity: 'Entity', owner: type = None):
+        if entity is None: return self
+        if entity._batch is None: return getattr(entity, self.name)
+        return float(entity._batch.state[self.field, entity._row])
+        
+    def __set__(self, entity: 'Entity', value: float):
+        if entity._batch is None:
+            setattr(entity, self.name, value)
+        else:
+            entity._batch.state[self.field, entity._row] = value
+        if self.geometry:
+            entity._invalidate()
+            Entity.edits += 1
 
 
 class Entity:
+    heading = _Field(dynamics.HEADING, geometry = True)
+    acceleration = _Field(dynamics.ACCELERATION)
+    angular_velocity = _Field(dynamics.ANGULAR_VELOCITY)
+    inputSteering = _Field(dynamics.STEERING)
+    inputAcceleration = _Field(dynamics.THROTTLE)
+    friction = _Field(dynamics.FRICTION)
+    min_speed = _Field(dynamics.MIN_SPEED)
+    max_speed = _Field(dynamics.MAX_SPEED)
+    edits = 0 # counts every change of the pose, size or layers of any entity, so that worlds can tell their caches are out of date
+    
     def __init__(self, center: Point, heading: float, movable: bool = True, friction: float = 0):
+        self._batch = None # the BatchedDynamics that holds the state of this entity, if any
+        self._geometry_step = -1
+        self._invalidate()
         self.center = center # this is x, y
         self.heading = heading
         self.movable = movable
         self.color = 'ghost white'
         self.collidable = True
+        self.category = CARS if movable else BUILDINGS
+        self.mask = CARS | PEDESTRIANS | BUILDINGS
         if movable:
             self.friction = friction
             self.velocity = Point(0,0) # this is xp, yp
@@ -21,6 +68,93 @@ class Entity:
             self.max_speed = np.inf
             self.min_speed = 0
     
+    @property
+    def collidable(self) -> bool:
+        # Entities that cannot collide with anything are left out of the physics entirely
+        return self._collidable and self.category != 0 and self.mask != 0
+        
+    @collidable.setter
+    def collidable(self, collidable: bool):
+        self._collidable = collidable
+        Entity.edits += 1
+        
+    @property
+    def category(self) -> int:
+        return self._category
+        
+    @category.setter
+    def category(self, category: int):
+        self._category = category
+        Entity.edits += 1
+        
+    @property
+    def mask(self) -> int:
+        return self._mask
+        
+    @mask.setter
+    def mask(self, mask: int):
+        self._mask = mask
+        Entity.edits += 1
+        
+    @property
+    def center(self) -> Point:
+        if self._batch is None: return self._center
+        return Point(self._batch.state[dynamics.X, self._row], self._batch.state[dynamics.Y, self._row])
+        
+    @center.setter
+    def center(self, center: Point):
+        if self._batch is None:
+            self._center = center
+        else:
+            self._batch.state[dynamics.X, self._row] = center.x
+            self._batch.state[dynamics.Y, self._row] = center.y
+        self._invalidate()
+        Entity.edits += 1
+            
+    @property
+    def velocity(self) -> Point:
+        if self._batch is None: return self._velocity
+        return Point(self._batch.state[dynamics.VX, self._row], self._batch.state[dynamics.VY, self._row])
+        
+    @velocity.setter
+    def velocity(self, velocity: Point):
+        if self._batch is None:
+            self._velocity = velocity
+        else:
+            self._batch.state[dynamics.VX, self._row] = velocity.x
+            self._batch.state[dynamics.VY, self._row] = velocity.y
+            
+    def _invalidate(self):
+        # Drops the cached geometry, it is built again on first use. Called whenever the center, heading or size change.
+        self._obj = None
+        self._corners = None
+        
+    def _resize(self):
+        # Called whenever the size changes. A batch keeps the rear distance of the entity
+        self._invalidate()
+        Entity.edits += 1
+        if self._batch is not None:
+            self._batch.state[dynamics.REAR_DIST, self._row] = self.rear_dist
+        
+    def _check_geometry(self):
+        # Attached entities are moved by their batch without being told, so their geometry is out of date after every tick
+        if self._batch is not None and self._geometry_step != self._batch.step:
+            self._invalidate()
+            self._geometry_step = self._batch.step
+        
+    @property
+    def obj(self) -> Union[Rectangle, Circle, Ring]:
+        # The geometry of the entity, built lazily
+        self._check_geometry()
+        if self._obj is None:
+            self.buildGeometry()
+        return self._obj
+        
+    @obj.setter
+    def obj(self, obj: Union[Rectangle, Circle, Ring]):
+        self._check_geometry()
+        self._obj = obj
+        
     @property
     def speed(self) -> float:
         return self.velocity.norm(p = 2) if self.movable else 0
@@ -35,7 +169,7 @@ class Entity:
             # only for this function, we assume
             # (i) the longer side of the rectangle is always the nominal direction of the car
             # (ii) the center of mass is the same as the geometric center of the RectangleEntity.
-            return np.maximum(self.size.x, self.size.y) / 2.
+            return max(self.size.x, self.size.y) / 2.
         elif isinstance(self, CircleEntity):
             return self.radius
         elif isinstance(self, RingEntity):
@@ -44,23 +178,28 @@ class Entity:
     
     def tick(self, dt: float):
         if self.movable:
-            speed = self.speed
-            heading = self.heading
+            if self._batch is not None:
+                self._batch.tick(dt, [self._row])
+                return
+            speed = self._velocity.norm(p = 2)
+            heading = self._heading
         
             # Kinematic bicycle model dynamics based on
             # "Kinematic and Dynamic Vehicle Models for Autonomous Driving Control Design" by
             # Jason Kong, Mark Pfeiffer, Georg Schildbach, Francesco Borrelli
+            # Everything below is plain float math (no NumPy scalars, no temporary Points), as this runs for every agent at every step
             lr = self.rear_dist
             lf = lr # we assume the center of mass is the same as the geometric center of the entity
-            beta = np.arctan(lr / (lf + lr) * np.tan(self.inputSteering))
+            beta = math.atan(lr / (lf + lr) * math.tan(self._inputSteering))
             
-            new_angular_velocity = speed * self.inputSteering # this is not needed and used for this model, but let's keep it for consistency (and to avoid if-else statements)
-            new_acceleration = self.inputAcceleration - self.friction
-            new_speed = np.clip(speed + new_acceleration * dt, self.min_speed, self.max_speed)
-            new_heading = heading + ((speed + new_speed)/lr)*np.sin(beta)*dt/2.
+            new_angular_velocity = speed * self._inputSteering # this is not needed and used for this model, but let's keep it for consistency (and to avoid if-else statements)
+            new_acceleration = self._inputAcceleration - self._friction
+            new_speed = min(max(speed + new_acceleration * dt, self._min_speed), self._max_speed)
+            new_heading = heading + ((speed + new_speed)/lr)*math.sin(beta)*dt/2.
             angle = (heading + new_heading)/2. + beta
-            new_center = self.center + (speed + new_speed)*Point(np.cos(angle), np.sin(angle))*dt / 2.
-            new_velocity = Point(new_speed * np.cos(new_heading), new_speed * np.sin(new_heading))
+            displacement = (speed + new_speed)*dt / 2.
+            new_center = Point(self._center.x + displacement*math.cos(angle), self._center.y + displacement*math.sin(angle))
+            new_velocity = Point(new_speed * math.cos(new_heading), new_speed * math.sin(new_heading))
             
             '''
             # Point-mass dynamics based on
@@ -80,13 +219,19 @@ class Entity:
             
             '''
             
-            self.center = new_center
-            self.heading = np.mod(new_heading, 2*np.pi) # wrap the heading angle between 0 and +2pi
-            self.velocity = new_velocity
-            self.acceleration = new_acceleration
-            self.angular_velocity = new_angular_velocity
+            self._center = new_center
+            self._heading = new_heading % (2*math.pi) # wrap the heading angle between 0 and +2pi
+            self._velocity = new_velocity
+            self._acceleration = new_acceleration
+            self._angular_velocity = new_angular_velocity
             
-            self.buildGeometry()
+            self._invalidate()
+    
+    def _at_rest(self, dt: float) -> bool:
+        # Whether tick(dt) would leave this (not attached) entity exactly as it is: it stands still and its controls keep it so
+        acceleration = self._inputAcceleration - self._friction
+        return (self._velocity.x == 0 and self._velocity.y == 0 and self._acceleration == acceleration and self._angular_velocity == 0
+                and min(max(acceleration * dt, self._min_speed), self._max_speed) == 0 and 0 <= self._heading < 2*math.pi)
     
     def buildGeometry(self): # builds the obj
         raise NotImplementedError
@@ -106,7 +251,21 @@ class Entity:
         raise NotImplementedError
         
     def copy(self):
-        return copy.deepcopy(self)
+        if self._batch is None:
+            return copy.deepcopy(self)
+        # The copy of an attached entity is not attached, it gets the current state as plain attributes (and not a copy of the whole batch)
+        batch, self._batch = self._batch, None
+        try:
+            clone = copy.deepcopy(self)
+        finally:
+            self._batch = batch
+        dynamics.set_entity_state(clone, batch.state[:, self._row].tolist())
+        clone._invalidate()
+        return clone
+        
+    @property
+    def aabb(self) -> tuple: # (xmin, ymin, xmax, ymax) of the current geometry
+        return self.obj.aabb
         
     @property
     def x(self):
@@ -128,7 +287,15 @@ class RectangleEntity(Entity):
     def __init__(self, center: Point, heading: float, size: Point, movable: bool = True, friction: float = 0):
         super(RectangleEntity, self).__init__(center, heading, movable, friction)
         self.size = size
-        self.buildGeometry()
+        
+    @property
+    def size(self) -> Point:
+        return self._size
+        
+    @size.setter
+    def size(self, size: Point):
+        self._size = size
+        self._resize()
     
     @property
     def edge_centers(self):
@@ -145,14 +312,25 @@ class RectangleEntity(Entity):
         
     @property
     def corners(self):
-        ec = self.edge_centers
-        c = np.array([self.center.x, self.center.y])
-        corners = []
-        corners.append(Point(*(ec[1] + ec[0] - c)))
-        corners.append(Point(*(ec[2] + ec[1] - c)))
-        corners.append(Point(*(ec[3] + ec[2] - c)))
-        corners.append(Point(*(ec[0] + ec[3] - c)))
-        return corners
+        self._check_geometry()
+        if self._corners is None:
+            self._corners = self._buildCorners()
+        return self._corners
+        
+    def _buildCorners(self):
+        # Each corner is the sum of two adjacent edge centers minus the center, written out in floats
+        x = self.center.x
+        y = self.center.y
+        c = math.cos(self.heading)
+        s = math.sin(self.heading)
+        wc = self.size.x / 2. * c
+        ws = self.size.x / 2. * s
+        hc = self.size.y / 2. * c
+        hs = self.size.y / 2. * s
+        return [Point(x + wc - hs, y + ws + hc),
+                Point(x - wc - hs, y - ws + hc),
+                Point(x - wc + hs, y - ws - hc),
+                Point(x + wc + hs, y + ws - hc)]
         
     def buildGeometry(self):
         C = self.corners
@@ -162,7 +340,15 @@ class CircleEntity(Entity):
     def __init__(self, center: Point, heading: float, radius: float, movable: bool = True, friction: float = 0):
         super(CircleEntity, self).__init__(center, heading, movable, friction)
         self.radius = radius
-        self.buildGeometry()
+        
+    @property
+    def radius(self) -> float:
+        return self._radius
+        
+    @radius.setter
+    def radius(self, radius: float):
+        self._radius = radius
+        self._resize()
         
     def buildGeometry(self):
         self.obj = Circle(self.center, self.radius)
@@ -172,7 +358,24 @@ class RingEntity(Entity):
         super(RingEntity, self).__init__(center, heading, movable, friction)
         self.inner_radius = inner_radius
         self.outer_radius = outer_radius
-        self.buildGeometry()
+        
+    @property
+    def inner_radius(self) -> float:
+        return self._inner_radius
+        
+    @inner_radius.setter
+    def inner_radius(self, inner_radius: float):
+        self._inner_radius = inner_radius
+        self._resize()
+        
+    @property
+    def outer_radius(self) -> float:
+        return self._outer_radius
+        
+    @outer_radius.setter
+    def outer_radius(self, outer_radius: float):
+        self._outer_radius = outer_radius
+        self._resize()
         
     def buildGeometry(self):
         self.obj = Ring(self.center, self.inner_radius, self.outer_radius)
\ No newline at end of file
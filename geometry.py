@@ -1,8 +1,76 @@
 import numpy as np
+import math
 from typing import Union
 
+# Every shape below carries an axis-aligned bounding box (xmin, ymin, xmax, ymax) that is computed on first use.
+# The intersection tests check the boxes before doing the exact math. These counters tell how often that paid off,
+# set them back to 0 to start a new measurement.
+aabb_stats = {'checks': 0, 'skipped': 0}
+
+def aabbsAreDisjoint(a: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring'], b: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> bool:
+    A = a.aabb
+    B = b.aabb
+    aabb_stats['checks'] += 1
+    if A[0] > B[2] or B[0] > A[2] or A[1] > B[3] or B[1] > A[3]:
+        aabb_stats['skipped'] += 1
+        return True
+    return False
+
+
+# Scalar kernels on plain floats. The methods below unpack their Points once and call these,
+# so that the hot paths neither allocate temporary Points nor go through NumPy scalar math.
+
+def _segmentDistance(px: float, py: float, ax: float, ay: float, bx: float, by: float) -> float:
+    # Distance from (px, py) to the segment from (ax, ay) to (bx, by), based on https://math.stackexchange.com/a/330329
+    dx = bx - ax
+    dy = by - ay
+    that = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    tstar = min(1., max(0., that))
+    ex = ax + tstar * dx - px
+    ey = ay + tstar * dy - py
+    return math.sqrt(ex * ex + ey * ey)
+
+def _insideRectangle(px: float, py: float, ax: float, ay: float, bx: float, by: float, cx: float, cy: float) -> bool:
+    # Whether (px, py) is inside the rectangle with consecutive corners a, b, c. Based on https://stackoverflow.com/a/2763387
+    abx = bx - ax
+    aby = by - ay
+    bcx = cx - bx
+    bcy = cy - by
+    abam = abx * (px - ax) + aby * (py - ay)
+    bcbm = bcx * (px - bx) + bcy * (py - by)
+    return 0 <= abam <= abx * abx + aby * aby and 0 <= bcbm <= bcx * bcx + bcy * bcy
+
+def _orientation(px: float, py: float, qx: float, qy: float, rx: float, ry: float) -> int:
+    # Same as orientation() below
+    val = (qy - py) * (rx - qx) - (qx - px) * (ry - qy)
+    if val == 0: return 0
+    return 1 if val > 0 else 2
+
+def _onSegment(px: float, py: float, qx: float, qy: float, rx: float, ry: float) -> bool:
+    # Same as onSegment() below
+    return min(px, rx) <= qx <= max(px, rx) and min(py, ry) <= qy <= max(py, ry)
+
+def _segmentsIntersect(p1x: float, p1y: float, q1x: float, q1y: float, p2x: float, p2y: float, q2x: float, q2y: float) -> bool:
+    # Based on https://www.geeksforgeeks.org/check-if-two-given-line-segments-intersect/
+    o1 = _orientation(p1x, p1y, q1x, q1y, p2x, p2y)
+    o2 = _orientation(p1x, p1y, q1x, q1y, q2x, q2y)
+    o3 = _orientation(p2x, p2y, q2x, q2y, p1x, p1y)
+    o4 = _orientation(p2x, p2y, q2x, q2y, q1x, q1y)
+    
+    # General case
+    if o1 != o2 and o3 != o4: return True
+    
+    # Special cases: one endpoint is colinear with, and lies on, the other segment
+    if o1 == 0 and _onSegment(p1x, p1y, p2x, p2y, q1x, q1y): return True
+    if o2 == 0 and _onSegment(p1x, p1y, q2x, q2y, q1x, q1y): return True
+    if o3 == 0 and _onSegment(p2x, p2y, p1x, p1y, q2x, q2y): return True
+    if o4 == 0 and _onSegment(p2x, p2y, q1x, q1y, q2x, q2y): return True
+    return False
+
 
 class Point:
+    __slots__ = ('x', 'y')
+    
     def __init__(self, x: float, y: float):
         self.x = float(x)
         self.y = float(y)
@@ -10,6 +78,10 @@ class Point:
     def __str__(self):
         return 'Point(' + str(self.x) + ', ' + str(self.y) + ')'
         
+    @property
+    def aabb(self) -> tuple:
+        return (self.x, self.y, self.x, self.y)
+        
     def __add__(self, other: 'Point') -> 'Point':
         return Point(self.x + other.x, self.y + other.y)
         
@@ -17,6 +89,7 @@ class Point:
         return Point(self.x - other.x, self.y - other.y)
     
     def norm(self, p: int = 2) -> float:
+        if p == 2: return math.sqrt(self.x * self.x + self.y * self.y)
         return (self.x ** p + self.y ** p)**(1./p)
         
     def dot(self, other: 'Point') -> float:
@@ -39,13 +112,8 @@ class Point:
             return np.close(np.abs(AM.dot(BM)), AM.length * MB.length)
         
         elif isinstance(other, Rectangle):
-            # Based on https://stackoverflow.com/a/2763387
-            AB = Line(other.c1, other.c2)
-            AM = Line(other.c1, self)
-            BC = Line(other.c2, other.c3)
-            BM = Line(other.c2, self)
-        
-            return 0 <= AB.dot(AM) <= AB.dot(AB) and 0 <= BC.dot(BM) <= BC.dot(BC)
+            if aabbsAreDisjoint(self, other): return False
+            return _insideRectangle(self.x, self.y, other.c1.x, other.c1.y, other.c2.x, other.c2.y, other.c3.x, other.c3.y)
             
         elif isinstance(other, Circle):
             return self.distanceTo(other.m) <= other.r
@@ -71,43 +139,14 @@ class Point:
         return direction.dot(p - self) <= 0
                     
     def distanceTo(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> float:
-        if isinstance(other, Point):
-            return (self - other).norm(p = 2)
-    
-        elif isinstance(other, Line):
-            # Based on https://math.stackexchange.com/a/330329
-            s2_minus_s1 = other.p2 - other.p1
-            that = (self - other.p1).dot(s2_minus_s1) / s2_minus_s1.dot(s2_minus_s1)
-            tstar = np.minimum(1, np.maximum(0, that))
-            return (other.p1 + tstar * s2_minus_s1 - self).norm(p = 2)
-        
-        elif isinstance(other, Rectangle):
-            if self.isInside(other): return 0
-            E = other.edges
-            return np.min([self.distanceTo(e) for e in E])
-        
-        elif isinstance(other, Circle):
-            return np.maximum(0, self.distanceTo(other.m) - other.r)
-            
-        elif isinstance(other, Ring):
-            d = self.distanceTo(other.m)
-            return np.max([r_inner - d, d - r_outer, 0])
-            
-        else:
-            try:
-                return other.distanceTo(self) # do we really need to try this? Does it ever succeed?
-            except NameError:
-                raise NotImplementedError
-            print('Something went wrong!')
-            raise
+        return _dispatch(_DISTANCES, self, other)(self, other)
         
 '''
 Given three colinear points p, q, r, the function checks if 
 point q lies on line segment 'pr' 
 '''
 def onSegment(p: Point, q: Point, r: Point) -> bool:
-    return (q.x <= np.maximum(p.x, r.x) and q.x >= np.minimum(p.x, r.x) and 
-        q.y <= np.maximum(p.y, r.y) and q.y >= np.minimum(p.y, r.y)) 
+    return _onSegment(p.x, p.y, q.x, q.y, r.x, r.y)
   
 '''
 To find orientation of ordered triplet (p, q, r). 
@@ -117,67 +156,27 @@ The function returns following values
 2 --> Counterclockwise 
 '''
 def orientation(p: Point, q: Point, r: Point) -> int:
-    # See https://www.geeksforgeeks.org/orientation-3-ordered-points/ for details of below formula. 
-    val = (q.y - p.y) * (r.x - q.x) - (q.x - p.x) * (r.y - q.y)
-    if val == 0: return 0 # colinear 
-    return 1 if val > 0 else 2 # clock or counterclock wise 
+    # See https://www.geeksforgeeks.org/orientation-3-ordered-points/ for details of the formula.
+    return _orientation(p.x, p.y, q.x, q.y, r.x, r.y)
         
         
 class Line:
     def __init__(self, p1: Point, p2: Point):
         self.p1 = p1
         self.p2 = p2
+        self._aabb = None
         
     def __str__(self):
         return 'Line(' + str(self.p1) +  ', ' + str(self.p2) + ')'
         
+    @property
+    def aabb(self) -> tuple:
+        if self._aabb is None:
+            self._aabb = (min(self.p1.x, self.p2.x), min(self.p1.y, self.p2.y), max(self.p1.x, self.p2.x), max(self.p1.y, self.p2.y))
+        return self._aabb
+        
     def intersectsWith(self, other: Union['Line','Rectangle','Circle','Ring']):
-        if isinstance(other, Line):
-            p1 = self.p1
-            q1 = self.p2
-            p2 = other.p1
-            q2 = other.p2
-        
-            # Based on https://www.geeksforgeeks.org/check-if-two-given-line-segments-intersect/
-            # Find the four orientations needed for general and special cases 
-            o1 = orientation(p1, q1, p2) 
-            o2 = orientation(p1, q1, q2) 
-            o3 = orientation(p2, q2, p1) 
-            o4 = orientation(p2, q2, q1)
-      
-            # General case 
-            if o1 != o2 and o3 != o4:
-                return True
-
-            # Special Cases 
-            # p1, q1 and p2 are colinear and p2 lies on segment p1q1 
-            if o1 == 0 and onSegment(p1, p2, q1): return True
-      
-            # p1, q1 and q2 are colinear and q2 lies on segment p1q1 
-            if o2 == 0 and onSegment(p1, q2, q1): return True
-      
-            # p2, q2 and p1 are colinear and p1 lies on segment p2q2
-            if o3 == 0 and onSegment(p2, p1, q2): return True
-      
-            # p2, q2 and q1 are colinear and q1 lies on segment p2q2
-            if o4 == 0 and onSegment(p2, q1, q2): return True
-      
-            return False # Doesn't fall in any of the above cases 
-            
-        elif isinstance(other, Rectangle):
-            if self.p1.isInside(other) or self.p2.isInside(other): return True
-            E = other.edges
-            for edge in E:
-                if self.intersectsWith(edge): return True
-            return False
-            
-        elif isinstance(other, Circle):
-            return other.m.distanceTo(self) <= other.r
-            
-        elif isinstance(other, Ring):
-            return (other.m.distanceTo(self.p1) >= other.r_inner or other.m.distanceTo(self.p2) >= other.r_inner) and other.m.distanceTo(self) < other.r_outer
-            
-        raise NotImplementedError
+        return _dispatch(_INTERSECTIONS, self, other)(self, other)
         
     @property
     def length(self):
@@ -193,31 +192,7 @@ class Line:
         return p.hasPassed(other, direction)
         
     def distanceTo(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> float:
-        if isinstance(other, Point):
-            return other.distanceTo(self)
-            
-        elif isinstance(other, Line):
-            if self.intersectsWith(other): return 0.
-            return np.min([self.p1.distanceTo(other.p1), self.p1.distanceTo(other.p2), self.p2.distanceTo(other.p1), self.p2.distanceTo(other.p2)])
-            
-        elif isinstance(other, Rectangle):
-            if self.intersectsWith(other): return 0.
-            other_edges = other.edges
-            return np.min([self.distanceTo(e) for e in other_edges])
-            
-        elif isinstance(other, Circle):
-            return np.maximum(0, other.m.distanceTo(self) - other.r)
-            
-        elif isinstance(other, Ring):
-            if self.intersectsWith(other): return 0.
-            p1m = self.p1.distanceTo(other.m)
-            if p1m < other.r_inner: # the line is inside the ring
-                p2m = self.p2.distanceTo(other.m)
-                return other.r_inner - np.maximum(p1m, p2m)
-            else: # the line is completely outside
-                return np.maximum(0, other.m.distanceTo(self) - other.r_outer)   
-                
-        raise NotImplementedError
+        return _dispatch(_DISTANCES, self, other)(self, other)
 
 class Rectangle:
     def __init__(self, c1: Point, c2: Point, c3: Point): # 3 points are enough to represent a rectangle
@@ -225,10 +200,19 @@ class Rectangle:
         self.c2 = c2
         self.c3 = c3
         self.c4 = c3 + c1 - c2
+        self._aabb = None
         
     def __str__(self):
         return 'Rectangle(' + str(self.c1) +  ', ' + str(self.c2) +  ', ' + str(self.c3) +  ', ' + str(self.c4) + ')'
         
+    @property
+    def aabb(self) -> tuple:
+        if self._aabb is None:
+            xs = [self.c1.x, self.c2.x, self.c3.x, self.c4.x]
+            ys = [self.c1.y, self.c2.y, self.c3.y, self.c4.y]
+            self._aabb = (min(xs), min(ys), max(xs), max(ys))
+        return self._aabb
+        
     @property
     def edges(self):
         e1 = Line(self.c1, self.c2)
@@ -242,69 +226,39 @@ class Rectangle:
         return [self.c1, self.c2, self.c3, self.c4]
         
     def intersectsWith(self, other: Union['Line', 'Rectangle', 'Circle', 'Ring']) -> bool:
-        if isinstance(other, Line):
-            return other.intersectsWith(self)
-            
-        elif isinstance(other, Rectangle) or isinstance(other, Circle) or isinstance(other, Ring):
-            E = self.edges
-            for e in E:
-                if e.intersectsWith(other): return True
-            return False
-
-        raise NotImplementedError
+        return _dispatch(_INTERSECTIONS, self, other)(self, other)
         
     def hasPassed(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring'], direction: Point) -> bool:
         p = (self.c1 + self.c2 + self.c3 + self.c4) / 4.
         return p.hasPassed(other, direction)
         
     def distanceTo(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> float:
-        if isinstance(other, Point) or isinstance(other, Line):
-            return other.distanceTo(self)
-
-        elif isinstance(other, Rectangle) or isinstance(other, Circle) or isinstance(other, Ring):
-            if self.intersectsWith(other): return 0.
-            E = self.edges
-            return np.min([e.distanceTo(other) for e in E])
-
-        raise NotImplementedError # TODO: implement the other cases
+        return _dispatch(_DISTANCES, self, other)(self, other)
         
     
 class Circle:
     def __init__(self, m: Point, r: float):
         self.m = m
         self.r = r
+        self._aabb = None
         
     def __str__(self):
         return 'Circle(' + str(self.m) +  ', radius = ' + str(self.r) + ')'
         
+    @property
+    def aabb(self) -> tuple:
+        if self._aabb is None:
+            self._aabb = (self.m.x - self.r, self.m.y - self.r, self.m.x + self.r, self.m.y + self.r)
+        return self._aabb
+        
     def intersectsWith(self, other: Union['Line', 'Rectangle', 'Circle', 'Ring']):
-        if isinstance(other, Line) or isinstance(other, Rectangle):
-            return other.intersectsWith(self)
-            
-        elif isinstance(other, Circle):
-            return self.m.distanceTo(other.m) <= self.r + other.r
-            
-        elif isinstance(other, Ring):
-            return other.r_inner - self.r <= self.m.distanceTo(other.m) <= self.r + other.r_outer
-            
-        raise NotImplementedError
+        return _dispatch(_INTERSECTIONS, self, other)(self, other)
         
     def hasPassed(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring'], direction: Point) -> bool:
         return self.m.hasPassed(other, direction)
         
     def distanceTo(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> float:
-        if isinstance(other, Point) or isinstance(other, Line) or isinstance(other, Rectangle):
-            return other.distanceTo(self)
-            
-        elif isinstance(other, Circle):
-            return np.maximum(0, self.m.distanceTo(other.m) - self.r - other.r)
-            
-        elif isinstance(other, Ring):
-            if self.intersectsWith(other): return 0.
-            d = self.m.distanceTo(other.m)
-            return np.maximum(other.r_inner - d, d - other.r_outer) - self.r
-            
-        raise NotImplementedError
+        return _dispatch(_DISTANCES, self, other)(self, other)
             
             
 class Ring:
@@ -313,34 +267,228 @@ class Ring:
         assert r_inner < r_outer
         self.r_inner = r_inner
         self.r_outer = r_outer
+        self._aabb = None
         
     def __str__(self):
         return 'Ring(' + str(self.m) +  ', inner radius = ' + str(self.r_inner) +  ', outer radius = ' + str(self.r_outer) + ')'
         
+    @property
+    def aabb(self) -> tuple:
+        if self._aabb is None:
+            self._aabb = (self.m.x - self.r_outer, self.m.y - self.r_outer, self.m.x + self.r_outer, self.m.y + self.r_outer)
+        return self._aabb
+        
     def intersectsWith(self, other: Union['Line', 'Rectangle', 'Circle', 'Ring']):
-        if isinstance(other, Line) or isinstance(other, Rectangle) or isinstance(other, Circle):
-            return other.intersectsWith(self)
-            
-        elif isinstance(other, Ring):
-            d = self.m.distanceTo(other.m)
-            if d > self.r_outer + other.r_outer: return False # rings are far away
-            if d + self.r_outer < other.r_inner: return False # self is completely inside other
-            if d + other.r_outer < self.r_inner: return False # other is completely inside self
-            return True
-            
-        raise NotImplementedError
+        return _dispatch(_INTERSECTIONS, self, other)(self, other)
         
     def hasPassed(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring'], direction: Point) -> bool:
         return self.m.hasPassed(other, direction)
         
     def distanceTo(self, other: Union['Point', 'Line', 'Rectangle', 'Circle', 'Ring']) -> float:
-        if isinstance(other, Point) or isinstance(other, Line) or isinstance(other, Rectangle) or isinstance(other, Circle):
-            return other.distanceTo(self)
-            
-        if isinstance(other, Ring):
-            if d > self.r_outer + other.r_outer: return d - self.r_outer - other.r_outer # rings are far away
-            if d + self.r_outer < other.r_inner: return other.r_inner - d - self.r_outer # self is completely inside other
-            if d + other.r_outer < self.r_inner: return self.r_inner - d - other.r_outer # other is completely inside self
-            return 0
-            
-        raise NotImplementedError # TODO: implement the other cases
\ No newline at end of file
+        return _dispatch(_DISTANCES, self, other)(self, other)
+
+
+# Double dispatch for intersectsWith and distanceTo. These tables map (type of a, type of b) straight to the kernel that
+# answers a.intersectsWith(b) or a.distanceTo(b), so a query never bounces between classes. The kernels work on plain
+# floats like the ones above, and do the same math as the method cascades they replace.
+
+_INTERSECTIONS = {}
+_DISTANCES = {}
+
+def _register(table: dict, type_a: type, type_b: type, kernel):
+    table[type_a, type_b] = kernel
+    if type_a is not type_b:
+        table[type_b, type_a] = lambda a, b: kernel(b, a)
+
+def _dispatch(table: dict, a, b):
+    kernel = table.get((a.__class__, b.__class__))
+    if kernel is None:
+        # Subclasses of the shapes use the kernel of the registered classes they derive from
+        for (type_a, type_b), k in list(table.items()):
+            if isinstance(a, type_a) and isinstance(b, type_b):
+                kernel = table[a.__class__, b.__class__] = k
+                break
+        else:
+            raise NotImplementedError
+    return kernel
+
+def _pointDistance(ax: float, ay: float, bx: float, by: float) -> float:
+    dx = ax - bx
+    dy = ay - by
+    return math.sqrt(dx * dx + dy * dy)
+
+def _pointInRectangle(px: float, py: float, r: 'Rectangle') -> bool:
+    A = r.aabb
+    if px < A[0] or px > A[2] or py < A[1] or py > A[3]: return False
+    return _insideRectangle(px, py, r.c1.x, r.c1.y, r.c2.x, r.c2.y, r.c3.x, r.c3.y)
+
+def _edges(r: 'Rectangle') -> tuple:
+    # The edges of r as (ax, ay, bx, by) tuples, in the same order as Rectangle.edges
+    c1, c2, c3, c4 = r.c1, r.c2, r.c3, r.c4
+    return ((c1.x, c1.y, c2.x, c2.y), (c2.x, c2.y, c3.x, c3.y), (c3.x, c3.y, c4.x, c4.y), (c4.x, c4.y, c1.x, c1.y))
+
+def _endpointDistance(ax: float, ay: float, bx: float, by: float, cx: float, cy: float, dx: float, dy: float) -> float:
+    # Distance between two segments that do not intersect: the closest pair of points always includes an endpoint
+    return min(_segmentDistance(ax, ay, cx, cy, dx, dy), _segmentDistance(bx, by, cx, cy, dx, dy),
+               _segmentDistance(cx, cy, ax, ay, bx, by), _segmentDistance(dx, dy, ax, ay, bx, by))
+
+def _segmentRingDistance(ax: float, ay: float, bx: float, by: float, ring: 'Ring') -> float:
+    # Distance from a segment that does not intersect the ring
+    m = ring.m
+    p1m = _pointDistance(ax, ay, m.x, m.y)
+    if p1m < ring.r_inner: # the segment is inside the ring
+        return ring.r_inner - max(p1m, _pointDistance(bx, by, m.x, m.y))
+    return max(0., _segmentDistance(m.x, m.y, ax, ay, bx, by) - ring.r_outer) # the segment is completely outside
+
+
+def _lineLineIntersects(a: Line, b: Line) -> bool:
+    if aabbsAreDisjoint(a, b): return False
+    return _segmentsIntersect(a.p1.x, a.p1.y, a.p2.x, a.p2.y, b.p1.x, b.p1.y, b.p2.x, b.p2.y)
+
+def _lineRectangleIntersects(l: Line, r: Rectangle) -> bool:
+    if aabbsAreDisjoint(l, r): return False
+    px, py, qx, qy = l.p1.x, l.p1.y, l.p2.x, l.p2.y
+    if _pointInRectangle(px, py, r) or _pointInRectangle(qx, qy, r): return True
+    for ax, ay, bx, by in _edges(r):
+        if _segmentsIntersect(px, py, qx, qy, ax, ay, bx, by): return True
+    return False
+
+def _lineCircleIntersects(l: Line, c: Circle) -> bool:
+    if aabbsAreDisjoint(l, c): return False
+    return _segmentDistance(c.m.x, c.m.y, l.p1.x, l.p1.y, l.p2.x, l.p2.y) <= c.r
+
+def _segmentRingIntersects(ax: float, ay: float, bx: float, by: float, ring: 'Ring') -> bool:
+    mx, my = ring.m.x, ring.m.y
+    return (_pointDistance(mx, my, ax, ay) >= ring.r_inner or _pointDistance(mx, my, bx, by) >= ring.r_inner) and _segmentDistance(mx, my, ax, ay, bx, by) < ring.r_outer
+
+def _lineRingIntersects(l: Line, ring: Ring) -> bool:
+    if aabbsAreDisjoint(l, ring): return False
+    return _segmentRingIntersects(l.p1.x, l.p1.y, l.p2.x, l.p2.y, ring)
+
+def _rectangleRectangleIntersects(a: Rectangle, b: Rectangle) -> bool:
+    if aabbsAreDisjoint(a, b): return False
+    edges_b = _edges(b)
+    for px, py, qx, qy in _edges(a):
+        if _pointInRectangle(px, py, b) or _pointInRectangle(qx, qy, b): return True
+        for ax, ay, bx, by in edges_b:
+            if _segmentsIntersect(px, py, qx, qy, ax, ay, bx, by): return True
+    return _pointInRectangle(b.c1.x, b.c1.y, a) # b might still be completely inside a
+
+def _rectangleCircleIntersects(r: Rectangle, c: Circle) -> bool:
+    # The circle touches the rectangle iff its center is inside, or close enough to one of the edges
+    if aabbsAreDisjoint(r, c): return False
+    mx, my = c.m.x, c.m.y
+    for ax, ay, bx, by in _edges(r):
+        if _segmentDistance(mx, my, ax, ay, bx, by) <= c.r: return True
+    return _pointInRectangle(mx, my, r)
+
+def _rectangleRingIntersects(r: Rectangle, ring: Ring) -> bool:
+    if aabbsAreDisjoint(r, ring): return False
+    for ax, ay, bx, by in _edges(r):
+        if _segmentRingIntersects(ax, ay, bx, by, ring): return True
+    # None of the edges touch the ring. The rectangle can still cover the ring if it surrounds its center
+    if _pointInRectangle(ring.m.x, ring.m.y, r):
+        return max(_pointDistance(c.x, c.y, ring.m.x, ring.m.y) for c in r.corners) >= ring.r_inner
+    return False
+
+def _circleCircleIntersects(a: Circle, b: Circle) -> bool:
+    if aabbsAreDisjoint(a, b): return False
+    return _pointDistance(a.m.x, a.m.y, b.m.x, b.m.y) <= a.r + b.r
+
+def _circleRingIntersects(c: Circle, ring: Ring) -> bool:
+    if aabbsAreDisjoint(c, ring): return False
+    return ring.r_inner - c.r <= _pointDistance(c.m.x, c.m.y, ring.m.x, ring.m.y) <= c.r + ring.r_outer
+
+def _ringRingIntersects(a: Ring, b: Ring) -> bool:
+    if aabbsAreDisjoint(a, b): return False
+    d = _pointDistance(a.m.x, a.m.y, b.m.x, b.m.y)
+    if d > a.r_outer + b.r_outer: return False # rings are far away
+    if d + a.r_outer < b.r_inner: return False # a is completely inside b
+    if d + b.r_outer < a.r_inner: return False # b is completely inside a
+    return True
+
+
+def _pointPointDistance(a: Point, b: Point) -> float:
+    return _pointDistance(a.x, a.y, b.x, b.y)
+
+def _pointLineDistance(p: Point, l: Line) -> float:
+    return _segmentDistance(p.x, p.y, l.p1.x, l.p1.y, l.p2.x, l.p2.y)
+
+def _pointRectangleDistance(p: Point, r: Rectangle) -> float:
+    if _pointInRectangle(p.x, p.y, r): return 0
+    return min(_segmentDistance(p.x, p.y, ax, ay, bx, by) for ax, ay, bx, by in _edges(r))
+
+def _pointCircleDistance(p: Point, c: Circle) -> float:
+    return max(0., _pointDistance(p.x, p.y, c.m.x, c.m.y) - c.r)
+
+def _pointRingDistance(p: Point, ring: Ring) -> float:
+    d = _pointDistance(p.x, p.y, ring.m.x, ring.m.y)
+    return max(ring.r_inner - d, d - ring.r_outer, 0.)
+
+def _lineLineDistance(a: Line, b: Line) -> float:
+    if _lineLineIntersects(a, b): return 0.
+    return _endpointDistance(a.p1.x, a.p1.y, a.p2.x, a.p2.y, b.p1.x, b.p1.y, b.p2.x, b.p2.y)
+
+def _lineRectangleDistance(l: Line, r: Rectangle) -> float:
+    if _lineRectangleIntersects(l, r): return 0.
+    return min(_endpointDistance(l.p1.x, l.p1.y, l.p2.x, l.p2.y, ax, ay, bx, by) for ax, ay, bx, by in _edges(r))
+
+def _lineCircleDistance(l: Line, c: Circle) -> float:
+    return max(0., _segmentDistance(c.m.x, c.m.y, l.p1.x, l.p1.y, l.p2.x, l.p2.y) - c.r)
+
+def _lineRingDistance(l: Line, ring: Ring) -> float:
+    if _lineRingIntersects(l, ring): return 0.
+    return _segmentRingDistance(l.p1.x, l.p1.y, l.p2.x, l.p2.y, ring)
+
+def _rectangleRectangleDistance(a: Rectangle, b: Rectangle) -> float:
+    if _rectangleRectangleIntersects(a, b): return 0.
+    edges_b = _edges(b)
+    return min(_endpointDistance(px, py, qx, qy, ax, ay, bx, by) for px, py, qx, qy in _edges(a) for ax, ay, bx, by in edges_b)
+
+def _rectangleCircleDistance(r: Rectangle, c: Circle) -> float:
+    if _rectangleCircleIntersects(r, c): return 0.
+    return max(0., min(_segmentDistance(c.m.x, c.m.y, ax, ay, bx, by) for ax, ay, bx, by in _edges(r)) - c.r)
+
+def _rectangleRingDistance(r: Rectangle, ring: Ring) -> float:
+    if _rectangleRingIntersects(r, ring): return 0.
+    return min(_segmentRingDistance(ax, ay, bx, by, ring) for ax, ay, bx, by in _edges(r))
+
+def _circleCircleDistance(a: Circle, b: Circle) -> float:
+    return max(0., _pointDistance(a.m.x, a.m.y, b.m.x, b.m.y) - a.r - b.r)
+
+def _circleRingDistance(c: Circle, ring: Ring) -> float:
+    if _circleRingIntersects(c, ring): return 0.
+    d = _pointDistance(c.m.x, c.m.y, ring.m.x, ring.m.y)
+    return max(ring.r_inner - d, d - ring.r_outer) - c.r
+
+def _ringRingDistance(a: Ring, b: Ring) -> float:
+    d = _pointDistance(a.m.x, a.m.y, b.m.x, b.m.y)
+    if d > a.r_outer + b.r_outer: return d - a.r_outer - b.r_outer # rings are far away
+    if d + a.r_outer < b.r_inner: return b.r_inner - d - a.r_outer # a is completely inside b
+    if d + b.r_outer < a.r_inner: return a.r_inner - d - b.r_outer # b is completely inside a
+    return 0
+
+
+for type_a, type_b, kernel in [(Line, Line, _lineLineIntersects), (Line, Rectangle, _lineRectangleIntersects),
+                               (Line, Circle, _lineCircleIntersects), (Line, Ring, _lineRingIntersects),
+                               (Rectangle, Rectangle, _rectangleRectangleIntersects), (Rectangle, Circle, _rectangleCircleIntersects),
+                               (Rectangle, Ring, _rectangleRingIntersects), (Circle, Circle, _circleCircleIntersects),
+                               (Circle, Ring, _circleRingIntersects), (Ring, Ring, _ringRingIntersects)]:
+    _register(_INTERSECTIONS, type_a, type_b, kernel)
+
+for type_a, type_b, kernel in [(Point, Point, _pointPointDistance), (Point, Line, _pointLineDistance),
+                               (Point, Rectangle, _pointRectangleDistance), (Point, Circle, _pointCircleDistance),
+                               (Point, Ring, _pointRingDistance), (Line, Line, _lineLineDistance),
+                               (Line, Rectangle, _lineRectangleDistance), (Line, Circle, _lineCircleDistance),
+                               (Line, Ring, _lineRingDistance), (Rectangle, Rectangle, _rectangleRectangleDistance),
+                               (Rectangle, Circle, _rectangleCircleDistance), (Rectangle, Ring, _rectangleRingDistance),
+                               (Circle, Circle, _circleCircleDistance), (Circle, Ring, _circleRingDistance),
+                               (Ring, Ring, _ringRingDistance)]:
+    _register(_DISTANCES, type_a, type_b, kernel)
+
+
+def distanceMatrix(sources: Union[np.ndarray, list], targets: list) -> np.ndarray:
+    # Returns the N x M matrix of distances between N sources and M target shapes (Rectangle, Circle or Ring).
+    # sources is either an N x 2 array of points or a list of shapes. The entries agree with distanceTo.
+    from collision import distance_matrix # the vectorized kernels live in collision.py, which is built on top of this module
+    return distance_matrix(sources, targets)
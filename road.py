@@ -0,0 +1,283 @@
+import numpy as np
+from geometry import Point, Line
+from typing import Union
+
+# Lane centerlines, made of straight (geometry.Line) and circular pieces, with Frenet projection:
+#   s:             arc length along the centerline, from its start
+#   d:             signed lateral offset from the centerline, positive to the left
+#   heading error: heading minus the direction of the centerline at s, in [-pi, pi)
+
+LINE, ARC = 0, 1
+
+
+def wrap_angle(a: np.ndarray) -> np.ndarray:
+    return np.mod(a + np.pi, 2*np.pi) - np.pi
+
+
+def segment_positions(kinds: np.ndarray, params: np.ndarray, t: np.ndarray, d: np.ndarray):
+    # Points at arc length t along segments given by their kinds and params (see Lane._build) and offset d to their left,
+    # and the headings of the segments there
+    points = np.zeros((len(t), 2))
+    heading = np.zeros(len(t))
+    line = kinds == LINE
+    heading[line] = np.arctan2(params[line, 3], params[line, 2])
+    points[line] = params[line, :2] + t[line, None] * params[line, 2:4]
+    arc = ~line
+    direction = np.sign(params[arc, 4])
+    angle = params[arc, 3] + direction * t[arc] / params[arc, 2]
+    points[arc] = params[arc, :2] + params[arc, 2, None] * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+    heading[arc] = angle + direction * np.pi / 2.
+    left = np.stack([-np.sin(heading), np.cos(heading)], axis=1)
+    return points + d[:, None] * left, heading
+
+
+def project_segments(kinds: np.ndarray, params: np.ndarray, P: np.ndarray):
+    # Projects each point P[n] (N, 2) on the segment given by kinds[n] and params[n]. Returns the distances to the segments,
+    # and the arc length from the start of the segment, d and the centerline heading at the closest points
+    dist = np.zeros(len(P))
+    s = np.zeros(len(P))
+    d = np.zeros(len(P))
+    heading = np.zeros(len(P))
+    line = kinds == LINE
+    if np.any(line):
+        a, u, length = params[line, :2], params[line, 2:4], params[line, 4]
+        v = P[line] - a
+        t = np.clip(np.sum(v * u, axis=1), 0, length)
+        dist[line] = np.linalg.norm(v - t[:, None] * u, axis=1)
+        s[line] = t
+        d[line] = np.where(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0] < 0, -dist[line], dist[line]) # past a corner, the distance to the vertex
+        heading[line] = np.arctan2(u[:, 1], u[:, 0])
+    arc = ~line
+    if np.any(arc):
+        c, radius, a0, sweep = params[arc, :2], params[arc, 2], params[arc, 3], params[arc, 4]
+        direction = np.sign(sweep)
+        w = P[arc] - c
+        t = np.mod((np.arctan2(w[:, 1], w[:, 0]) - a0) * direction, 2*np.pi) # angle travelled along the arc
+        beyond = t > np.abs(sweep)
+        t = np.where(beyond & (t - np.abs(sweep) > 2*np.pi - t), 0., np.minimum(t, np.abs(sweep))) # closest end if off the arc
+        angle = a0 + direction * t
+        q = c + radius[:, None] * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+        dist[arc] = np.linalg.norm(P[arc] - q, axis=1)
+        s[arc] = radius * t
+        # Signed like for lines: left of the tangent at q is positive, past an end that is the distance to the end point
+        tangent = direction[:, None] * np.stack([-np.sin(angle), np.cos(angle)], axis=1)
+        v = P[arc] - q
+        d[arc] = np.where(tangent[:, 0] * v[:, 1] - tangent[:, 1] * v[:, 0] < 0, -dist[arc], dist[arc])
+        heading[arc] = angle + direction * np.pi / 2.
+    return dist, s, d, heading
+
+
+class Lane:
+    def __init__(self, points: list, width: float = 3.5, closed: bool = False, cell_size: float = 2.):
+        # A polyline through the given Points. If closed, the last point is connected back to the first one.
+        self.width = width
+        self.closed = closed
+        self.cell_size = cell_size
+        self.lines = [Line(p, q) for p, q in zip(points[:-1], points[1:])]
+        if closed and len(points) > 2:
+            self.lines.append(Line(points[-1], points[0]))
+        rows = []
+        for line in self.lines:
+            length = line.p1.distanceTo(line.p2)
+            rows.append([LINE, line.p1.x, line.p1.y, (line.p2.x - line.p1.x) / length, (line.p2.y - line.p1.y) / length, length])
+        self._build(rows)
+
+    @classmethod
+    def arc(cls, center: Point, radius: float, start_angle: float, end_angle: float, width: float = 3.5, cell_size: float = 2.) -> 'Lane':
+        # A circular lane going from start_angle to end_angle: counterclockwise if end_angle > start_angle, clockwise otherwise.
+        # A sweep of 2*pi or more gives a closed lane around the whole circle.
+        lane = cls.__new__(cls)
+        lane.width = width
+        lane.cell_size = cell_size
+        sweep = float(np.clip(end_angle - start_angle, -2*np.pi, 2*np.pi))
+        lane.closed = abs(sweep) == 2*np.pi
+        lane.lines = []
+        lane._build([[ARC, center.x, center.y, radius, start_angle, sweep]])
+        return lane
+
+    @classmethod
+    def circle(cls, center: Point, radius: float, width: float = 3.5, clockwise: bool = False, start_angle: float = 0., cell_size: float = 2.) -> 'Lane':
+        return cls.arc(center, radius, start_angle, start_angle + (-2*np.pi if clockwise else 2*np.pi), width, cell_size)
+
+    def _build(self, rows: list):
+        # Segment table. Lines: [LINE, x, y, ux, uy, length], arcs: [ARC, cx, cy, radius, start angle, signed sweep]
+        segments = np.array(rows, dtype=float).reshape(-1, 6)
+        self.kinds = segments[:, 0].astype(int)
+        self.params = segments[:, 1:]
+        self.lengths = np.where(self.kinds == LINE, self.params[:, 4], np.abs(self.params[:, 2] * self.params[:, 4]))
+        self.starts = np.concatenate([[0.], np.cumsum(self.lengths)[:-1]]) # arc length at the start of every segment
+        self.length = float(np.sum(self.lengths))
+        self._build_index()
+
+    def _build_index(self):
+        # For every cell of a grid around the lane, the segments that can be the closest one to a point of the cell.
+        # With c the cell center and h half its diagonal, a segment that is farther than min_k dist(c, k) + 2h from c
+        # is farther from any point of the cell than the closest segment, so it is left out.
+        lo, hi = self._bounds()
+        margin = 2 * self.width
+        self.cell_size = max(self.cell_size, float(np.max(hi - lo + 2 * margin)) / 256) # at most 256 x 256 cells
+        self.grid_origin = lo - margin
+        self.grid_shape = np.ceil((hi - lo + 2 * margin) / self.cell_size).astype(int)
+        ix, iy = np.meshgrid(np.arange(self.grid_shape[0]), np.arange(self.grid_shape[1]), indexing='ij')
+        centers = self.grid_origin + (np.stack([ix.ravel(), iy.ravel()], axis=1) + 0.5) * self.cell_size
+        chunks = np.array_split(np.arange(len(self.kinds)), max(1, len(self.kinds) * len(centers) // 2**20)) # about 1M pairs at a time
+        distances = lambda ks: self._distances(centers, ks)
+        closest = np.full(len(centers), np.inf)
+        for ks in chunks:
+            closest = np.minimum(closest, distances(ks).min(axis=0))
+        cells, segments = [], []
+        for ks in chunks:
+            k, near = np.nonzero(distances(ks) <= closest + np.sqrt(2) * self.cell_size)
+            cells.append(near)
+            segments.append(ks[k])
+        cells = np.concatenate(cells)
+        order = np.argsort(cells, kind='stable')
+        self.cell_starts = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=len(centers)))])
+        self.cell_segments = np.concatenate(segments)[order]
+
+    def _bounds(self):
+        points = []
+        for kind, p in zip(self.kinds, self.params):
+            if kind == LINE:
+                points += [p[:2], p[:2] + p[2:4] * p[4]]
+            else:
+                points += [p[:2] - p[2], p[:2] + p[2]]
+        points = np.array(points)
+        return points.min(axis=0), points.max(axis=0)
+
+    def _distances(self, P: np.ndarray, ks: np.ndarray) -> np.ndarray:
+        # (len(ks), N) distances from the points P (N, 2) to the segments ks
+        result = np.zeros((len(ks), len(P)))
+        line = self.kinds[ks] == LINE
+        a, u, length = self.params[ks[line], None, :2], self.params[ks[line], None, 2:4], self.params[ks[line], 4, None]
+        v = P - a
+        t = np.clip(v[..., 0] * u[..., 0] + v[..., 1] * u[..., 1], 0, length)
+        result[line] = np.hypot(v[..., 0] - t * u[..., 0], v[..., 1] - t * u[..., 1])
+        for row, k in zip(np.nonzero(~line)[0], ks[~line]):
+            result[row] = self._project_pairs(P, np.full(len(P), k))[0]
+        return result
+        
+    def _project_pairs(self, P: np.ndarray, K: np.ndarray):
+        # Projects each point P[n] (N, 2) on segment K[n], see project_segments
+        return project_segments(self.kinds[K], self.params[K], P)
+
+    def project(self, P: np.ndarray, headings: np.ndarray = None):
+        # Frenet coordinates of the points P (N, 2). Returns (s, d, heading error), the latter only if headings are given
+        P = np.asarray(P, dtype=float).reshape(-1, 2)
+        cell = np.floor((P - self.grid_origin) / self.cell_size).astype(int)
+        inside = np.all((cell >= 0) & (cell < self.grid_shape), axis=1)
+        flat = cell[:, 0] * self.grid_shape[1] + cell[:, 1]
+        # Candidate segments of each point: those of its cell, or all of them if it is outside of the grid
+        counts = np.where(inside, self.cell_starts[np.where(inside, flat, 0) + 1] - self.cell_starts[np.where(inside, flat, 0)], len(self.kinds))
+        Q = np.repeat(np.arange(len(P)), counts)
+        local = np.arange(len(Q)) - np.repeat(np.cumsum(counts) - counts, counts)
+        K = np.where(inside[Q], self.cell_segments[np.minimum(np.repeat(self.cell_starts[np.where(inside, flat, 0)], counts) + local, len(self.cell_segments) - 1)], local)
+        dist, s, d, heading = self._project_pairs(P[Q], K)
+        # Keep the closest segment of every point
+        order = np.lexsort((dist, Q))
+        best = order[np.concatenate([[0], np.cumsum(counts)[:-1]])]
+        s = self.starts[K[best]] + s[best]
+        if self.closed:
+            s = np.mod(s, self.length)
+        if headings is None:
+            return s, d[best]
+        return s, d[best], wrap_angle(np.asarray(headings, dtype=float) - heading[best])
+
+    def project_entities(self, entities: list):
+        # (s, d, heading error) of the centers and headings of the entities
+        P = np.array([[e.center.x, e.center.y] for e in entities]).reshape(-1, 2)
+        return self.project(P, np.array([e.heading for e in entities]))
+
+    def position(self, s: Union[float, np.ndarray], d: Union[float, np.ndarray] = 0.):
+        # Inverse of project: returns the (N, 2) points at arc length s and offset d, and the centerline headings there
+        s = np.atleast_1d(np.asarray(s, dtype=float))
+        d = np.broadcast_to(np.asarray(d, dtype=float), s.shape)
+        if self.closed:
+            s = np.mod(s, self.length)
+        K = np.clip(np.searchsorted(self.starts, s, side='right') - 1, 0, len(self.kinds) - 1)
+        t = np.clip(s - self.starts[K], 0, self.lengths[K])
+        return segment_positions(self.kinds[K], self.params[K], t, d)
+
+    def progress(self, s_before: np.ndarray, s_after: np.ndarray) -> np.ndarray:
+        # Signed distance travelled along the lane between two projections. On a closed lane, crossing the start counts as
+        # going on (or back), so summing this over time gives the total progress, and laps = progress / length.
+        ds = np.asarray(s_after) - np.asarray(s_before)
+        if self.closed:
+            ds = np.mod(ds + self.length / 2., self.length) - self.length / 2.
+        return ds
+
+
+class LaneSet:
+    # Several lanes in one segment table, one lane after the other, to query points that are on different lanes at once.
+    # Lanes are referred to by their index in self.lanes. In the table, the arc length along a lane is offset by the total
+    # length of the lanes before it.
+    def __init__(self, lanes: list = ()):
+        self.lanes = list(lanes)
+        self._build()
+
+    def index(self, lane: Lane) -> int:
+        # Index of the lane, which is added if needed
+        for k, l in enumerate(self.lanes):
+            if l is lane: return k
+        self.lanes.append(lane)
+        self._build()
+        return len(self.lanes) - 1
+
+    def _build(self):
+        lanes = self.lanes
+        self.kinds = np.concatenate([lane.kinds for lane in lanes] + [np.zeros(0, dtype=int)])
+        self.params = np.concatenate([lane.params for lane in lanes] + [np.zeros((0, 5))])
+        self.segment_lengths = np.concatenate([lane.lengths for lane in lanes] + [np.zeros(0)])
+        self.lengths = np.array([lane.length for lane in lanes])
+        self.offsets = np.concatenate([[0.], np.cumsum(self.lengths)[:-1]]) if lanes else np.zeros(0)
+        self.segment_starts = np.concatenate([lane.starts + offset for lane, offset in zip(lanes, self.offsets)] + [np.zeros(0)])
+        counts = np.array([len(lane.kinds) for lane in lanes], dtype=int)
+        self.first_segments = np.cumsum(counts) - counts
+        self.num_segments = counts
+        self.closed = np.array([lane.closed for lane in lanes], dtype=bool)
+
+    def segments(self, lane_ids: np.ndarray, s: np.ndarray):
+        # The segments (rows of the table) at arc lengths s along the lanes, and the arc lengths from their starts
+        s = np.where(self.closed[lane_ids], np.mod(s, self.lengths[lane_ids]), s)
+        K = np.searchsorted(self.segment_starts, self.offsets[lane_ids] + s, side='right') - 1
+        K = np.clip(K, self.first_segments[lane_ids], self.first_segments[lane_ids] + self.num_segments[lane_ids] - 1)
+        t = np.clip(self.offsets[lane_ids] + s - self.segment_starts[K], 0, self.segment_lengths[K])
+        return K, t
+
+    def position(self, lane_ids: np.ndarray, s: np.ndarray, d: Union[float, np.ndarray] = 0.):
+        # Same as Lane.position, for points on the lanes lane_ids
+        K, t = self.segments(lane_ids, s)
+        return segment_positions(self.kinds[K], self.params[K], t, np.broadcast_to(np.asarray(d, dtype=float), t.shape))
+
+    def project(self, lane_ids: np.ndarray, P: np.ndarray, hints: np.ndarray = None):
+        # Projects the points P (N, 2) on the lanes lane_ids. Returns s, d and the segments they are on. Given the segments
+        # hints of the points a moment ago, only those and their neighbours are tried: this follows points that move less
+        # than a segment at a time, without going through the grid of every lane.
+        P = np.asarray(P, dtype=float).reshape(-1, 2)
+        if hints is None:
+            s = np.zeros(len(P))
+            d = np.zeros(len(P))
+            for k, lane in enumerate(self.lanes):
+                on_lane = lane_ids == k
+                if np.any(on_lane):
+                    s[on_lane], d[on_lane] = lane.project(P[on_lane])
+            return s, d, self.segments(lane_ids, s)[0]
+        first, count = self.first_segments[lane_ids, None], self.num_segments[lane_ids, None]
+        local = hints[:, None] - first + np.array([-1, 0, 1]) # the hinted segments and their neighbours on the same lane
+        local = np.where(self.closed[lane_ids, None], np.mod(local, count), np.clip(local, 0, count - 1))
+        # On lanes with fewer than three segments, some of them are the same: those are only tried once
+        unique = np.ones(local.shape, dtype=bool)
+        unique[:, 0] = local[:, 0] != local[:, 1]
+        unique[:, 2] = (local[:, 2] != local[:, 1]) & (local[:, 2] != local[:, 0])
+        K = (first + local)[unique]
+        Q = np.nonzero(unique)[0]
+        dist = np.full(local.shape, np.inf)
+        t = np.zeros(local.shape)
+        d = np.zeros(local.shape)
+        dist[unique], t[unique], d[unique], _ = project_segments(self.kinds[K], self.params[K], P[Q])
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(P))
+        K = first[:, 0] + local[rows, best]
+        s = self.segment_starts[K] - self.offsets[lane_ids] + t[rows, best]
+        s = np.where(self.closed[lane_ids], np.mod(s, self.lengths[lane_ids]), s)
+        return s, d[rows, best], K
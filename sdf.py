@@ -0,0 +1,81 @@
+import numpy as np
+import hashlib
+import os
+from collision import pack, point_signed_distance
+from geometry import Point
+from typing import Union
+
+class SignedDistanceField:
+    # Signed distance to a fixed set of shapes, sampled on a regular grid and bilinearly interpolated.
+    # Positive outside the shapes, negative inside. Queries outside the grid are clamped to its border.
+    def __init__(self, values: np.ndarray, origin: Point, resolution: float, fingerprint: float = 0.):
+        self.values = values # values[i, j] is the signed distance at (origin.x + j*resolution, origin.y + i*resolution)
+        self.origin = origin
+        self.resolution = resolution
+        self.fingerprint = fingerprint # identifies the shapes the field was baked for
+        
+    @staticmethod
+    def shapes_fingerprint(objs: list) -> float:
+        h = hashlib.sha1()
+        for kind, (idx, arr) in sorted(pack(objs).items()):
+            h.update(np.int64(kind).tobytes() + idx.tobytes() + arr.tobytes())
+        return float(int(h.hexdigest()[:12], 16)) # 48 bits, exactly representable as a float
+        
+    @classmethod
+    def bake(cls, objs: list, width: float, height: float, resolution: float = 0.5, origin: Point = Point(0, 0), chunk_size: int = 2**22) -> 'SignedDistanceField':
+        xs = origin.x + resolution * np.arange(int(np.ceil(width / resolution)) + 1)
+        ys = origin.y + resolution * np.arange(int(np.ceil(height / resolution)) + 1)
+        P = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+        values = np.full(len(P), np.inf)
+        for kind, (_, arr) in pack(objs).items():
+            rows = max(1, chunk_size // len(arr)) # keeps the temporary (rows x shapes) matrices bounded
+            for start in range(0, len(P), rows):
+                block = point_signed_distance(P[start:start+rows, None], kind, arr[None, :])
+                values[start:start+rows] = np.minimum(values[start:start+rows], block.min(axis=1))
+        return cls(values.reshape(len(ys), len(xs)), origin, resolution, cls.shapes_fingerprint(objs))
+        
+    def save(self, path: str):
+        # The values go to a plain .npy file so that load() can memory-map them, the grid parameters go next to it
+        with open(path, 'wb') as f: # np.save(path, ...) would append .npy to the name
+            np.save(f, self.values)
+        np.save(path + '.meta.npy', np.array([self.origin.x, self.origin.y, self.resolution, self.fingerprint]))
+        
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r') -> 'SignedDistanceField':
+        x, y, resolution, fingerprint = np.load(path + '.meta.npy')
+        return cls(np.load(path, mmap_mode=mmap_mode), Point(x, y), resolution, fingerprint)
+        
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(path) and os.path.exists(path + '.meta.npy')
+        
+    def _cells(self, P: np.ndarray):
+        # Returns the lower-left grid indices of the cells containing P, and the position of P inside them
+        H, W = self.values.shape
+        f = (P - [self.origin.x, self.origin.y]) / self.resolution
+        fx = np.clip(f[..., 0], 0, W - 1)
+        fy = np.clip(f[..., 1], 0, H - 1)
+        ix = np.minimum(np.floor(fx).astype(int), W - 2)
+        iy = np.minimum(np.floor(fy).astype(int), H - 2)
+        return ix, iy, fx - ix, fy - iy
+        
+    @staticmethod
+    def _as_array(p: Union[Point, np.ndarray]) -> np.ndarray:
+        return np.array([p.x, p.y]) if isinstance(p, Point) else np.asarray(p, dtype=float)
+        
+    def distance(self, p: Union[Point, np.ndarray]) -> Union[float, np.ndarray]:
+        # p is a Point or an (..., 2) array of points
+        P = self._as_array(p)
+        ix, iy, tx, ty = self._cells(P)
+        v = self.values
+        d = (1 - tx) * (1 - ty) * v[iy, ix] + tx * (1 - ty) * v[iy, ix + 1] + (1 - tx) * ty * v[iy + 1, ix] + tx * ty * v[iy + 1, ix + 1]
+        return float(d) if isinstance(p, Point) else d
+        
+    def gradient(self, p: Union[Point, np.ndarray]) -> Union[Point, np.ndarray]:
+        # Gradient of the interpolated field. Returns a Point for a Point, and an (..., 2) array otherwise
+        P = self._as_array(p)
+        ix, iy, tx, ty = self._cells(P)
+        v = self.values
+        gx = ((1 - ty) * (v[iy, ix + 1] - v[iy, ix]) + ty * (v[iy + 1, ix + 1] - v[iy + 1, ix])) / self.resolution
+        gy = ((1 - tx) * (v[iy + 1, ix] - v[iy, ix]) + tx * (v[iy + 1, ix + 1] - v[iy, ix + 1])) / self.resolution
+        return Point(gx, gy) if isinstance(p, Point) else np.stack([gx, gy], axis=-1)
@@ -0,0 +1,234 @@
+import numpy as np
+from collision import BOX, CIRCLE, RING, ShapeBatch, point_inside
+from entities import Entity, CircleEntity, CARS, PEDESTRIANS
+
+# Ray kernels. Rays start at O (..., 2) and go along the unit vectors U (..., 2). Each kernel returns the distance
+# along the ray to the first point of the shape, 0 if the ray starts inside the shape, and inf if it misses.
+
+def ray_box(O: np.ndarray, U: np.ndarray, A: np.ndarray) -> np.ndarray:
+    # Slab method: a rectangle (or any parallelogram) is the intersection of two slabs, one per pair of parallel edges
+    t_enter = np.zeros(np.broadcast_shapes(O.shape[:-1], U.shape[:-1], A.shape[:-2]))
+    t_exit = np.full(t_enter.shape, np.inf)
+    for a, b, c in [(0, 1, 2), (1, 2, 3)]:
+        e = A[..., b, :] - A[..., a, :]
+        n = np.stack([-e[..., 1], e[..., 0]], axis=-1) # normal of the edge a-b, the slab lies between that edge and the one through c
+        lo = np.sum(n * A[..., a, :], axis=-1)
+        hi = np.sum(n * A[..., c, :], axis=-1)
+        lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+        start = np.sum(n * O, axis=-1)
+        speed = np.sum(n * U, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (lo - start) / speed
+            t2 = (hi - start) / speed
+        parallel = speed == 0
+        inside_slab = (lo <= start) & (start <= hi)
+        t_enter = np.maximum(t_enter, np.where(parallel, np.where(inside_slab, -np.inf, np.inf), np.minimum(t1, t2)))
+        t_exit = np.minimum(t_exit, np.where(parallel, np.where(inside_slab, np.inf, -np.inf), np.maximum(t1, t2)))
+    return np.where(t_enter <= t_exit, t_enter, np.inf)
+
+
+def _ray_circle_roots(O: np.ndarray, U: np.ndarray, m: np.ndarray, r: np.ndarray):
+    # Roots of |O + t U - m| = r, as (smaller, larger, whether they exist)
+    f = O - m
+    b = np.sum(f * U, axis=-1)
+    disc = b * b - (np.sum(f * f, axis=-1) - r * r)
+    sq = np.sqrt(np.maximum(disc, 0.))
+    return -b - sq, -b + sq, disc >= 0
+
+
+def ray_circle(O: np.ndarray, U: np.ndarray, C: np.ndarray) -> np.ndarray:
+    t0, t1, real = _ray_circle_roots(O, U, C[..., :2], C[..., 2])
+    inside = np.linalg.norm(O - C[..., :2], axis=-1) <= C[..., 2]
+    return np.where(inside, 0., np.where(real & (t0 >= 0), t0, np.inf))
+
+
+def ray_ring(O: np.ndarray, U: np.ndarray, R: np.ndarray) -> np.ndarray:
+    d = np.linalg.norm(O - R[..., :2], axis=-1)
+    outer = ray_circle(O, U, R[..., [0, 1, 3]]) # from outside, the ray first enters the outer circle
+    _, exit_inner, _ = _ray_circle_roots(O, U, R[..., :2], R[..., 2]) # from the hole, it leaves the inner circle
+    return np.where(d < R[..., 2], exit_inner, np.where(d <= R[..., 3], 0., outer))
+
+
+RAY_KERNELS = {BOX: ray_box, CIRCLE: ray_circle, RING: ray_ring}
+
+
+class Lidar:
+    # A range sensor that casts num_rays rays from the center of an entity, evenly spread over fov radians around its heading
+    def __init__(self, num_rays: int = 64, max_range: float = 50., fov: float = 2*np.pi):
+        self.num_rays = num_rays
+        self.max_range = max_range
+        self.fov = fov
+        
+    @property
+    def angles(self) -> np.ndarray: # relative to the heading of the entity
+        if np.isclose(self.fov, 2*np.pi):
+            return np.arange(self.num_rays) * 2*np.pi / self.num_rays
+        return np.linspace(-self.fov / 2., self.fov / 2., self.num_rays)
+        
+    def scan(self, world, entities: list) -> np.ndarray:
+        # Returns a (len(entities), num_rays) array of distances to the closest collidable agent of the world along each ray.
+        # Rays that hit nothing read max_range. The scanning entities do not see themselves.
+        origins = np.array([[e.center.x, e.center.y] for e in entities]).reshape(-1, 2)
+        headings = np.array([e.heading for e in entities], dtype=float)
+        angles = self.angles
+        step = angles[1] - angles[0] if self.num_rays > 1 else 2*np.pi
+        result = np.full((len(entities), self.num_rays), float(self.max_range))
+        
+        aabbs = np.concatenate([origins - self.max_range, origins + self.max_range], axis=1)
+        for Q, J, agents, shapes in world.nearby(aabbs):
+            index = {id(a): j for j, a in enumerate(agents)}
+            own = np.array([index.get(id(e), -1) for e in entities], dtype=int).reshape(-1)
+            keep = J != own[Q]
+            Q, J = Q[keep], J[keep]
+            
+            # Only the rays that point within the bounding circle of a shape can hit it
+            center = (shapes.aabbs[J, :2] + shapes.aabbs[J, 2:]) / 2.
+            radius = np.linalg.norm(shapes.aabbs[J, 2:] - shapes.aabbs[J, :2], axis=1) / 2.
+            offset = center - origins[Q]
+            d = np.linalg.norm(offset, axis=1)
+            reachable = d - radius <= self.max_range
+            Q, J, offset, d, radius = Q[reachable], J[reachable], offset[reachable], d[reachable], radius[reachable]
+            enclosing = d <= radius
+            half_width = np.where(enclosing, np.pi, np.arcsin(np.minimum(radius / np.maximum(d, 1e-12), 1.)))
+            direction = np.mod(np.arctan2(offset[:, 1], offset[:, 0]) - headings[Q] - angles[0], 2*np.pi)
+            P, K = [], []
+            for shift in [-2*np.pi, 0., 2*np.pi]: # the angular window may wrap around
+                lo = np.where(enclosing, 0, np.maximum(np.ceil((direction - half_width + shift) / step), 0)).astype(int)
+                hi = np.where(enclosing, self.num_rays - 1 if shift == 0 else -1, np.minimum(np.floor((direction + half_width + shift) / step), self.num_rays - 1)).astype(int)
+                counts = np.maximum(hi - lo + 1, 0)
+                pairs = np.repeat(np.arange(len(Q)), counts)
+                P.append(pairs)
+                K.append(np.repeat(lo, counts) + np.arange(len(pairs)) - np.repeat(np.cumsum(counts) - counts, counts))
+            P = np.concatenate(P)
+            K = np.concatenate(K)
+            
+            q = Q[P]
+            theta = headings[q] + angles[K]
+            U = np.stack([np.cos(theta), np.sin(theta)], axis=-1)
+            for kind, kernel in RAY_KERNELS.items():
+                mask = shapes.kinds[J[P]] == kind
+                if not np.any(mask): continue
+                arr = shapes.packed[kind][1][shapes.rows[J[P[mask]]]]
+                t = kernel(origins[q[mask]], U[mask], arr)
+                np.minimum.at(result, (q[mask], K[mask]), t)
+        return result
+
+
+class OccupancyGrid:
+    # Renders a bird's eye view around an entity as an (H, W, 4) array without any window. The entity is at the center of
+    # the image and faces up. The channels are: static obstacles, other cars, pedestrians and paintings (e.g. lane markings).
+    # Dynamic agents go to the cars and / or pedestrians channels after their category (see entities.py), whatever their shape.
+    STATIC, CARS, PEDESTRIANS, PAINTINGS = 0, 1, 2, 3
+    
+    def __init__(self, world, height: int = 64, width: int = 64, resolution: float = 0.5, static_resolution: float = None):
+        self.world = world
+        self.height = height
+        self.width = width
+        self.resolution = resolution # meters per cell of the observation
+        self.static_resolution = resolution / 2. if static_resolution is None else static_resolution # of the cached static layer
+        self._static_version = None
+        
+        # Cell centers in the frame of the entity: x points forward (up in the image), y to the left
+        self._forward = (height / 2. - np.arange(height) - 0.5) * resolution # of the rows
+        self._left = (width / 2. - np.arange(width) - 0.5) * resolution # of the columns
+        self._local = np.stack(np.meshgrid(self._forward, self._left, indexing='ij'), axis=-1).reshape(-1, 2)
+        self._view_radius = np.hypot(height, width) * resolution / 2.
+        
+    def _rasterize_static(self):
+        # Rasterizes all static agents in the world frame, once. Collidable ones go to the STATIC channel, the others are paintings
+        res = self.static_resolution
+        H = int(np.ceil(self.world.height / res))
+        W = int(np.ceil(self.world.width / res))
+        layer = np.zeros((H, W, 2), dtype=bool)
+        for agent in self.world.static_agents:
+            xmin, ymin, xmax, ymax = agent.aabb
+            i0, i1 = max(int(np.floor(ymin / res)), 0), min(int(np.ceil(ymax / res)), H)
+            j0, j1 = max(int(np.floor(xmin / res)), 0), min(int(np.ceil(xmax / res)), W)
+            if i0 >= i1 or j0 >= j1: continue
+            ys = (np.arange(i0, i1) + 0.5) * res
+            xs = (np.arange(j0, j1) + 0.5) * res
+            P = np.stack(np.meshgrid(xs, ys), axis=-1)
+            shapes = ShapeBatch([agent.obj])
+            kind = shapes.kinds[0]
+            inside = point_inside(P, kind, shapes.packed[kind][1][0])
+            channel = 0 if agent.collidable else 1
+            layer[i0:i1, j0:j1, channel] |= inside
+        self._static_layer = layer
+        self._static_version = self.world.static_version
+        
+    def render(self, ego: Entity) -> np.ndarray:
+        if self._static_version != self.world.static_version:
+            self._rasterize_static()
+        c = np.cos(ego.heading)
+        s = np.sin(ego.heading)
+        P = np.empty_like(self._local)
+        P[:, 0] = ego.center.x + c * self._local[:, 0] - s * self._local[:, 1]
+        P[:, 1] = ego.center.y + s * self._local[:, 0] + c * self._local[:, 1]
+        grid = np.zeros((self.height * self.width, 4), dtype=np.float32)
+        
+        # Static channels: nearest cell of the cached layer, everything outside the world is free
+        layer = self._static_layer
+        i = np.floor(P[:, 1] / self.static_resolution).astype(int)
+        j = np.floor(P[:, 0] / self.static_resolution).astype(int)
+        valid = (i >= 0) & (i < layer.shape[0]) & (j >= 0) & (j < layer.shape[1])
+        grid[valid, self.STATIC] = layer[i[valid], j[valid], 0]
+        grid[valid, self.PAINTINGS] = layer[i[valid], j[valid], 1]
+        
+        # Dynamic channels: the agents around the entity, re-rasterized at every call. Every shape is expressed in the frame
+        # of the entity once, then scan-converted: for each row of the image that its bounding box covers, the span of
+        # columns whose centers are inside it is found in closed form. The spans are marked with +1 / -1 at their ends
+        # and a cumulative sum along the rows fills them, so the work grows with the rows covered, not with the cells.
+        view = np.array([[ego.center.x - self._view_radius, ego.center.y - self._view_radius, ego.center.x + self._view_radius, ego.center.y + self._view_radius]])
+        to_ego = lambda V: np.stack([c * V[..., 0] + s * V[..., 1], -s * V[..., 0] + c * V[..., 1]], axis=-1) # world vectors -> (forward, left)
+        H, W = self.height, self.width
+        starts, ends = [], [] # spans of cells, as indices into the (2, H, W + 1) marks below
+        for _, J, agents, shapes in self.world.nearby(view, static=False):
+            categories = np.array([agents[j].category if agents[j] is not ego else 0 for j in J], dtype=np.int64).reshape(-1)
+            J, categories = J[(categories & (CARS | PEDESTRIANS)) != 0], categories[(categories & (CARS | PEDESTRIANS)) != 0]
+            if len(J) == 0: continue
+            boxes = shapes.aabbs[J]
+            forward = to_ego(np.stack([boxes[:, [0, 1]], boxes[:, [2, 1]], boxes[:, [0, 3]], boxes[:, [2, 3]]], axis=1) - [ego.center.x, ego.center.y])[..., 0]
+            row_lo = np.maximum(np.ceil(H / 2. - forward.max(axis=1) / self.resolution - 0.5), 0).astype(int)
+            row_hi = np.minimum(np.floor(H / 2. - forward.min(axis=1) / self.resolution - 0.5), H - 1).astype(int)
+            kinds = shapes.kinds[J]
+            for kind, (_, arr) in shapes.packed.items():
+                sel = np.nonzero(kinds == kind)[0]
+                if len(sel) == 0: continue
+                S = arr[shapes.rows[J[sel]]]
+                counts = np.maximum(row_hi[sel] - row_lo[sel] + 1, 0)
+                ids = np.repeat(np.arange(len(sel)), counts)
+                rows = row_lo[sel][ids] + np.arange(len(ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+                f = self._forward[rows]
+                category = categories[sel][ids]
+                if kind == BOX:
+                    # Where the row crosses the edges of the rectangle
+                    K = to_ego(S - [ego.center.x, ego.center.y])[ids] # (M, 4, 2)
+                    Ka, Kb = K, np.roll(K, -1, axis=1)
+                    df = Kb[..., 0] - Ka[..., 0]
+                    crosses = (np.minimum(Ka[..., 0], Kb[..., 0]) <= f[:, None]) & (f[:, None] <= np.maximum(Ka[..., 0], Kb[..., 0])) & (df != 0)
+                    l = Ka[..., 1] + (Kb[..., 1] - Ka[..., 1]) * np.divide(f[:, None] - Ka[..., 0], df, out=np.zeros_like(df), where=df != 0)
+                    spans = [(np.where(crosses, l, np.inf).min(axis=1), np.where(crosses, l, -np.inf).max(axis=1))]
+                else:
+                    center = to_ego(S[:, :2] - [ego.center.x, ego.center.y])[ids]
+                    h2 = (f - center[:, 0]) ** 2
+                    outer = np.sqrt(np.maximum(S[ids, 2 if kind == CIRCLE else 3] ** 2 - h2, 0.))
+                    outer[S[ids, 2 if kind == CIRCLE else 3] ** 2 < h2] = -np.inf # the row misses the shape: empty span
+                    if kind == CIRCLE:
+                        spans = [(center[:, 1] - outer, center[:, 1] + outer)]
+                    else:
+                        inner = np.sqrt(np.maximum(S[ids, 2] ** 2 - h2, 0.)) # 0 where the row misses the hole: the two spans meet
+                        spans = [(center[:, 1] - outer, center[:, 1] - inner), (center[:, 1] + inner, center[:, 1] + outer)]
+                for lo, hi in spans:
+                    col_lo = np.maximum(np.ceil(W / 2. - hi / self.resolution - 0.5), 0)
+                    col_hi = np.minimum(np.floor(W / 2. - lo / self.resolution - 0.5), W - 1)
+                    for layer, bit in enumerate((CARS, PEDESTRIANS)):
+                        keep = (col_lo <= col_hi) & ((category & bit) != 0)
+                        starts.append((layer * H + rows[keep]) * (W + 1) + col_lo[keep].astype(int))
+                        ends.append((layer * H + rows[keep]) * (W + 1) + col_hi[keep].astype(int) + 1)
+        if starts:
+            starts, ends = np.concatenate(starts), np.concatenate(ends)
+            marks = np.bincount(starts, minlength=2 * H * (W + 1)) - np.bincount(ends, minlength=2 * H * (W + 1))
+            occupied = np.cumsum(marks.reshape(2, H, W + 1), axis=-1)[..., :W] > 0
+            grid[:, self.CARS] = occupied[0].reshape(-1)
+            grid[:, self.PEDESTRIANS] = occupied[1].reshape(-1)
+        return grid.reshape(self.height, self.width, 4)
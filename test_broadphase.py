@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from broadphase import SpatialHash, SweepAndPrune, BVH, aabb_overlap
+
+# Checks the broad phase structures against every pair of boxes. Run with
+#	python -m pytest -q test_broadphase.py
+
+
+def random_boxes(rng, n: int, world: float = 100.) -> np.ndarray:
+    lo = rng.uniform(0, world, (n, 2))
+    return np.concatenate([lo, lo + rng.uniform(0.5, 6., (n, 2))], axis=1)
+
+
+def brute_query(boxes: np.ndarray, aabbs: np.ndarray) -> set:
+    Q, I = np.nonzero(aabb_overlap(aabbs[:, None], boxes[None, :]))
+    return set(zip(Q.tolist(), I.tolist()))
+
+
+@pytest.mark.parametrize('structure', [lambda: SpatialHash(10.), SweepAndPrune, BVH], ids=['grid', 'sap', 'bvh'])
+def test_query_matches_brute_force(structure):
+    rng = np.random.default_rng(0)
+    index = structure()
+    boxes = random_boxes(rng, 300)
+    index.build(boxes)
+    for step in range(5):
+        if step > 0 and not isinstance(index, BVH): # entities that move a little, and a huge one
+            boxes = boxes + np.tile(rng.uniform(-1, 1, (len(boxes), 2)), 2)
+            boxes[7, 2:] += 40.
+            index.update(boxes)
+        queries = np.concatenate([random_boxes(rng, 50), [[-10., -10., 200., 200.], [50., 50., 50., 50.], [500., 500., 501., 501.]]])
+        Q, I = index.query(queries)
+        assert len(set(zip(Q.tolist(), I.tolist()))) == len(Q)
+        assert set(zip(Q.tolist(), I.tolist())) == brute_query(boxes, queries)
+    Q, I = structure().query(queries) # empty
+    assert len(Q) == 0 and len(I) == 0
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import warnings
+from agents import Pedestrian, CircleBuilding, RectangleBuilding
+from crowd import SocialForceCrowd
+from geometry import Point
+
+# Checks the social force crowd in a World. Run with
+#	python -m pytest -q test_crowd.py
+
+
+def world(**kwargs):
+    try:
+        from world import World
+    except Exception: # the visualizer opens a Tk root when it is imported
+        pytest.skip('World needs a display')
+    return World(0.1, 40, 20, **kwargs)
+
+
+def walk(w, crowd: SocialForceCrowd, ticks: int, check=lambda: None):
+    for _ in range(ticks):
+        crowd.update(w.dt)
+        w.tick()
+        check()
+
+
+@pytest.mark.parametrize('obstacle', [lambda: CircleBuilding(Point(20, 10), 3.), lambda: RectangleBuilding(Point(20, 10), Point(2., 4.))], ids=['circle', 'rectangle'])
+def test_pedestrians_walk_around_obstacles(obstacle):
+    # The goals are straight behind the obstacle: the pedestrians go around it without ever stepping into it
+    w = world(batched=True)
+    building = obstacle()
+    w.add(building)
+    crowd = SocialForceCrowd(sdf=w.bake_sdf(0.25))
+    pedestrians = []
+    for k, y in enumerate(np.linspace(7, 13, 7)):
+        pedestrian = Pedestrian(Point(5. - (k % 2), y), 0.)
+        w.add(pedestrian)
+        crowd.add(pedestrian, Point(35., y))
+        pedestrians.append(pedestrian)
+    clearances = []
+    def check():
+        clearances.append(min(Point(p.center.x, p.center.y).distanceTo(building.obj) - p.radius for p in pedestrians))
+        assert clearances[-1] >= 0
+    walk(w, crowd, 600, check)
+    assert min(clearances) < 0.5 # they did brush past it
+    # Most of them get past it. Those heading straight at its middle can be held in front of it, the forces cancelling out
+    assert sum(p.center.x > 25 for p in pedestrians) > len(pedestrians) / 2
+
+
+def test_without_static_agents():
+    # The field of an empty world is inf everywhere: it must not push anyone, nor turn the forces into NaN
+    w = world()
+    crowd = SocialForceCrowd(sdf=w.bake_sdf())
+    assert np.all(np.isinf(crowd.sdf.values))
+    for y in (8., 12.):
+        pedestrian = Pedestrian(Point(5., y), 0.)
+        w.add(pedestrian)
+        crowd.add(pedestrian, Point(35., y))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        P = np.array([[p.center.x, p.center.y] for p in crowd.pedestrians])
+        assert np.all(np.isfinite(crowd.forces(P, np.zeros_like(P))))
+        walk(w, crowd, 300)
+    assert np.all(crowd.arrived())
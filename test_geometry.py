@@ -0,0 +1,149 @@
+import itertools
+import math
+import numpy as np
+import pytest
+from geometry import Point, Line, Rectangle, Circle, Ring, distanceMatrix
+
+# Checks the geometry queries against the per-pair methods. Run with
+#	python -m pytest -q test_geometry.py
+
+
+def random_rectangle(rng) -> Rectangle:
+    c = Point(*rng.uniform(0, 20, 2))
+    size, heading = rng.uniform(0.5, 5, 2), rng.uniform(0, 2*np.pi)
+    u, v = Point(np.cos(heading), np.sin(heading)) * size[0], Point(-np.sin(heading), np.cos(heading)) * size[1]
+    return Rectangle(c - u/2 - v/2, c + u/2 - v/2, c + u/2 + v/2)
+
+
+def random_shapes(rng, n: int) -> list:
+    shapes = []
+    for k in range(n):
+        m = Point(*rng.uniform(0, 20, 2))
+        r = rng.uniform(0.5, 4)
+        shapes.append([random_rectangle(rng), Circle(m, r), Ring(m, r, r + rng.uniform(0.5, 3))][k % 3])
+    return shapes
+
+
+def test_distance_matrix():
+    rng = np.random.default_rng(0)
+    targets = random_shapes(rng, 30)
+    points = rng.uniform(-5, 25, (40, 2))
+    expected = [[Point(*p).distanceTo(t) for t in targets] for p in points]
+    assert np.allclose(distanceMatrix(points, targets), expected)
+    sources = random_shapes(rng, 30)
+    expected = [[s.distanceTo(t) for t in targets] for s in sources]
+    assert np.allclose(distanceMatrix(sources, targets), expected)
+    assert distanceMatrix(np.zeros((0, 2)), targets).shape == (0, len(targets))
+
+
+# The formulas of the isinstance cascades that intersectsWith and distanceTo used before the type-pair table, written
+# on plain coordinates so that they do not go through the table themselves
+
+def segment_distance(p: Point, a: Point, b: Point) -> float:
+    d = b - a
+    that = ((p.x - a.x) * d.x + (p.y - a.y) * d.y) / (d.x * d.x + d.y * d.y)
+    tstar = min(1., max(0., that))
+    return math.hypot(a.x + tstar * d.x - p.x, a.y + tstar * d.y - p.y)
+
+
+def inside_rectangle(p: Point, r: Rectangle) -> bool:
+    AB, AM, BC, BM = r.c2 - r.c1, p - r.c1, r.c3 - r.c2, p - r.c2
+    return 0 <= AB.dot(AM) <= AB.dot(AB) and 0 <= BC.dot(BM) <= BC.dot(BC)
+
+
+def orientation(p: Point, q: Point, r: Point) -> int:
+    val = (q.y - p.y) * (r.x - q.x) - (q.x - p.x) * (r.y - q.y)
+    return 0 if val == 0 else 1 if val > 0 else 2
+
+
+def on_segment(p: Point, q: Point, r: Point) -> bool:
+    return min(p.x, r.x) <= q.x <= max(p.x, r.x) and min(p.y, r.y) <= q.y <= max(p.y, r.y)
+
+
+def cascade_intersects(a, b) -> bool:
+    order = [Line, Rectangle, Circle, Ring]
+    if order.index(type(a)) > order.index(type(b)): a, b = b, a
+    if isinstance(a, Line):
+        if isinstance(b, Line):
+            o1, o2, o3, o4 = orientation(a.p1, a.p2, b.p1), orientation(a.p1, a.p2, b.p2), orientation(b.p1, b.p2, a.p1), orientation(b.p1, b.p2, a.p2)
+            return (o1 != o2 and o3 != o4) or (o1 == 0 and on_segment(a.p1, b.p1, a.p2)) or (o2 == 0 and on_segment(a.p1, b.p2, a.p2)) \
+                or (o3 == 0 and on_segment(b.p1, a.p1, b.p2)) or (o4 == 0 and on_segment(b.p1, a.p2, b.p2))
+        if isinstance(b, Rectangle):
+            return inside_rectangle(a.p1, b) or inside_rectangle(a.p2, b) or any(cascade_intersects(a, e) for e in b.edges)
+        if isinstance(b, Circle):
+            return segment_distance(b.m, a.p1, a.p2) <= b.r
+        return (b.m.distanceTo(a.p1) >= b.r_inner or b.m.distanceTo(a.p2) >= b.r_inner) and segment_distance(b.m, a.p1, a.p2) < b.r_outer
+    if isinstance(a, Rectangle):
+        if any(cascade_intersects(e, b) for e in a.edges): return True
+        if isinstance(b, Rectangle): return inside_rectangle(b.c1, a)
+        if isinstance(b, Circle): return inside_rectangle(b.m, a)
+        return inside_rectangle(b.m, a) and max(c.distanceTo(b.m) for c in a.corners) >= b.r_inner
+    d = a.m.distanceTo(b.m)
+    if isinstance(a, Circle) and isinstance(b, Circle):
+        return d <= a.r + b.r
+    if isinstance(a, Circle):
+        return b.r_inner - a.r <= d <= a.r + b.r_outer
+    return not (d > a.r_outer + b.r_outer or d + a.r_outer < b.r_inner or d + b.r_outer < a.r_inner)
+
+
+def cascade_distance(a, b) -> float:
+    order = [Point, Line, Rectangle, Circle, Ring]
+    if order.index(type(a)) > order.index(type(b)): a, b = b, a
+    if isinstance(a, Point):
+        if isinstance(b, Point): return math.hypot(a.x - b.x, a.y - b.y)
+        if isinstance(b, Line): return segment_distance(a, b.p1, b.p2)
+        if isinstance(b, Rectangle): return 0. if inside_rectangle(a, b) else min(segment_distance(a, e.p1, e.p2) for e in b.edges)
+        d = math.hypot(a.x - b.m.x, a.y - b.m.y)
+        if isinstance(b, Circle): return max(0., d - b.r)
+        return max(b.r_inner - d, d - b.r_outer, 0.)
+    if isinstance(a, Line):
+        if isinstance(b, Circle): return max(0., segment_distance(b.m, a.p1, a.p2) - b.r)
+        if cascade_intersects(a, b): return 0.
+        if isinstance(b, Line):
+            return min(segment_distance(a.p1, b.p1, b.p2), segment_distance(a.p2, b.p1, b.p2), segment_distance(b.p1, a.p1, a.p2), segment_distance(b.p2, a.p1, a.p2))
+        if isinstance(b, Rectangle): return min(cascade_distance(a, e) for e in b.edges)
+        p1m = a.p1.distanceTo(b.m)
+        if p1m < b.r_inner: return b.r_inner - max(p1m, a.p2.distanceTo(b.m))
+        return max(0., segment_distance(b.m, a.p1, a.p2) - b.r_outer)
+    if isinstance(a, Rectangle):
+        return 0. if cascade_intersects(a, b) else min(cascade_distance(e, b) for e in a.edges)
+    d = a.m.distanceTo(b.m)
+    if isinstance(a, Circle) and isinstance(b, Circle): return max(0., d - a.r - b.r)
+    if isinstance(a, Circle): return 0. if cascade_intersects(a, b) else max(b.r_inner - d, d - b.r_outer) - a.r
+    if d > a.r_outer + b.r_outer: return d - a.r_outer - b.r_outer
+    if d + a.r_outer < b.r_inner: return b.r_inner - d - a.r_outer
+    if d + b.r_outer < a.r_inner: return a.r_inner - d - b.r_outer
+    return 0.
+
+
+def random_shape(rng, kind: type, grid: bool):
+    # On the grid, the coordinates are small integers so that shapes often touch, share edges or have colinear points
+    coordinate = (lambda: Point(*rng.integers(0, 8, 2))) if grid else (lambda: Point(*rng.uniform(0, 8, 2)))
+    length = (lambda: float(rng.integers(1, 4))) if grid else (lambda: rng.uniform(0.2, 4))
+    if kind is Point: return coordinate()
+    if kind is Line:
+        p = coordinate()
+        return Line(p, p + Point(length(), length() - 2))
+    if kind is Rectangle:
+        if grid:
+            c, w, h = coordinate(), length(), length()
+            return Rectangle(c, c + Point(w, 0), c + Point(w, h))
+        return random_rectangle(rng)
+    if kind is Circle: return Circle(coordinate(), length())
+    r = length()
+    return Ring(coordinate(), r, r + length())
+
+
+TYPES = [Point, Line, Rectangle, Circle, Ring]
+
+
+@pytest.mark.parametrize('type_a, type_b', list(itertools.product(TYPES, TYPES)), ids=lambda t: t.__name__)
+def test_queries_match_cascades(type_a, type_b):
+    rng = np.random.default_rng(TYPES.index(type_a) * len(TYPES) + TYPES.index(type_b))
+    for k in range(400):
+        a, b = random_shape(rng, type_a, k % 2 == 0), random_shape(rng, type_b, k % 2 == 0)
+        assert math.isclose(a.distanceTo(b), cascade_distance(a, b), rel_tol=1e-12, abs_tol=1e-12), (str(a), str(b))
+        if type_b is Point and type_a is not Point:
+            with pytest.raises(NotImplementedError): a.intersectsWith(b)
+        elif type_a is not Point:
+            assert a.intersectsWith(b) == cascade_intersects(a, b), (str(a), str(b))
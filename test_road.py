@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from geometry import Point
+from road import Lane
+
+# Checks the Frenet projection of the lanes against a brute-force search over their centerlines. Run with
+#	python -m pytest -q test_road.py
+
+LANES = {
+    'polyline': lambda: Lane([Point(0, 0), Point(20, 0), Point(25, 15), Point(10, 12), Point(12, 30)]),
+    'closed polyline': lambda: Lane([Point(0, 0), Point(30, 0), Point(30, 20), Point(0, 20)], closed=True),
+    'arc': lambda: Lane.arc(Point(10, 10), 12., 0.3, 2.5),
+    'clockwise arc': lambda: Lane.arc(Point(10, 10), 8., 1., -3.),
+    'circle': lambda: Lane.circle(Point(10, 10), 15., start_angle=1.),
+}
+
+
+def centerline(lane: Lane, n: int = 20000):
+    # Points along the centerline every lane.length / n meters, with their arc lengths, built from the lines and the
+    # circle of the lane rather than from its segment table
+    s = np.linspace(0, lane.length, n + 1)
+    if lane.lines:
+        starts = np.concatenate([[0.], np.cumsum([l.length for l in lane.lines])])
+        k = np.clip(np.searchsorted(starts, s, side='right') - 1, 0, len(lane.lines) - 1)
+        p1 = np.array([[l.p1.x, l.p1.y] for l in lane.lines])
+        p2 = np.array([[l.p2.x, l.p2.y] for l in lane.lines])
+        u = (s - starts[k]) / (starts[k + 1] - starts[k])
+        return p1[k] + u[:, None] * (p2[k] - p1[k]), s
+    _, cx, cy, radius, a0, sweep = lane.kinds[0], *lane.params[0]
+    angle = a0 + np.sign(sweep) * s / radius
+    return np.stack([cx + radius * np.cos(angle), cy + radius * np.sin(angle)], axis=1), s
+
+
+def distances(lane: Lane, P: np.ndarray) -> np.ndarray:
+    # Exact distances to polylines, through Point.distanceTo(Line), and distances to the sampled arcs otherwise
+    if lane.lines:
+        return np.array([min(Point(*p).distanceTo(l) for l in lane.lines) for p in P])
+    samples, _ = centerline(lane)
+    return np.min(np.linalg.norm(P[:, None] - samples[None], axis=2), axis=1)
+
+
+@pytest.mark.parametrize('name', list(LANES))
+def test_project_matches_brute_force(name):
+    lane = LANES[name]()
+    rng = np.random.default_rng(0)
+    lo, hi = lane._bounds()
+    P = rng.uniform(lo - 10, hi + 10, (400, 2))
+    P = np.concatenate([P, rng.uniform(lo - 200, hi + 200, (20, 2))]) # some outside of the grid of the lane
+    headings = rng.uniform(-np.pi, np.pi, len(P))
+    s, d, heading_error = lane.project(P, headings)
+    assert np.all((0 <= s) & (s <= lane.length))
+    # s is a closest point of the centerline and |d| the distance to it
+    q, heading = lane.position(s)
+    assert np.allclose(np.abs(d), distances(lane, P), atol=1e-4)
+    assert np.allclose(np.linalg.norm(P - q, axis=1), np.abs(d), atol=1e-9)
+    # Where the closest point is unique, it is the one found by brute force
+    samples, sample_s = centerline(lane)
+    D = np.linalg.norm(P[:, None] - samples[None], axis=2)
+    nearest = np.argmin(D, axis=1)
+    far = np.abs(sample_s[None] - sample_s[nearest, None])
+    if lane.closed:
+        far = np.minimum(far, lane.length - far)
+    unique = np.all((far < 3.) | (D > D[np.arange(len(P)), nearest, None] + 0.5), axis=1)
+    assert np.sum(unique) > len(P) / 2
+    ds = np.abs(s - sample_s[nearest])
+    if lane.closed:
+        ds = np.minimum(ds, lane.length - ds)
+    assert np.all(ds[unique] < 1e-2)
+    # d is positive to the left of the centerline, and the heading error is relative to the centerline at s. This is only
+    # checked where P is on the normal at s: at a corner or an end, the heading of the centerline is not defined.
+    tangent = np.stack([np.cos(heading), np.sin(heading)], axis=1)
+    normal = np.abs(np.sum((P - q) * tangent, axis=1)) < 1e-6
+    assert np.sum(normal) > len(P) / 4
+    assert np.allclose(P[normal], q[normal] + d[normal, None] * np.stack([-tangent[normal, 1], tangent[normal, 0]], axis=1))
+    error = headings - heading
+    assert np.allclose(np.cos(heading_error[normal]), np.cos(error[normal])) and np.allclose(np.sin(heading_error[normal]), np.sin(error[normal]))
+    assert np.all((-np.pi <= heading_error) & (heading_error < np.pi))
+
+
+@pytest.mark.parametrize('name', [name for name in LANES if not LANES[name]().closed])
+def test_project_past_open_ends(name):
+    lane = LANES[name]()
+    (start, end), heading = lane.position([0., lane.length])
+    direction = np.stack([np.cos(heading), np.sin(heading)], axis=1)
+    for k, step in [(0, -1), (1, 1)]:
+        # Straight ahead of the end, and off to the side of it
+        P = end if k else start
+        P = P + step * np.outer([1., 5., 20.], direction[k])
+        P = np.concatenate([P, P + 3. * np.array([-direction[k, 1], direction[k, 0]])])
+        s, d = lane.project(P)
+        to_start, to_end = np.linalg.norm(P - start, axis=1), np.linalg.norm(P - end, axis=1)
+        assert np.allclose(s, np.where(to_start < to_end, 0., lane.length)) # the other end can be closer on a wide arc
+        assert np.allclose(np.abs(d), np.minimum(to_start, to_end))
+        assert np.allclose(np.abs(d), distances(lane, P), atol=1e-4)
+
+
+@pytest.mark.parametrize('name', list(LANES))
+def test_position_inverts_project(name):
+    lane = LANES[name]()
+    rng = np.random.default_rng(1)
+    s = rng.uniform(0, lane.length, 200)
+    d = rng.uniform(-1., 1., 200)
+    P, _ = lane.position(s, d)
+    s2, d2 = lane.project(P)
+    assert np.allclose(lane.position(s2, d2)[0], P, atol=1e-9)
+    # Near the inner side of a polyline corner, a point can be closer to the next segment than to the one it was put on
+    assert np.all(np.abs(d2) <= np.abs(d) + 1e-9)
+    if not lane.lines:
+        ds = np.abs(s2 - s)
+        if lane.closed:
+            ds = np.minimum(ds, lane.length - ds)
+        assert np.allclose(ds, 0., atol=1e-9) and np.allclose(d2, d)
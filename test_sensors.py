@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from agents import Car, Pedestrian, RectangleBuilding, CircleBuilding, RingBuilding, Painting
+from collision import ShapeBatch, BOX, CIRCLE, RING
+from entities import RingEntity, CARS, PEDESTRIANS, BUILDINGS
+from geometry import Point, Line
+from sensors import Lidar, OccupancyGrid, ray_box, ray_circle, ray_ring
+
+# Checks the sensors against the geometry primitives: the rays against Line.intersectsWith, the occupancy grid against
+# Point.distanceTo at the cell centers. Run with
+#	python -m pytest -q test_sensors.py
+
+
+def world(**kwargs):
+    try:
+        from world import World
+    except Exception: # the visualizer opens a Tk root when it is imported
+        pytest.skip('World needs a display')
+    return World(0.1, 80, 80, **kwargs)
+
+
+def first_hit(O: np.ndarray, U: np.ndarray, objs: list, max_range: float) -> float:
+    # Distance to the first point of objs along the ray, by bisection on the length of a segment from O
+    hits = lambda t: any(Line(Point(*O), Point(*(O + t * U))).intersectsWith(obj) for obj in objs)
+    if not hits(max_range): return max_range
+    lo, hi = 0., max_range
+    for _ in range(40):
+        mid = (lo + hi) / 2.
+        lo, hi = (lo, mid) if hits(mid) else (mid, hi)
+    return hi
+
+
+@pytest.mark.parametrize('kernel,kind,obj', [(ray_box, BOX, RectangleBuilding(Point(3., 1.), Point(4., 2.))),
+                                             (ray_circle, CIRCLE, CircleBuilding(Point(3., 1.), 2.)),
+                                             (ray_ring, RING, RingBuilding(Point(3., 1.), 2., 3.))], ids=['box', 'circle', 'ring'])
+def test_ray_kernels(kernel, kind, obj):
+    # Rays from outside, from inside and, for the ring, from its hole
+    obj.heading = 0.4
+    rng = np.random.default_rng(0)
+    O = np.concatenate([rng.uniform(-6, 12, (40, 2)), [[3., 1.], [3.5, 1.], [3., 3.5]]])
+    theta = rng.uniform(0, 2*np.pi, len(O))
+    U = np.stack([np.cos(theta), np.sin(theta)], axis=1)
+    shapes = ShapeBatch([obj.obj])
+    T = kernel(O, U, shapes.packed[kind][1][np.zeros(len(O), dtype=int)])
+    expected = [first_hit(o, u, [obj.obj], 30.) for o, u in zip(O, U)]
+    assert np.allclose(np.minimum(T, 30.), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('lidar', [Lidar(90, 30.), Lidar(45, 25., np.pi / 2.), Lidar(7, 40., 3.)], ids=['360', 'narrow', 'wide'])
+def test_scan_matches_segments(lidar):
+    w = world()
+    for building in [RectangleBuilding(Point(20, 20), Point(6, 3)), CircleBuilding(Point(35, 18), 2.), RingBuilding(Point(50, 50), 4., 6.),
+                     RectangleBuilding(Point(61, 40), Point(1., 30.))]:
+        building.heading = 0.3
+        w.add(building)
+    w.add(Painting(Point(30, 30), Point(10, 10))) # not collidable, the rays go through it
+    scanners = [Car(Point(25, 30), 4.), Car(Point(50, 50), 1.), Car(Point(37, 24), 6.2), Pedestrian(Point(60, 52), 3.), Car(Point(5, 5), 0.)]
+    for agent in scanners + [Car(Point(28, 36), 2.), Pedestrian(Point(31, 26), 0.), Pedestrian(Point(45, 45), 0.)]:
+        w.add(agent)
+    result = lidar.scan(w, scanners)
+    for k, e in enumerate(scanners):
+        others = [a.obj for a in w.agents if a.collidable and a is not e]
+        for r, angle in enumerate(lidar.angles):
+            U = np.array([np.cos(e.heading + angle), np.sin(e.heading + angle)])
+            assert result[k, r] == pytest.approx(first_hit(np.array([e.center.x, e.center.y]), U, others, lidar.max_range), abs=1e-6)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_occupancy_dynamic_channels(batched):
+    w = world(batched=batched)
+    w.add(RectangleBuilding(Point(40, 30), Point(5, 5)))
+    ego = Car(Point(40, 40), 0.7)
+    ring = RingEntity(Point(33, 44), 0., 1.5, 3., movable=True)
+    ring.category = CARS
+    agents = [ego, Car(Point(44, 42), 2.), Car(Point(36, 36), 0.3), Pedestrian(Point(41, 45), 0.), Pedestrian(Point(30, 38), 0.), ring,
+              Car(Point(47, 36), 1.), Car(Point(52, 48), 0.), Pedestrian(Point(60, 60), 0.)]
+    agents[2].category = PEDESTRIANS # shapes and categories do not go together
+    agents[4].category = CARS
+    agents[6].category = CARS | PEDESTRIANS
+    agents[7].category = BUILDINGS # in neither channel
+    for agent in agents:
+        w.add(agent)
+    agents[1].set_control(0.2, 3.)
+    grid = OccupancyGrid(w, height=40, width=48, resolution=0.6)
+    for t in range(15): # the parked agents fall asleep
+        if t % 7 == 0:
+            image = grid.render(ego)
+            c, s = np.cos(ego.heading), np.sin(ego.heading)
+            for channel, bit in ((OccupancyGrid.CARS, CARS), (OccupancyGrid.PEDESTRIANS, PEDESTRIANS)):
+                objs = [a.obj for a in agents[1:] if a.category & bit]
+                expected = np.zeros((grid.height, grid.width))
+                for i in range(grid.height):
+                    for j in range(grid.width):
+                        f, l = (grid.height / 2. - i - 0.5) * grid.resolution, (grid.width / 2. - j - 0.5) * grid.resolution # forward, left
+                        P = Point(ego.center.x + c * f - s * l, ego.center.y + s * f + c * l)
+                        expected[i, j] = any(obj.distanceTo(P) == 0 for obj in objs)
+                assert expected.sum() > 0
+                assert np.array_equal(image[..., channel], expected)
+        w.tick()
+    assert w.num_sleeping > 0
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from agents import Car
+from geometry import Point
+from road import Lane
+from traffic import IDMTraffic
+
+# Checks the IDM traffic in a World. Run with
+#	python -m pytest -q test_traffic.py
+
+
+def world(**kwargs):
+    try:
+        from world import World
+    except Exception: # the visualizer opens a Tk root when it is imported
+        pytest.skip('World needs a display')
+    return World(0.1, 220, 40, **kwargs)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_follower_stops_behind_stopped_leader(batched):
+    # A car coming at the desired speed brakes for a car stopped on its lane and stays at least min_gap behind it
+    w = world(batched=batched)
+    lane = Lane([Point(0, 20), Point(220, 20)])
+    traffic = IDMTraffic()
+    leader, follower = Car(Point(120, 20), 0.), Car(Point(10, 20), 0.)
+    follower.velocity = Point(traffic.desired_speed, 0.)
+    for car in (leader, follower):
+        w.add(car)
+        traffic.add(car, lane)
+    gaps = []
+    for _ in range(400):
+        traffic.update(w.dt)
+        leader.set_control(0., 0.) # overrides the controls IDM gave it
+        w.tick()
+        gaps.append(leader.center.x - follower.center.x - leader.rear_dist - follower.rear_dist)
+        assert leader.center.x == 120.
+    assert min(gaps) >= traffic.min_gap
+    assert gaps[-1] < traffic.min_gap + 1. and np.hypot(follower.velocity.x, follower.velocity.y) < 0.1 # and has come to a stop there
+    assert not w.collision_exists()
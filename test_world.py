@@ -0,0 +1,369 @@
+import numpy as np
+import pytest
+import warnings
+from agents import Car, RailCar, Pedestrian, RectangleBuilding, CircleBuilding, RingBuilding
+from collision import ShapeBatch, CIRCLE, entity_templates, times_of_impact
+from entities import PEDESTRIANS, BUILDINGS
+from geometry import Point
+from road import Lane
+try:
+    from world import World
+except Exception: # the visualizer opens a Tk root when it is imported
+    pytest.skip('World needs a display', allow_module_level=True)
+
+# Checks the collision queries of World (vectorized narrow phase, broad phases, batched dynamics, continuous collision,
+# sleeping) against brute force over every pair of agents with the per-object geometry. Run with
+#	python -m pytest -q test_world.py
+
+def mode_id(mode: dict) -> str:
+    return ','.join('%s=%s' % item for item in mode.items()) or 'default'
+
+
+MODES = [dict(), dict(broadphase='sap'), dict(batched=True), dict(continuous_collision=True),
+         dict(batched=True, continuous_collision=True), dict(sleep_ticks=0), dict(batched=True, sleep_ticks=0)]
+
+
+def random_world(seed: int, **kwargs) -> World:
+    # Moving and parked cars, pedestrians and buildings of every shape, crowded enough for plenty of contacts
+    rng = np.random.default_rng(seed)
+    w = World(0.1, 60, 60, sleep_ticks=kwargs.pop('sleep_ticks', 3), **kwargs)
+    for _ in range(8):
+        building = RectangleBuilding(Point(*rng.uniform(0, 60, 2)), Point(*rng.uniform(1, 6, 2)))
+        building.heading = rng.uniform(0, 2*np.pi)
+        w.add(building)
+    for _ in range(4):
+        w.add(CircleBuilding(Point(*rng.uniform(0, 60, 2)), rng.uniform(0.5, 3)))
+    for _ in range(2):
+        r = rng.uniform(2, 8)
+        w.add(RingBuilding(Point(*rng.uniform(0, 60, 2)), r, r + rng.uniform(0.5, 2)))
+    for k in range(40):
+        car = Car(Point(*rng.uniform(0, 60, 2)), rng.uniform(0, 2*np.pi))
+        if k % 3: car.set_control(rng.uniform(-0.3, 0.3), rng.uniform(0, 4)) # the others are parked
+        if k % 10 == 0: car.mask &= ~PEDESTRIANS # cars that do not see pedestrians
+        w.add(car)
+    for k in range(15):
+        pedestrian = Pedestrian(Point(*rng.uniform(0, 60, 2)), rng.uniform(0, 2*np.pi))
+        if k % 2: pedestrian.set_control(0, rng.uniform(0.2, 1.))
+        w.add(pedestrian)
+    return w
+
+
+def layers_overlap(a, b) -> bool:
+    return bool(a.category & b.mask) and bool(b.category & a.mask)
+
+
+def brute_contacts(w: World) -> set:
+    dynamic = [a for a in w.dynamic_agents if a.collidable]
+    static = [a for a in w.static_agents if a.collidable]
+    pairs = set()
+    for i, a in enumerate(dynamic):
+        for b in dynamic[i + 1:] + static:
+            if layers_overlap(a, b) and a.obj.intersectsWith(b.obj):
+                pairs.add(frozenset((id(a), id(b))))
+    return pairs
+
+
+def brute_nearby(w: World, boxes: np.ndarray) -> set:
+    result = set()
+    for q, box in enumerate(boxes):
+        for a in w.agents:
+            A = a.obj.aabb
+            if a.collidable and A[0] <= box[2] and box[0] <= A[2] and A[1] <= box[3] and box[1] <= A[3]:
+                result.add((q, id(a)))
+    return result
+
+
+def touching(kinds, templates, poses, velocities, I, J, T) -> np.ndarray:
+    # Whether agents I[k] and J[k] intersect once both have moved for T[k] seconds at constant velocity and heading
+    moved = lambda K: np.concatenate([poses[K, :2] + velocities[K] * T[:, None], poses[K, 2:]], axis=1)
+    A = ShapeBatch.from_poses(kinds[I], templates[I], moved(I))
+    B = ShapeBatch.from_poses(kinds[J], templates[J], moved(J))
+    return A.intersects(np.arange(len(I)), np.arange(len(I)), B)
+
+
+def check_time_to_collision(w: World, horizon: float):
+    # Against the agents stepped forward in time and tested with the narrow phase, and the closed form for two circles
+    I_found, J_found, T_found = w.time_to_collision_pairs(horizon)
+    found = {(i, j): t for i, j, t in zip(I_found.tolist(), J_found.tolist(), T_found)}
+    agents = w.dynamic_agents
+    kinds, templates, radii = entity_templates(agents)
+    poses = np.array([[a.center.x, a.center.y, a.heading] for a in agents]).reshape(-1, 3)
+    velocities = np.array([[a.velocity.x, a.velocity.y] for a in agents]).reshape(-1, 2)
+    I, J = np.triu_indices(len(agents), 1)
+    keep = np.array([agents[i].collidable and agents[j].collidable and layers_overlap(agents[i], agents[j]) for i, j in zip(I, J)], dtype=bool)
+    I, J = I[keep], J[keep]
+    # Pairs whose bounding circles come close enough within the horizon
+    dp, dv = poses[J, :2] - poses[I, :2], velocities[J] - velocities[I]
+    t = np.clip(-np.sum(dp * dv, axis=1) / np.maximum(np.sum(dv * dv, axis=1), 1e-12), 0, horizon)
+    near = np.linalg.norm(dp + dv * t[:, None], axis=1) <= radii[I] + radii[J]
+    I, J, dp, dv = I[near], J[near], dp[near], dv[near]
+    assert set(found) <= set(zip(I.tolist(), J.tolist()))
+
+    # First contact on a fine time grid, then by bisection between the last sample apart and the first one in contact
+    samples = np.linspace(0, horizon, 301)
+    hits = touching(kinds, templates, poses, velocities, np.repeat(I, len(samples)), np.repeat(J, len(samples)), np.tile(samples, len(I))).reshape(len(I), len(samples))
+    first = np.argmax(hits, axis=1)
+    lo, hi = samples[np.maximum(first - 1, 0)], samples[first]
+    for _ in range(30):
+        mid = (lo + hi) / 2.
+        inside = touching(kinds, templates, poses, velocities, I, J, mid)
+        lo, hi = np.where(inside, lo, mid), np.where(inside, mid, hi)
+    for k, (i, j) in enumerate(zip(I.tolist(), J.tolist())):
+        if not hits[k].any():
+            if (i, j) in found: # grazing between two samples
+                T = found[(i, j)] + np.linspace(-1e-6, 1e-3, 1001)
+                assert touching(kinds, templates, poses, velocities, np.full(len(T), i), np.full(len(T), j), T).any()
+            continue
+        assert (i, j) in found
+        expected = 0. if first[k] == 0 else hi[k]
+        if found[(i, j)] < expected - 1e-6: # an earlier graze between two samples
+            T = found[(i, j)] + np.linspace(-1e-6, 1e-3, 1001)
+            assert touching(kinds, templates, poses, velocities, np.full(len(T), i), np.full(len(T), j), T).any()
+        else:
+            assert found[(i, j)] == pytest.approx(expected, abs=1e-6)
+        if kinds[i] == kinds[j] == CIRCLE: # |dp + dv t| = r_i + r_j
+            r = templates[i, 0] + templates[j, 0]
+            a, b, c = np.dot(dv[k], dv[k]), np.dot(dp[k], dv[k]), np.dot(dp[k], dp[k]) - r * r
+            assert found[(i, j)] == pytest.approx(0. if c <= 0 else (-b - np.sqrt(b * b - a * c)) / a, abs=1e-9)
+
+
+def check_queries(w: World, impacts: bool = True):
+    expected = brute_contacts(w)
+    assert set(frozenset((id(c.agent), id(c.other))) for c in w.contacts()) == expected
+    colliding = set().union(*expected) if expected else set()
+    for a in w.dynamic_agents:
+        if w.continuous_collision:
+            assert id(a) not in colliding or w.collision_exists(a)
+        else:
+            assert w.collision_exists(a) == (id(a) in colliding)
+    if impacts and w.continuous_collision and w.t > 0: # whatever touches at the end of a tick touched during it
+        impacts = set(frozenset((id(i.agent), id(i.other))) for i in w.impacts)
+        assert expected <= impacts
+
+    boxes = np.array([[0, 0, 20, 20], [15, 25, 45, 30], [40, 40, 60, 60], [30, 0, 30.5, 60]], dtype=float)
+    found = set()
+    for Q, J, agents, shapes in w.nearby(boxes):
+        found |= set((int(q), id(agents[j])) for q, j in zip(Q, J))
+    assert found == brute_nearby(w, boxes)
+
+    check_time_to_collision(w, 3.)
+
+
+@pytest.mark.parametrize('mode', MODES, ids=mode_id)
+def test_queries_match_brute_force(mode):
+    for seed in range(3):
+        w = random_world(seed, **mode)
+        check_queries(w)
+        for _ in range(8):
+            w.tick()
+            check_queries(w)
+
+
+@pytest.mark.parametrize('mode', MODES, ids=mode_id)
+def test_collision_exists_after_edits(mode):
+    w = World(0.1, 50, 50, **mode)
+    w.add(RectangleBuilding(Point(25, 25), Point(4, 4)))
+    car, other = Car(Point(10, 10), 0.), Car(Point(40, 27), 0.)
+    w.add(car)
+    w.add(other)
+    for _ in range(12): w.tick() # long enough for them to fall asleep
+    # An agent that is not in the world is tested against the agents of the world
+    assert w.collision_exists(Car(Point(25, 25), 0.))
+    assert w.collision_exists(Car(Point(11, 11), 0.))
+    assert not w.collision_exists(Car(Point(25, 40), 0.))
+    assert not w.collision_exists()
+    # Agents moved, resized or put on other layers by hand, without a tick in between (and so without any impact)
+    car.center = Point(25, 27)
+    assert w.collision_exists() and w.collision_exists(car)
+    check_queries(w, impacts=False)
+    car.mask &= ~BUILDINGS
+    assert not w.collision_exists() and not w.collision_exists(car)
+    check_queries(w, impacts=False)
+    other.size = Point(30., 2.)
+    assert w.collision_exists(car) and w.collision_exists(other)
+    check_queries(w, impacts=False)
+
+
+@pytest.mark.parametrize('mode', MODES, ids=mode_id)
+def test_empty_world(mode):
+    w = World(0.1, 50, 50, **mode)
+    w.add(RectangleBuilding(Point(25, 25), Point(4, 4)))
+    for _ in range(2):
+        assert not w.collision_exists()
+        assert w.contacts() == []
+        assert all(len(Q) == 0 for Q, _, _, _ in w.nearby(np.array([[0., 0., 50., 50.]]), static=False))
+        assert len(w.time_to_collision_pairs()[0]) == 0
+        w.tick()
+
+
+def state(w: World):
+    return np.array([[a.center.x, a.center.y, a.heading, a.velocity.x, a.velocity.y] for a in w.dynamic_agents])
+
+
+def test_batched_matches_per_entity():
+    reference, w = random_world(0), random_world(0, batched=True)
+    for _ in range(20):
+        reference.tick()
+        w.tick()
+    assert np.allclose(state(w), state(reference), atol=1e-9)
+    assert [reference.collision_exists(a) for a in reference.dynamic_agents] == [w.collision_exists(a) for a in w.dynamic_agents]
+
+
+def test_batched_resize():
+    # Agents that change size: the batched shapes and dynamics must follow, like the per-entity ones
+    worlds = [random_world(2, sleep_ticks=0), random_world(2, sleep_ticks=0, batched=True)]
+    for t in range(20):
+        if t == 5:
+            for x in worlds:
+                x.dynamic_agents[1].size = Point(12., 5.)
+                x.dynamic_agents[-1].radius = 3.
+        for x in worlds: x.tick()
+        reference, w = worlds
+        assert np.allclose(state(w), state(reference), atol=1e-9)
+        assert [reference.collision_exists(a) for a in reference.dynamic_agents] == [w.collision_exists(a) for a in w.dynamic_agents]
+        check_queries(w)
+
+
+@pytest.mark.parametrize('mode', [dict(), dict(batched=True), dict(continuous_collision=True)], ids=mode_id)
+def test_snapshot_round_trip(mode):
+    # After a restore, the world goes through exactly the same states again, and nothing cached before it is used
+    w = random_world(0, **mode)
+    w.add(RailCar(Lane.circle(Point(30, 30), 20.), s=5., speed=4.))
+    for _ in range(10): w.tick()
+    assert np.any(w._sleeping) and w.contacts()
+    snapshot, before = w.snapshot(), state(w)
+    trajectory = []
+    for _ in range(15):
+        w.tick()
+        trajectory.append((state(w), sorted((id(c.agent), id(c.other)) for c in w.contacts()), w.t))
+    for _ in range(2):
+        w.restore(snapshot)
+        assert np.array_equal(state(w), before) and w.t == snapshot.t
+        assert not np.any(w._sleeping) and w._sleeping_shapes is None
+        assert w._contacts is None and w._dynamic_shapes is None and w._centers is None and w.impacts == []
+        check_queries(w, impacts=False)
+        for expected_state, expected_contacts, t in trajectory:
+            w.tick()
+            assert np.array_equal(state(w), expected_state) and w.t == t
+            assert sorted((id(c.agent), id(c.other)) for c in w.contacts()) == expected_contacts
+        check_queries(w)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_fork(batched):
+    # A fork goes on like the world it was forked from would, and leaves that world as it was
+    reference, w = random_world(0, batched=batched), random_world(0, batched=batched)
+    for _ in range(10):
+        reference.tick()
+        w.tick()
+    before = state(w)
+    child = w.fork()
+    child.own(child.dynamic_agents[2]).set_control(0.2, 3.)
+    reference.dynamic_agents[2].set_control(0.2, 3.)
+    for _ in range(10):
+        reference.tick()
+        child.tick()
+        assert np.array_equal(state(child), state(reference))
+        check_queries(child)
+    assert np.array_equal(state(w), before)
+    check_queries(w)
+
+
+@pytest.mark.parametrize('mode', [dict(), dict(batched=True), dict(continuous_collision=True)], ids=mode_id)
+def test_sleeping_matches_awake(mode):
+    reference, w = random_world(1, sleep_ticks=0, **mode), random_world(1, **mode)
+    for t in range(30):
+        if t == 12: # wake a parked car up through its controls and another one by moving it
+            for x in (reference, w):
+                x.dynamic_agents[0].set_control(0.1, 2.)
+                x.dynamic_agents[3].center = Point(30, 30)
+        reference.tick()
+        w.tick()
+        assert np.array_equal(state(w), state(reference))
+        assert [reference.collision_exists(a) for a in reference.dynamic_agents] == [w.collision_exists(a) for a in w.dynamic_agents]
+        check_queries(w)
+    assert w.sleep_count > 0 and w.wake_count > 0
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_all_asleep(batched):
+    # Every car falls asleep before the first query, so no agent is ever in the dynamic broad phase
+    worlds = []
+    for sleep_ticks in (0, 10):
+        w = World(0.1, 50, 50, batched=batched, sleep_ticks=sleep_ticks)
+        w.add(RectangleBuilding(Point(20, 20), Point(4, 4)))
+        for x, y in ((10, 10), (12, 10), (20, 22)): # two parked cars that touch, and one in the building
+            w.add(Car(Point(x, y), 0.))
+        for _ in range(11): w.tick()
+        worlds.append(w)
+    reference, w = worlds
+    assert w.num_sleeping == 3
+    assert w.collision_exists() and reference.collision_exists()
+    assert [reference.collision_exists(a) for a in reference.dynamic_agents] == [w.collision_exists(a) for a in w.dynamic_agents]
+    check_queries(w)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_sleeping_agents_changed_by_hand(batched):
+    # Sleeping agents resized or put on other layers, and agents taken out of dynamic_agents or put back in another order
+    reference, w = random_world(1, sleep_ticks=0, batched=batched), random_world(1, batched=batched)
+    for t in range(30):
+        if t == 12:
+            assert w.num_sleeping > 0
+            asleep = [k for k, a in enumerate(w.dynamic_agents) if a in w._sleeping_agents]
+            for x in (reference, w):
+                x.dynamic_agents[asleep[0]].size = Point(20., 6.)
+                x.dynamic_agents[asleep[1]].mask = 0
+        if t == 18 and not batched: # the batched agents are attached to their batch, they must be added and removed through the world
+            for x in (reference, w):
+                x.dynamic_agents.reverse()
+                del x.dynamic_agents[5]
+        reference.tick()
+        w.tick()
+        assert np.array_equal(state(w), state(reference))
+        assert [reference.collision_exists(a) for a in reference.dynamic_agents] == [w.collision_exists(a) for a in w.dynamic_agents]
+        check_queries(w)
+
+
+def test_continuous_collision_of_resting_agents():
+    # Agents that touch without moving: the conservative advancement must not divide 0 by 0
+    w = World(0.1, 50, 50, continuous_collision=True, sleep_ticks=0)
+    w.add(RectangleBuilding(Point(20, 20), Point(4, 4)))
+    for x, y in ((10, 10), (12, 10), (20, 22)):
+        w.add(Car(Point(x, y), 0.))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for _ in range(3): w.tick()
+    assert len(w.impacts) == 2 and all(i.time == w.t - w.dt for i in w.impacts)
+
+
+@pytest.mark.parametrize('steering', [0., 0.02])
+def test_continuous_collision_through_thin_wall(steering):
+    # A car that crosses a 10 cm wall within one tick, straight or spinning
+    w = World(0.1, 80, 80, continuous_collision=True)
+    wall = RectangleBuilding(Point(40, 40), Point(0.1, 30))
+    w.add(wall)
+    car = Car(Point(30, 40), 0.)
+    car.velocity = Point(200., 0.)
+    car.set_control(steering, 0.)
+    w.add(car)
+    w.tick()
+    assert car.center.x > 41 and not car.obj.intersectsWith(wall.obj) # past the wall at the end of the tick
+    assert [(i.agent, i.other) for i in w.impacts] == [(car, wall)]
+    assert 0 <= w.impacts[0].time <= w.dt
+    assert w.collision_exists(car)
+
+
+def test_times_of_impact_iteration_cap():
+    # Without enough iterations to converge, the pairs are reported at the last fraction known to be safe, not let through
+    kinds, templates, radii = entity_templates([Car(Point(0, 0), 0.), RectangleBuilding(Point(10, 0), Point(0.1, 30))])
+    poses0 = np.array([[0., 0., 0.], [10., 0., 0.]])
+    poses1 = np.array([[20., 0., 3.], [10., 0., 0.]])
+    I, J = np.array([0]), np.array([1])
+    exact = times_of_impact(kinds, templates, radii, poses0, poses1, I, J)
+    assert 0 < exact[0] < 1
+    for max_iterations in (1, 2, 4):
+        capped = times_of_impact(kinds, templates, radii, poses0, poses1, I, J, max_iterations=max_iterations)
+        assert 0 <= capped[0] <= exact[0]
+    poses0[1, 1] = poses1[1, 1] = 100. # a pair that stays far apart is still not reported
+    assert np.isinf(times_of_impact(kinds, templates, radii, poses0, poses1, I, J, max_iterations=1)[0])
@@ -0,0 +1,110 @@
+import numpy as np
+import dynamics
+from entities import Entity
+from road import Lane, LaneSet
+
+# Background traffic driven by the Intelligent Driver Model (Treiber, Hennecke and Helbing, "Congested traffic states in
+# empirical observations and microscopic simulations"). Every NPC car follows its lane: IDM gives its acceleration from
+# the gap to the car ahead on the same lane, and pure pursuit its steering. Both are turned into set_control inputs, the
+# cars are then moved by the usual kinematic bicycle model in World.tick.
+
+
+class IDMTraffic:
+    def __init__(self, desired_speed: float = 13.9, time_headway: float = 1.5, min_gap: float = 2., max_acceleration: float = 1.5,
+                 comfortable_deceleration: float = 2., max_deceleration: float = 9., delta: float = 4., lookahead_time: float = 0.8,
+                 min_lookahead: float = 4.):
+        self.desired_speed = desired_speed # v0, m/s
+        self.time_headway = time_headway # T, s
+        self.min_gap = min_gap # s0, bumper to bumper, m
+        self.max_acceleration = max_acceleration # a, m/s^2
+        self.comfortable_deceleration = comfortable_deceleration # b, m/s^2
+        self.max_deceleration = max_deceleration # the commands are clipped to it
+        self.delta = delta
+        self.lookahead_time = lookahead_time # pure pursuit aims at the point of the lane this far ahead in time...
+        self.min_lookahead = min_lookahead # ...but at least this far, in meters
+        self.cars = []
+        self.tracks = LaneSet() # the lanes of the cars
+        self._lane_ids = np.zeros(0, dtype=int)
+        self._desired_speeds = np.zeros(0)
+        self._lengths = np.zeros(0)
+        self._rear_dists = np.zeros(0)
+        self._segments = None # segments of the lanes the cars were on at the last update, to project them again quickly
+        self._arrays = dynamics.EntityArrays(self.cars)
+
+    def __len__(self):
+        return len(self.cars)
+
+    def add(self, car: Entity, lane: Lane, desired_speed: float = None):
+        # The car will follow the lane, at up to desired_speed (or the default one)
+        self.cars.append(car)
+        self._lane_ids = np.append(self._lane_ids, self.tracks.index(lane))
+        self._desired_speeds = np.append(self._desired_speeds, self.desired_speed if desired_speed is None else desired_speed)
+        self._lengths = np.append(self._lengths, 2 * car.rear_dist)
+        self._rear_dists = np.append(self._rear_dists, car.rear_dist)
+        self._segments = None
+
+    def leaders(self, s: np.ndarray):
+        # For the arc lengths s of the cars on their lanes, the index of the car ahead of each one on the same lane (-1 if
+        # none) and the distance between their centers along the lane. Closed lanes wrap around.
+        n = len(s)
+        leader = np.full(n, -1, dtype=int)
+        distance = np.full(n, np.inf)
+        if n == 0: return leader, distance
+        order = np.lexsort((np.arange(n), s, self._lane_ids))
+        lanes = self._lane_ids[order]
+        first = np.concatenate([[True], lanes[1:] != lanes[:-1]])
+        last = np.concatenate([lanes[1:] != lanes[:-1], [True]])
+        following = np.roll(order, -1) # the next car in sorted order...
+        group_start = order[np.maximum.accumulate(np.where(first, np.arange(n), 0))]
+        following[last] = group_start[last] # ...or, for the last car of a lane, the first car of that lane
+        length = self.tracks.lengths[lanes]
+        closed = self.tracks.closed[lanes]
+        ahead = s[following] - s[order] + np.where(last, length, 0.)
+        valid = (~last | closed) & (following != order) # the last car of an open lane (or the only car of a lane) leads
+        leader[order[valid]] = following[valid]
+        distance[order[valid]] = ahead[valid]
+        return leader, distance
+
+    def accelerations(self, speed: np.ndarray, gap: np.ndarray, leader_speed: np.ndarray) -> np.ndarray:
+        # IDM acceleration for the given speeds, bumper to bumper gaps (inf if free road) and speeds of the leaders
+        a, b = self.max_acceleration, self.comfortable_deceleration
+        desired_gap = self.min_gap + np.maximum(0., speed * self.time_headway + speed * (speed - leader_speed) / (2 * np.sqrt(a * b)))
+        free_road = 1 - (speed / self._desired_speeds) ** self.delta
+        interaction = np.where(np.isfinite(gap), (desired_gap / np.maximum(gap, 0.1)) ** 2, 0.)
+        return np.clip(a * (free_road - interaction), -self.max_deceleration, a)
+
+    def update(self, dt: float = None):
+        # Computes the controls of all the cars from their current state. Call it before every World.tick. Given the dt of
+        # that tick, the cars also brake hard enough not to end it closer than min_gap to where their leaders are now.
+        if not self.cars: return
+        state = self._arrays.state()
+        P, heading, speed, friction = state[:, :2], state[:, 2], np.hypot(state[:, 3], state[:, 4]), state[:, 5]
+
+        # Frenet projection, near the segments of the last update, and lookahead points
+        s, _, self._segments = self.tracks.project(self._lane_ids, P, self._segments)
+        lookahead = np.maximum(self.min_lookahead, self.lookahead_time * speed)
+        targets = self.tracks.position(self._lane_ids, s + lookahead)[0]
+
+        leader, distance = self.leaders(s)
+        has_leader = leader >= 0
+        gap = np.where(has_leader, distance - (self._lengths + self._lengths[np.maximum(leader, 0)]) / 2., np.inf)
+        leader_speed = np.where(has_leader, speed[np.maximum(leader, 0)], speed)
+        # The end of an open lane is a standing obstacle for the car that leads on it
+        length = self.tracks.lengths[self._lane_ids]
+        at_end = ~has_leader & ~self.tracks.closed[self._lane_ids]
+        gap[at_end] = length[at_end] - s[at_end] - self._lengths[at_end] / 2.
+        leader_speed[at_end] = 0.
+        acceleration = self.accelerations(speed, gap, leader_speed)
+        if dt is not None:
+            # IDM only keeps min_gap in continuous time. Over a tick the car travels (speed + new speed) * dt / 2: the new
+            # speed is capped so that it can still stop within the gap at the next tick, i.e. new speed * dt / 2 further
+            stop = ((gap - self.min_gap) / dt - 1.5 * speed) / dt
+            acceleration = np.maximum(np.minimum(acceleration, stop), -self.max_deceleration)
+
+        # Pure pursuit: the arc through the target has curvature 2 sin(alpha) / L
+        to_target = targets - P
+        alpha = np.arctan2(to_target[:, 1], to_target[:, 0]) - heading
+        curvature = 2 * np.sin(alpha) / np.maximum(np.hypot(to_target[:, 0], to_target[:, 1]), 1e-6)
+        steering = dynamics.steering_for_curvature(curvature, self._rear_dists)
+
+        self._arrays.set_controls(steering, acceleration + friction) # Entity.tick applies inputAcceleration - friction
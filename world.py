@@ -1,26 +1,357 @@
-from agents import Car, Pedestrian, RectangleBuilding
+import numpy as np
+import copy
+from collections import namedtuple
+from agents import Car, Pedestrian, RectangleBuilding, RailCar
+from broadphase import SpatialHash, SweepAndPrune, BVH, layers_overlap
+from collision import ShapeBatch, entity_templates, times_of_impact
+import dynamics
+from dynamics import BatchedDynamics, RailDynamics
 from entities import Entity
+from sdf import SignedDistanceField
 from typing import Union
 from visualizer import Visualizer
 
+# An impact found by continuous collision detection: agent touched other at the given simulation time
+Impact = namedtuple('Impact', ['agent', 'other', 'time'])
+
+# A pair of agents that currently intersect, see World.contacts
+Contact = namedtuple('Contact', ['agent', 'other', 'agent_type', 'other_type', 'penetration'])
+
+# The dynamic state of a World, see World.snapshot. state is a (dynamics.STATE_FIELDS, N) array, one column per agent
+# that does not follow a lane, and rails the state of the RailDynamics of the World.
+Snapshot = namedtuple('Snapshot', ['t', 'version', 'agents', 'state', 'rails'])
+
 class World:
-    def __init__(self, dt: float, width: float, height: float, ppm: float = 8):
+    def __init__(self, dt: float, width: float, height: float, ppm: float = 8, cell_size: float = 10., continuous_collision: bool = False, broadphase: str = 'grid', batched: bool = False, sleep_ticks: int = 10):
         self.dynamic_agents = []
         self.static_agents = []
         self.t = 0 # simulation time
         self.dt = dt # simulation time step
+        self.width = width
+        self.height = height
         self.visualizer = Visualizer(width, height, ppm=ppm)
+        # Broad phase over the dynamic agents: 'grid' is a spatial hash with cells of cell_size meters, 'sap' is a
+        # sweep-and-prune that is updated incrementally and works best for dense traffic that moves little at each tick
+        self.cell_size = cell_size
+        if broadphase == 'grid':
+            self.broadphase = SpatialHash(cell_size)
+        elif broadphase == 'sap':
+            self.broadphase = SweepAndPrune()
+        else:
+            raise NotImplementedError
+        self._dynamic_physics_agents = []
+        self._dynamic_layers = np.zeros((0, 2), dtype=np.int64)
+        self.static_bvh = BVH() # over the static agents, they never move so it is only rebuilt when they change
+        self._dynamic_shapes = None # packed geometry of the collidable dynamic agents, rebuilt lazily after every tick
+        self._dynamic_templates = entity_templates([])[:2] # kinds and templates of the collidable dynamic agents, if batched
+        self._static_shapes = None # packed geometry of the collidable static agents
+        self.sdf = None # signed distance field of the collidable static agents, see bake_sdf
+        self.static_version = 0 # changes whenever the static agents change, so that caches built on them can tell
+        self.dynamic_version = 0 # changes whenever the list of dynamic agents changes
+        self.continuous_collision = continuous_collision # if True, tick() also checks the motion between the poses
+        self.impacts = [] # the Impacts found during the last tick, only in continuous_collision mode
+        self._contacts = None # cached result of contacts(), dropped at every tick
+        self._members = None # the agents of the world, built on demand by collision_exists
+        self._edits = Entity.edits # the caches are dropped when agents are changed by hand, see _check_edits
+        self.center_index = SpatialHash(cell_size) # over the centers of all dynamic agents, for nearest()
+        self._centers = None # (N, 2) centers of the dynamic agents, rebuilt lazily after every tick
+        self.dynamics = BatchedDynamics() if batched else None # if set, the dynamic agents are views on its arrays and tick together
+        self.rails = RailDynamics() # moves the RailCars along their lanes, batched or not
+        self._owned = None # in a fork, the dynamic agents that are not shared with the parent world, see fork()
+        self._copies = None # in a fork, the agents of the ancestor worlds -> their copies in this world
+        # Sleeping: the dynamic agents (except the RailCars) that have been at rest for sleep_ticks ticks in a row are not
+        # integrated anymore, and are treated like static agents by the collision structures, until they would move again
+        # (e.g. after set_control), are moved, or an awake agent touches them. sleep_ticks = 0 turns it off.
+        self.sleep_ticks = sleep_ticks
+        self.sleep_count = 0 # number of times an agent fell asleep, for profiling
+        self.wake_count = 0 # number of times an agent woke up
+        self._rest_ticks = np.zeros(0, dtype=int) # these three are aligned with _free_agents(), see _align_sleep
+        self._sleeping = np.zeros(0, dtype=bool)
+        self._sleep_poses = np.zeros((0, 3)) # [x, y, heading] of the agents when they fell asleep
+        self._sleeping_agents = set()
+        self._sleep_agents = [] # the free agents, in the order of the arrays above
+        self.sleeping_bvh = BVH() # over the sleeping collidable agents, rebuilt when they change
+        self._sleeping_shapes = None
         
     def add(self, entity: Entity):
         if entity.movable:
             self.dynamic_agents.append(entity)
+            self.dynamic_version += 1
+            if self._owned is not None:
+                self._owned.add(entity)
+            if isinstance(entity, RailCar):
+                self.rails.attach(entity)
+            else:
+                if self.dynamics is not None:
+                    self.dynamics.attach(entity)
+                self._rest_ticks = np.append(self._rest_ticks, 0)
+                self._sleeping = np.append(self._sleeping, False)
+                self._sleep_poses = np.concatenate([self._sleep_poses, np.zeros((1, 3))])
+                self._sleep_agents.append(entity)
+            self._dynamic_shapes = None
+            self._contacts = None
+            self._centers = None
         else:
             self.static_agents.append(entity)
+            self.static_version += 1
+            self._static_shapes = None
+            self._contacts = None
+            self.sdf = None
         
     def tick(self):
-        for agent in self.dynamic_agents:
-            agent.tick(self.dt)
+        self._check_edits()
+        if self.sleep_ticks > 0:
+            self._update_sleep()
+        sleeping = self._sleeping_agents
+        if self.continuous_collision:
+            previous_poses = np.array([[a.center.x, a.center.y, a.heading] for a in self.dynamic_agents if a.collidable and a not in sleeping]).reshape(-1, 3)
+        if self.dynamics is not None:
+            self.dynamics.tick(self.dt, np.nonzero(~self._sleeping)[0] if sleeping else None)
+        elif self._owned is not None:
+            for i, agent in enumerate(self.dynamic_agents):
+                if agent._batch is not None or agent in sleeping: continue
+                if agent not in self._owned:
+                    if agent._at_rest(self.dt): continue # nothing changes, it can stay shared
+                    agent = self._copy_agent(i)
+                agent.tick(self.dt)
+        else:
+            for agent in self.dynamic_agents:
+                if agent._batch is None and agent not in sleeping: agent.tick(self.dt)
+        if len(self.rails) > 0:
+            self.rails.tick(self.dt)
         self.t += self.dt
+        self._dynamic_shapes = None
+        self._contacts = None
+        self._centers = None
+        self._edits = Entity.edits # the agents moved by this tick are packed again anyway
+        if self.continuous_collision:
+            self.impacts = self._swept_collisions(previous_poses)
+            
+    def _check_edits(self):
+        # Agents moved, resized or put on other layers by hand since the caches were built: the dynamic and sleeping ones
+        # are packed again, and the broad phase is built from scratch. The static agents are assumed not to change.
+        if Entity.edits != self._edits:
+            self._edits = Entity.edits
+            self._dynamic_shapes = None
+            self._dynamic_physics_agents = []
+            self._sleeping_shapes = None
+            self._contacts = None
+            self._centers = None
+            
+    def _update_sleep(self):
+        # Puts to sleep the agents that have been at rest long enough, and wakes the sleeping ones that would move or were moved
+        agents = self._free_agents()
+        if self.dynamics is not None:
+            # Same test as Entity._at_rest, for the whole batch
+            state = self.dynamics.state[:, :len(agents)]
+            acceleration = state[dynamics.THROTTLE] - state[dynamics.FRICTION]
+            rest = ((state[dynamics.VX] == 0) & (state[dynamics.VY] == 0) & (state[dynamics.ACCELERATION] == acceleration)
+                    & (state[dynamics.ANGULAR_VELOCITY] == 0) & (state[dynamics.HEADING] >= 0) & (state[dynamics.HEADING] < 2*np.pi)
+                    & (np.minimum(np.maximum(acceleration * self.dt, state[dynamics.MIN_SPEED]), state[dynamics.MAX_SPEED]) == 0))
+        else:
+            rest = np.array([a._at_rest(self.dt) for a in agents], dtype=bool)
+        sleeping = np.nonzero(self._sleeping)[0]
+        rest[sleeping] &= np.all(self._poses(agents, sleeping) == self._sleep_poses[sleeping], axis=1) # or they were moved
+        self._rest_ticks = np.where(rest, self._rest_ticks + 1, 0)
+        wake = np.nonzero(self._sleeping & ~rest)[0]
+        sleep = np.nonzero(~self._sleeping & (self._rest_ticks >= self.sleep_ticks))[0]
+        if len(wake) > 0 or len(sleep) > 0:
+            self._sleeping[wake] = False
+            self._sleeping[sleep] = True
+            self._sleep_poses[sleep] = self._poses(agents, sleep)
+            self.wake_count += len(wake)
+            self.sleep_count += len(sleep)
+            self._sleeping_agents.difference_update(agents[i] for i in wake)
+            self._sleeping_agents.update(agents[i] for i in sleep)
+            self._sleeping_shapes = None
+            
+    def _poses(self, agents: list, rows: np.ndarray) -> np.ndarray:
+        # (N, 3) [x, y, heading] of the given free agents
+        if self.dynamics is not None:
+            return self.dynamics.state[[dynamics.X, dynamics.Y, dynamics.HEADING]][:, rows].T
+        return np.array([[agents[i]._center.x, agents[i]._center.y, agents[i]._heading] for i in rows]).reshape(-1, 3)
+            
+    def _wake(self, agents: list = None):
+        # Wakes the given sleeping agents (all of them by default) up right away
+        if agents is None:
+            rows = np.nonzero(self._sleeping)[0]
+            self._sleeping_agents = set()
+        else:
+            index = {id(a): i for i, a in enumerate(self._free_agents())}
+            rows = [index[id(a)] for a in agents]
+            self._sleeping_agents.difference_update(agents)
+        if len(rows) == 0: return
+        self._sleeping[rows] = False
+        self._rest_ticks[rows] = 0
+        self.wake_count += len(rows)
+        self._sleeping_shapes = None
+        self._dynamic_shapes = None
+        
+    @property
+    def num_sleeping(self) -> int:
+        return len(self._sleeping_agents)
+        
+    def _swept_collisions(self, previous_poses: np.ndarray) -> list:
+        # Finds the first time of impact of every pair of agents that touched while moving from previous_poses to their current poses
+        self._update_broadphase()
+        dynamic = self._dynamic_physics_agents
+        static = self._sleeping_physics_agents + self._static_physics_agents # the sleeping agents did not move either
+        entities = dynamic + static
+        kinds, templates, radii = entity_templates(entities)
+        poses = np.array([[a.center.x, a.center.y, a.heading] for a in entities]).reshape(-1, 3)
+        poses0 = poses.copy()
+        poses0[:len(dynamic)] = previous_poses
+        
+        # Broad phase on the swept volumes: each agent stays within its bounding radius of the segment between its centers
+        lo = np.minimum(poses0[:len(dynamic), :2], poses[:len(dynamic), :2]) - radii[:len(dynamic), None]
+        hi = np.maximum(poses0[:len(dynamic), :2], poses[:len(dynamic), :2]) + radii[:len(dynamic), None]
+        swept = np.concatenate([lo, hi], axis=1)
+        grid = SpatialHash(self.cell_size)
+        grid.build(swept)
+        I_dynamic, J_dynamic = grid.pairs()
+        I_sleeping, J_sleeping = self.sleeping_bvh.query(swept)
+        I_static, J_static = self.static_bvh.query(swept)
+        I = np.concatenate([I_dynamic, I_sleeping, I_static])
+        J = np.concatenate([J_dynamic, J_sleeping + len(dynamic), J_static + len(dynamic) + len(self._sleeping_physics_agents)])
+        layers = np.concatenate([self._dynamic_layers, self._sleeping_layers, self._static_layers])
+        keep = layers_overlap(layers[I], layers[J])
+        I, J = I[keep], J[keep]
+        
+        toi = times_of_impact(kinds, templates, radii, poses0, poses, I, J)
+        hit = np.isfinite(toi)
+        impacts = [Impact(entities[i], entities[j], float(self.t - self.dt + t * self.dt)) for i, j, t in zip(I[hit], J[hit], toi[hit])]
+        # The sleeping agents that intersect each other or static agents touch them from the start of the tick
+        return impacts + [Impact(c.agent, c.other, float(self.t - self.dt)) for c in self._sleeping_contacts]
+    
+    def snapshot(self) -> Snapshot:
+        # Copies the time and the state of the dynamic agents (pose, velocity, controls, limits) into arrays, so that
+        # restore() can bring them back. The static agents and the attributes of the agents that never change are not copied.
+        agents = self._free_agents()
+        if self.dynamics is not None:
+            state = self.dynamics.state[:dynamics.STATE_FIELDS, :len(agents)].copy()
+        else:
+            state = np.array([dynamics.entity_state(a) for a in agents]).reshape(-1, dynamics.STATE_FIELDS).T
+        rails = self.rails.state[:, :len(self.rails)].copy()
+        return Snapshot(self.t, self.dynamic_version, tuple(agents + self.rails.entities), state, rails)
+        
+    def restore(self, snapshot: Snapshot):
+        # Puts the dynamic agents back in the state they had when the snapshot was taken. They must be the same agents.
+        if snapshot.version != self.dynamic_version:
+            agents = self._free_agents() + self.rails.entities
+            if len(agents) != len(snapshot.agents) or any(a is not b for a, b in zip(agents, snapshot.agents)):
+                raise ValueError('The dynamic agents have changed since the snapshot was taken')
+        if self._owned is not None:
+            for i, agent in enumerate(self.dynamic_agents):
+                if agent not in self._owned: self._copy_agent(i)
+        agents = self._free_agents()
+        self.rails.state[:, :len(self.rails)] = snapshot.rails
+        self.rails.step += 1
+        if self.dynamics is not None:
+            self.dynamics.state[:dynamics.STATE_FIELDS, :len(agents)] = snapshot.state
+            self.dynamics.step += 1 # the geometry of every agent is out of date
+        else:
+            for agent, state in zip(agents, snapshot.state.T.tolist()):
+                dynamics.set_entity_state(agent, state)
+        self.t = snapshot.t
+        self._wake() # they may have been moved, the next ticks put them back to sleep
+        self._dynamic_shapes = None
+        self._contacts = None
+        self._centers = None
+        self.impacts = []
+        
+    def _free_agents(self) -> list:
+        # The dynamic agents that are not RailCars
+        if self.dynamics is not None: return self.dynamics.entities
+        agents = [a for a in self.dynamic_agents if a._batch is None]
+        if len(agents) != len(self._sleep_agents) or any(a is not b for a, b in zip(agents, self._sleep_agents)):
+            self._align_sleep(agents)
+        return agents
+        
+    def _align_sleep(self, agents: list):
+        # dynamic_agents was changed by hand, or a fork copied some agents: the sleep state follows the agents (or the
+        # agents they are copies of) to their new rows, and the new agents start awake
+        originals = {id(clone): original for original, clone in self._copies.items()} if self._copies else {}
+        rows = {id(a): i for i, a in enumerate(self._sleep_agents)}
+        old = np.full(len(agents), -1, dtype=int)
+        for k, agent in enumerate(agents):
+            while id(agent) not in rows and id(agent) in originals:
+                agent = originals[id(agent)]
+            old[k] = rows.get(id(agent), -1)
+        # Row -1 is the state of a new agent
+        self._rest_ticks = np.append(self._rest_ticks, 0)[old]
+        self._sleeping = np.append(self._sleeping, False)[old]
+        self._sleep_poses = np.concatenate([self._sleep_poses, np.zeros((1, 3))])[old]
+        self._sleeping_agents = set(a for a, asleep in zip(agents, self._sleeping) if asleep)
+        self._sleep_agents = list(agents)
+        self._sleeping_shapes = None
+        self._dynamic_shapes = None
+    
+    def fork(self) -> 'World':
+        # A child world for lookahead, in the same state as this one. It shares the static agents and their collision
+        # structures with this world, and every dynamic agent until the child ticks it while it moves or asks for it
+        # through own(): only then is the agent copied (shallowly, its geometry is rebuilt lazily anyway).
+        # This world must not be ticked or changed while its forks are in use, they would see the changes.
+        # The agents of a batch (the RailCars, and every other dynamic agent in a batched world) move together at every
+        # tick anyway: they are copied right away along with the arrays of their batch.
+        self._update_broadphase() # so that the static structures are built once, here
+        child = copy.copy(self)
+        child._sleep_agents = list(self._sleep_agents)
+        child.dynamic_agents = list(self.dynamic_agents)
+        child.static_agents = list(self.static_agents)
+        child.broadphase = copy.copy(self.broadphase) # rebuilt from scratch by the child, see _dynamic_physics_agents
+        child.center_index = copy.copy(self.center_index)
+        child._dynamic_physics_agents = []
+        child._dynamic_shapes = None
+        child._contacts = None
+        child._centers = None
+        child.impacts = list(self.impacts)
+        child._owned = set()
+        child._copies = dict(self._copies) if self._copies is not None else {}
+        child._rest_ticks = self._rest_ticks.copy()
+        child._sleeping = self._sleeping.copy()
+        child._sleep_poses = self._sleep_poses.copy()
+        child._sleeping_agents = set(self._sleeping_agents)
+        child.rails = self.rails.clone() if len(self.rails) > 0 else RailDynamics()
+        child.dynamics = self.dynamics.clone() if self.dynamics is not None else None
+        rows = {id(a): i for i, a in enumerate(child.dynamic_agents)}
+        for batch, clones in [(self.rails, child.rails), (self.dynamics, child.dynamics)]:
+            if clones is None or len(clones) == 0: continue
+            for original, clone in zip(batch.entities, clones.entities):
+                child.dynamic_agents[rows[id(original)]] = clone
+                child._copies[original] = clone
+                child._owned.add(clone)
+                if original in child._sleeping_agents:
+                    child._sleeping_agents.remove(original)
+                    child._sleeping_agents.add(clone)
+                    child._sleeping_shapes = None
+        return child
+        
+    def own(self, agent: Entity) -> Entity:
+        # In a fork, this world's version of a dynamic agent of its own or of an ancestor world, that can be changed
+        # without affecting the ancestors. Anywhere else, the agent itself.
+        if self._owned is None: return agent
+        while agent in self._copies:
+            agent = self._copies[agent]
+        if agent in self._owned: return agent
+        clone = self._copy_agent(self.dynamic_agents.index(agent))
+        self._dynamic_shapes = None
+        self._contacts = None
+        self._centers = None
+        return clone
+        
+    def _copy_agent(self, i: int) -> Entity:
+        original = self.dynamic_agents[i]
+        clone = copy.copy(original)
+        self.dynamic_agents[i] = clone
+        self._copies[original] = clone
+        self._owned.add(clone)
+        if i < len(self._sleep_agents) and self._sleep_agents[i] is original:
+            self._sleep_agents[i] = clone # no need for _align_sleep
+        if original in self._sleeping_agents:
+            self._sleeping_agents.remove(original)
+            self._sleeping_agents.add(clone)
+            self._sleeping_shapes = None
+        return clone
     
     def render(self):
         self.visualizer.create_window(bg_color = 'gray')
@@ -30,32 +361,284 @@ class World:
     def agents(self):
         return self.static_agents + self.dynamic_agents
         
+    def _update_broadphase(self):
+        self._check_edits()
+        if self._static_shapes is None:
+            self._static_physics_agents = [a for a in self.static_agents if a.collidable]
+            self._static_shapes = ShapeBatch([a.obj for a in self._static_physics_agents])
+            self._static_layers = self._layers(self._static_physics_agents)
+            self.static_bvh = BVH(self.static_bvh.leaf_size) # a new tree, forks may still use the previous one
+            self.static_bvh.build(self._static_shapes.aabbs)
+            # Static agents that overlap each other. They never count for collision_exists(), only when asked about one of them
+            I, J = self.static_bvh.query(self._static_shapes.aabbs)
+            keep = (I < J) & layers_overlap(self._static_layers[I], self._static_layers[J])
+            I, J = I[keep], J[keep]
+            hit = self._static_shapes.intersects(I, J)
+            self._overlapping_static_agents = set(self._static_physics_agents[k] for k in np.concatenate([I[hit], J[hit]]))
+            self._sleeping_shapes = None # the contacts of the sleeping agents with the static ones have changed
+        if self._dynamic_shapes is None:
+            self._free_agents() # in case dynamic_agents was changed by hand
+        if self._sleeping_shapes is None:
+            self._update_sleeping_shapes()
+        if self._dynamic_shapes is None:
+            sleeping = self._sleeping_agents
+            physics_agents = [a for a in self.dynamic_agents if a.collidable and a not in sleeping]
+            same_agents = len(physics_agents) == len(self._dynamic_physics_agents) and all(a is b for a, b in zip(physics_agents, self._dynamic_physics_agents))
+            if self.dynamics is not None:
+                # Packed straight from the arrays of the batches, the agents do not need to rebuild their geometry
+                if not same_agents:
+                    self._dynamic_templates = entity_templates(physics_agents)[:2]
+                n = len(self.dynamics)
+                rows = [a._row if a._batch is self.dynamics else n + a._row for a in physics_agents]
+                poses = np.concatenate([self.dynamics.state[[dynamics.X, dynamics.Y, dynamics.HEADING], :n],
+                                        self.rails.state[[dynamics.X, dynamics.Y, dynamics.HEADING], :len(self.rails)]], axis=1)[:, rows].T
+                self._dynamic_shapes = ShapeBatch.from_poses(*self._dynamic_templates, poses)
+            else:
+                self._dynamic_shapes = ShapeBatch([a.obj for a in physics_agents])
+            if same_agents:
+                self.broadphase.update(self._dynamic_shapes.aabbs) # same agents as before, they have just moved
+            else:
+                self.broadphase.build(self._dynamic_shapes.aabbs)
+                self._dynamic_layers = self._layers(physics_agents)
+            self._dynamic_physics_agents = physics_agents
+            
+    def _update_sleeping_shapes(self):
+        # Packs the sleeping agents like the static ones. As they do not move, their contacts with each other and with
+        # the static agents are found here, once, and contacts() only has to look for awake agents touching them.
+        free_agents = self._free_agents()
+        rows = [i for i in np.nonzero(self._sleeping)[0] if free_agents[i].collidable]
+        agents = [free_agents[i] for i in rows]
+        if self.dynamics is not None:
+            poses = self.dynamics.state[[dynamics.X, dynamics.Y, dynamics.HEADING]][:, rows].T.reshape(-1, 3)
+            self._sleeping_shapes = ShapeBatch.from_poses(*entity_templates(agents)[:2], poses)
+        else:
+            self._sleeping_shapes = ShapeBatch([a.obj for a in agents])
+        self._sleeping_physics_agents = agents
+        self._sleeping_layers = self._layers(agents)
+        self.sleeping_bvh = BVH(self.sleeping_bvh.leaf_size) # a new tree, forks may still use the previous one
+        self.sleeping_bvh.build(self._sleeping_shapes.aabbs)
+        self._sleeping_contacts = []
+        for I, J, others, other_shapes, other_layers in [self.sleeping_bvh.query(self._sleeping_shapes.aabbs) + (agents, self._sleeping_shapes, self._sleeping_layers),
+                                                         self.static_bvh.query(self._sleeping_shapes.aabbs) + (self._static_physics_agents, self._static_shapes, self._static_layers)]:
+            keep = layers_overlap(self._sleeping_layers[I], other_layers[J]) & ((I < J) | (others is not agents))
+            I, J = I[keep], J[keep]
+            hit = self._sleeping_shapes.intersects(I, J, other_shapes)
+            I, J = I[hit], J[hit]
+            penetrations = self._sleeping_shapes.penetrations(I, J, other_shapes)
+            for i, j, penetration in zip(I, J, penetrations):
+                self._sleeping_contacts.append(Contact(agents[i], others[j], type(agents[i]), type(others[j]), float(penetration)))
+            if others is agents:
+                self._sleeping_pairs = (I, J)
+        
+    @staticmethod
+    def _layers(agents: list) -> np.ndarray:
+        # (N, 2) [category, mask] of the agents
+        return np.array([[a.category, a.mask] for a in agents], dtype=np.int64).reshape(-1, 2)
+        
+    def nearby(self, aabbs: np.ndarray, static: bool = True, dynamic: bool = True) -> list:
+        # Finds the collidable agents whose bounding boxes overlap the given (N, 4) boxes. Returns one (Q, J, agents, shapes)
+        # tuple for the static and/or two for the dynamic agents (awake and sleeping), where agents[J[k]] (packed in shapes)
+        # overlaps aabbs[Q[k]].
+        self._update_broadphase()
+        result = []
+        if static:
+            result.append(self.static_bvh.query(aabbs) + (self._static_physics_agents, self._static_shapes))
+        if dynamic:
+            result.append(self.broadphase.query(aabbs) + (self._dynamic_physics_agents, self._dynamic_shapes))
+            result.append(self.sleeping_bvh.query(aabbs) + (self._sleeping_physics_agents, self._sleeping_shapes))
+        return result
+        
+    def contacts(self) -> list:
+        # Every pair of collidable agents that intersect, as Contacts. The first agent of a pair is always dynamic.
+        # Computed once and reused until the next tick() or add(), or until an agent is changed by hand. The sleeping
+        # agents that awake agents touch wake up.
+        self._check_edits()
+        if self._contacts is None:
+            self._update_broadphase()
+            dynamic = self._dynamic_physics_agents
+            static = self._static_physics_agents
+            sleeping = self._sleeping_physics_agents
+            self._contacts = list(self._sleeping_contacts)
+            woken = set()
+            for I, J, others, other_shapes, other_layers in [self.broadphase.pairs() + (dynamic, self._dynamic_shapes, self._dynamic_layers),
+                                                             self.sleeping_bvh.query(self._dynamic_shapes.aabbs) + (sleeping, self._sleeping_shapes, self._sleeping_layers),
+                                                             self.static_bvh.query(self._dynamic_shapes.aabbs) + (static, self._static_shapes, self._static_layers)]:
+                keep = layers_overlap(self._dynamic_layers[I], other_layers[J]) # before any geometry
+                I, J = I[keep], J[keep]
+                hit = self._dynamic_shapes.intersects(I, J, other_shapes)
+                I, J = I[hit], J[hit]
+                penetrations = self._dynamic_shapes.penetrations(I, J, other_shapes)
+                for i, j, penetration in zip(I, J, penetrations):
+                    self._contacts.append(Contact(dynamic[i], others[j], type(dynamic[i]), type(others[j]), float(penetration)))
+                if others is sleeping:
+                    woken.update(sleeping[j] for j in J)
+            self._colliding_agents = set(c.agent for c in self._contacts) | set(c.other for c in self._contacts)
+            self._colliding_agents |= set(i.agent for i in self.impacts) | set(i.other for i in self.impacts)
+            self._members = None
+            if woken: self._wake(list(woken))
+        return self._contacts
+        
     def collision_exists(self, agent = None):
+        self.contacts()
         if agent is None:
-            for i in range(len(self.dynamic_agents)):
-                for j in range(i+1, len(self.dynamic_agents)):
-                    if self.dynamic_agents[i].collidable and self.dynamic_agents[j].collidable:
-                        if self.dynamic_agents[i].collidesWith(self.dynamic_agents[j]):
-                            return True
-                for j in range(len(self.static_agents)):
-                    if self.dynamic_agents[i].collidable and self.static_agents[j].collidable:
-                        if self.dynamic_agents[i].collidesWith(self.static_agents[j]):
-                            return True
-            return False
-            
+            return len(self._colliding_agents) > 0
         if not agent.collidable: return False
-        
-        for i in range(len(self.agents)):
-            if self.agents[i] is not agent and self.agents[i].collidable and agent.collidesWith(self.agents[i]):
-                return True
+        if agent in self._colliding_agents or agent in self._overlapping_static_agents: return True
+        if self._members is None:
+            self._members = set(self.dynamic_agents) | set(self.static_agents)
+        if agent in self._members: return False
+        # An agent that is not in the world, tested against every agent around it
+        shapes = ShapeBatch([agent.obj])
+        for Q, J, others, other_shapes in self.nearby(shapes.aabbs):
+            keep = layers_overlap(self._layers([agent])[Q], self._layers([others[j] for j in J]))
+            if np.any(shapes.intersects(Q[keep], J[keep], other_shapes)): return True
         return False
     
+    def nearest(self, agent: Entity, k: int, radius: float = None, types: Union[type, tuple] = None) -> list:
+        # The (up to) k dynamic agents closest to agent, center to center and nearest first, leaving agent itself out.
+        # Only agents within radius (if given) and that are instances of types (if given) are considered.
+        I, _ = self._nearest(np.array([[agent.center.x, agent.center.y]]), [agent], k, radius, types)
+        return [self.dynamic_agents[i] for i in I[0] if i >= 0]
+        
+    def nearest_batch(self, k: int, radius: float = None, types: Union[type, tuple] = None):
+        # Same as nearest for every dynamic agent at once. Returns (I, D), two (N, k) arrays over self.dynamic_agents holding
+        # the indices of the neighbours of each agent and their distances. Missing neighbours have index -1 and distance inf.
+        self._update_centers()
+        return self._nearest(self._centers, self.dynamic_agents, k, radius, types)
+        
+    def _update_centers(self):
+        self._check_edits()
+        if self._centers is None:
+            self._centers = np.array([[a.center.x, a.center.y] for a in self.dynamic_agents]).reshape(-1, 2)
+            self.center_index.update(np.concatenate([self._centers, self._centers], axis=1))
+            self._agent_rows = {id(a): i for i, a in enumerate(self.dynamic_agents)}
+            self._type_masks = {} # types -> which dynamic agents are instances of them
+            
+    def _nearest(self, points: np.ndarray, exclude: list, k: int, radius: float, types: Union[type, tuple]):
+        # k nearest centers to each of the points, except the agent exclude[q] for points[q]. Without a radius, the search
+        # starts at one cell and doubles its radius for the points that have not found k neighbours yet.
+        self._update_centers()
+        centers = self._centers
+        excluded = np.array([self._agent_rows.get(id(a), -1) for a in exclude], dtype=int)
+        if types not in self._type_masks:
+            self._type_masks[types] = np.array([types is None or isinstance(a, types) for a in self.dynamic_agents], dtype=bool)
+        allowed = self._type_masks[types]
+        I_out = np.full((len(points), k), -1, dtype=int)
+        D_out = np.full((len(points), k), np.inf)
+        if len(centers) == 0 or k <= 0: return I_out, D_out
+        everything = np.concatenate([centers, points])
+        max_radius = np.hypot(*(everything.max(axis=0) - everything.min(axis=0))) # beyond that, every center has been seen
+        r = radius if radius is not None else self.cell_size
+        todo = np.arange(len(points))
+        while len(todo) > 0:
+            P = points[todo]
+            Q, I = self.center_index.query(np.concatenate([P - r, P + r], axis=1))
+            keep = allowed[I] & (I != excluded[todo[Q]])
+            Q, I = Q[keep], I[keep]
+            D = np.linalg.norm(centers[I] - P[Q], axis=1)
+            Q, I, D = Q[D <= r], I[D <= r], D[D <= r] # only then are they sure to beat everything outside the search box
+            order = np.lexsort((D, Q))
+            Q, I, D = Q[order], I[order], D[order]
+            counts = np.bincount(Q, minlength=len(todo))
+            rank = np.arange(len(Q)) - (np.cumsum(counts) - counts)[Q]
+            done = (counts >= k) | (radius is not None) | (r >= max_radius)
+            fill = (rank < k) & done[Q]
+            I_out[todo[Q[fill]], rank[fill]] = I[fill]
+            D_out[todo[Q[fill]], rank[fill]] = D[fill]
+            todo = todo[~done]
+            r *= 2.
+        return I_out, D_out
+        
+    def time_to_collision_pairs(self, horizon: float = 5., radius: float = None):
+        # Time to collision between the collidable dynamic agents, if they all keep their current velocity and heading.
+        # Returns (I, J, T) with I < J, indices into self.dynamic_agents, for the pairs that collide within the horizon.
+        # Only pairs whose boxes, swept over the horizon, overlap are tested; radius also skips pairs whose centers are farther apart.
+        self._update_broadphase()
+        agents = self._dynamic_physics_agents
+        shapes = self._dynamic_shapes
+        velocities = np.array([[a.velocity.x, a.velocity.y] for a in agents]).reshape(-1, 2)
+        aabbs = shapes.aabbs
+        motion = np.tile(velocities * horizon, 2)
+        swept = np.concatenate([np.minimum(aabbs[:, :2], aabbs[:, :2] + motion[:, :2]), np.maximum(aabbs[:, 2:], aabbs[:, 2:] + motion[:, 2:])], axis=1)
+        grid = SpatialHash(self.cell_size)
+        grid.build(swept)
+        I, J = grid.pairs()
+        keep = layers_overlap(self._dynamic_layers[I], self._dynamic_layers[J])
+        I, J = I[keep], J[keep]
+        # The sleeping agents stand still: only the awake ones can run into them, and they collide with each other at 0
+        # if they already intersect
+        sleeping = self._sleeping_physics_agents
+        I_sleeping, J_sleeping = self.sleeping_bvh.query(swept)
+        keep = layers_overlap(self._dynamic_layers[I_sleeping], self._sleeping_layers[J_sleeping])
+        I_sleeping, J_sleeping = I_sleeping[keep], J_sleeping[keep]
+        I_asleep, J_asleep = self._sleeping_pairs
+        I_sleeping, J_sleeping = np.concatenate([I_sleeping, len(agents) + I_asleep]), np.concatenate([J_sleeping, J_asleep])
+        if radius is not None:
+            centers = np.array([[a.center.x, a.center.y] for a in agents + sleeping]).reshape(-1, 2)
+            near = np.sum((centers[I] - centers[J]) ** 2, axis=1) <= radius ** 2
+            I, J = I[near], J[near]
+            near = np.sum((centers[I_sleeping] - centers[len(agents) + J_sleeping]) ** 2, axis=1) <= radius ** 2
+            I_sleeping, J_sleeping = I_sleeping[near], J_sleeping[near]
+        awake = I_sleeping < len(agents)
+        T_sleeping = np.zeros(len(I_sleeping))
+        T_sleeping[awake] = shapes.times_to_collision(I_sleeping[awake], J_sleeping[awake], velocities, horizon, self._sleeping_shapes, np.zeros((len(sleeping), 2)))
+        T = np.concatenate([shapes.times_to_collision(I, J, velocities, horizon), T_sleeping])
+        I = np.concatenate([I, I_sleeping])
+        J = np.concatenate([J, len(agents) + J_sleeping])
+        hit = np.isfinite(T)
+        I, J = I[hit], J[hit]
+        if len(agents) + len(sleeping) != len(self.dynamic_agents) or sleeping: # map back to the indices of the agents
+            index = {id(a): k for k, a in enumerate(self.dynamic_agents)}
+            rows = np.array([index[id(a)] for a in agents + sleeping], dtype=int)
+            I, J = rows[I], rows[J]
+        return np.minimum(I, J), np.maximum(I, J), T[hit]
+        
+    def time_to_collision(self, horizon: float = 5., radius: float = None) -> np.ndarray:
+        # Same as time_to_collision_pairs, as a symmetric matrix over self.dynamic_agents with inf for the pairs that do not collide
+        I, J, T = self.time_to_collision_pairs(horizon, radius)
+        ttc = np.full((len(self.dynamic_agents), len(self.dynamic_agents)), np.inf)
+        ttc[I, J] = T
+        ttc[J, I] = T
+        return ttc
+        
+    def bake_sdf(self, resolution: float = 0.5, cache_path: str = None) -> SignedDistanceField:
+        # Samples the signed distance to the collidable static agents over the whole world.
+        # If cache_path is given, a field saved there for the same static agents and resolution is loaded (memory-mapped) instead.
+        objs = [a.obj for a in self.static_agents if a.collidable]
+        if cache_path is not None and SignedDistanceField.exists(cache_path):
+            sdf = SignedDistanceField.load(cache_path)
+            if sdf.resolution == resolution and sdf.fingerprint == SignedDistanceField.shapes_fingerprint(objs):
+                self.sdf = sdf
+                return sdf
+        self.sdf = SignedDistanceField.bake(objs, self.width, self.height, resolution)
+        if cache_path is not None:
+            self.sdf.save(cache_path)
+        return self.sdf
+        
     def close(self):
         self.reset()
         self.static_agents = []
+        self.static_version += 1
+        self._static_shapes = None
+        self._contacts = None
+        self.sdf = None
         if self.visualizer.window_created:
             self.visualizer.close()
         
     def reset(self):
+        if self.dynamics is not None:
+            self.dynamics.detach_all() # the agents keep their last state as plain attributes
+        self.rails.detach_all()
         self.dynamic_agents = []
-        self.t = 0
\ No newline at end of file
+        self.dynamic_version += 1
+        self._rest_ticks = np.zeros(0, dtype=int)
+        self._sleeping = np.zeros(0, dtype=bool)
+        self._sleep_poses = np.zeros((0, 3))
+        self._sleeping_agents = set()
+        self._sleep_agents = []
+        self._sleeping_shapes = None
+        self.t = 0
+        self._dynamic_shapes = None
+        self._contacts = None
+        self._centers = None
+        self.impacts = []